@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+from pathlib import Path
+from shutil import rmtree
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Callable, List, Optional, Sequence
+
+import cv2
+import numpy as np
+import torch
+
+from benchmarks.synthetic import generate_dataset, label_folder, parse_size
+from scripts import groups2video
+from scripts import preprocess
+from src.data.dataset import TUMTraf, collate_tumtraf
+from src.models.checkpoint import load_model
+from src.models.snn import SpikingDetector
+from src.utils.profiling import PeakMemoryMonitor
+
+STAGES = ["group_frames", "roi", "preprocess", "dataset_init", "dataset_getitem", "build_video", "forward"]
+FORMATS = ["jpg", "packed", "sparse"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Throughput, latency percentiles and peak RSS of the data and model hot paths, on a synthetic TUMTraf-shaped dataset")
+    parser.add_argument("--work-dir", type=str, default=None, help="Where the synthetic dataset and the preprocessed outputs go, a temporary folder (removed at the end) by default. The dataset is reused when it exists.")
+    parser.add_argument("--stages", type=str, default=",".join(STAGES), help="Comma-separated list of stages to run.")
+    parser.add_argument("--formats", type=str, default=",".join(FORMATS), help="Comma-separated preprocess formats to benchmark the preprocessing and the dataset on.")
+    parser.add_argument("--frames", type=int, default=128, help="Synthetic frames per camera.")
+    parser.add_argument("--rgb-size", type=str, default="1920x1200", help="Synthetic RGB frame size, WIDTHxHEIGHT.")
+    parser.add_argument("--eb-size", type=str, default="640x480", help="Synthetic EB frame size, WIDTHxHEIGHT.")
+    parser.add_argument("--n_frames", type=int, default=8, help="Frames per group of the preprocessing.")
+    parser.add_argument("--repeat", type=int, default=5, help="Calls of the stages that are cheap enough to be repeated.")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the preprocessing.")
+    parser.add_argument("--batch-size", type=int, default=4, help="Samples per forward pass.")
+    parser.add_argument("--snn-path", type=str, default=None, help="SNN checkpoint for the forward stage, an untrained SpikingDetector by default.")
+    parser.add_argument("--ann-path", type=str, default=None, help="ANN checkpoint for the forward stage on the RGB frames, skipped without it.")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads, 0 keeps the default.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic dataset.")
+    parser.add_argument("--out", type=str, default=None, help="JSON results file, defaults to results/bench/pipeline_<commit>.json.")
+    parser.add_argument("--compare", type=str, default=None, help="Results file of an earlier run to compare against.")
+    parser.add_argument("--max-slowdown", type=float, default=0, help="With --compare, exit with an error when the throughput of a stage drops by more than this fraction (0 only reports).")
+    return parser.parse_args()
+
+
+def git_commit() -> Optional[str]:
+    """Commit of the working tree, with a -dirty suffix when it has changes, None outside a git repository"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True,
+                               check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def environment() -> dict:
+    return {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+            "processor": platform.processor(), "cpus": os.cpu_count(),
+            "numpy": np.__version__, "torch": torch.__version__, "opencv": cv2.__version__,
+            "torch_threads": torch.get_num_threads()}
+
+
+def summarize(seconds:Sequence[float], items:Sequence[int], unit:str) -> dict:
+    """
+    Throughput and latency percentiles of a stage
+    :param seconds: duration of every call
+    :param items: items processed by every call (frames, groups, samples...)
+    :param unit: what the items are
+
+    :return: dict of calls, items, total seconds, items per second and per call latency percentiles in ms
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    total = float(seconds.sum())
+    p50, p90, p99 = np.percentile(seconds, [50, 90, 99]) * 1000 if len(seconds) else (np.nan,) * 3
+    return {"unit": unit, "calls": len(seconds), "items": int(np.sum(items)), "seconds": round(total, 4),
+            "per_second": round(float(np.sum(items)) / total, 2) if total > 0 else None,
+            "p50_ms": round(float(p50), 3), "p90_ms": round(float(p90), 3), "p99_ms": round(float(p99), 3),
+            "max_ms": round(float(seconds.max()) * 1000, 3) if len(seconds) else None,
+            "first_ms": round(float(seconds[0]) * 1000, 3) if len(seconds) else None}
+
+
+def measure(calls:Sequence[Callable[[], int]], unit:str) -> dict:
+    """Runs every call (each returns how many items it processed) and summarizes them with the peak RSS"""
+    seconds, items = [], []
+    with PeakMemoryMonitor() as monitor:
+        for call in calls:
+            start = time.perf_counter()
+            items.append(call())
+            seconds.append(time.perf_counter() - start)
+    summary = summarize(seconds, items, unit)
+    summary["peak_rss_mb"] = round(monitor.summary()["peak_rss_mb"], 1)
+    return summary
+
+
+def preprocess_args(raw_path:Path, out_path:Path, split:str, out_format:str, args) -> argparse.Namespace:
+    """Arguments of scripts/preprocess.py for a split, both cameras except with the sparse format (EB only)"""
+    sparse = out_format == "sparse"
+    return argparse.Namespace(data_path=str(raw_path), out_path=str(out_path), rewrite=True, rgb=False, eb=sparse,
+                              all=not sparse, split=split, eb_roi_path="", n_frames=args.n_frames, max_time_diff=1000,
+                              format=out_format, groups_per_shard=128, fingerprint="stat", workers=args.workers,
+                              align_tolerance=50)
+
+
+def camera_dirs(root:Path, split:str, camera:str):
+    """(image folder, label folder) of a split/camera, raw or preprocessed"""
+    return root / split / "images" / camera, root / split / label_folder(split, camera)
+
+
+def bench_group_frames(raw_path:Path, split:str, args) -> dict:
+    results = {}
+    for camera in ("rgb", "eb_transformed"):
+        frame_files = sorted(camera_dirs(raw_path, split, camera)[0].glob("*.jpg"))
+        results[camera] = measure([lambda: len(preprocess.group_frames(frame_files, args.n_frames))] * args.repeat,
+                                  "groups")
+    return results
+
+
+def bench_roi(raw_path:Path, split:str, work_path:Path) -> dict:
+    """The EB ROI of the preprocessing: decode, crop and grayscale of every frame, shift of every label file"""
+    image_dir, label_dir = camera_dirs(raw_path, split, "eb_transformed")
+    roi = preprocess.load_eb_roi("")
+    frames = sorted(image_dir.glob("*.jpg"))
+    labels = sorted(label_dir.glob("*.json"))
+    dest = work_path / "roi_labels"
+    dest.mkdir(parents=True, exist_ok=True)
+
+    def label(path):
+        preprocess.roi_label(path, dest / path.name, roi)
+        return 1
+
+    results = {"frame": measure([lambda frame=frame: len(preprocess.load_frame_array(frame, roi)) for frame in frames],
+                                "frames"),
+               "label": measure([lambda path=path: label(path) for path in labels], "labels")}
+    rmtree(dest)
+    return results
+
+
+def bench_preprocess(raw_path:Path, out_root:Path, split:str, formats:List[str], args) -> dict:
+    results = {}
+    for out_format in formats:
+        # outputs of an earlier run (eg. other cameras) must not be benchmarked again
+        rmtree(out_root / out_format, ignore_errors=True)
+        preprocess_args_ = preprocess_args(raw_path, out_root / out_format, split, out_format, args)
+        cameras = ("eb_transformed",) if preprocess_args_.eb else ("rgb", "eb_transformed")
+        frames = sum(len(list(camera_dirs(raw_path, split, camera)[0].glob("*.jpg"))) for camera in cameras)
+
+        def run():
+            # the progress of the preprocessing would bury the results
+            with redirect_stdout(StringIO()):
+                preprocess.preprocess_data(preprocess_args_)
+            return frames
+
+        results[out_format] = measure([run], "frames")
+    return results
+
+
+def open_dataset(out_path:Path, split:str, camera:str) -> TUMTraf:
+    # as the evaluation: RGB frame by frame, EB by group
+    return TUMTraf(*camera_dirs(out_path, split, camera), by_group=camera == "eb_transformed")
+
+
+def init_dataset(out_path:Path, split:str, camera:str) -> int:
+    open_dataset(out_path, split, camera)
+    return 1
+
+
+def bench_dataset(out_root:Path, split:str, formats:List[str], args):
+    init, getitem = {}, {}
+    for out_format in formats:
+        for camera in ("rgb", "eb_transformed"):
+            key = f"{out_format}/{camera}"
+            if not (out_root / out_format / split / "images" / camera).is_dir():
+                continue
+            # the first call builds the label cache, the next ones read it
+            init[key] = measure([lambda: init_dataset(out_root / out_format, split, camera)] * args.repeat, "datasets")
+            dataset = open_dataset(out_root / out_format, split, camera)
+
+            def item(i):
+                sample = dataset[i]
+                return len(sample["frame"]) if camera == "eb_transformed" else 1
+
+            getitem[key] = measure([lambda i=i: item(i) for i in range(len(dataset))], "frames")
+    return init, getitem
+
+
+def bench_build_video(out_path:Path, split:str, work_path:Path) -> dict:
+    """Per group videos with their boxes, as groups2video.py --workers 1"""
+    results = {}
+    for camera in ("rgb", "eb_transformed"):
+        image_dir, label_dir = camera_dirs(out_path, split, camera)
+        video_dir = work_path / "videos" / camera
+        video_dir.mkdir(parents=True, exist_ok=True)
+        tasks = groups2video.plan_groups(image_dir, label_dir, video_dir, draw_boxes=True, rewrite=True)
+        results[camera] = measure([lambda task=task: groups2video.build_video(task, 10, (0, 255, 0), 2) for task in tasks],
+                                  "frames")
+    rmtree(work_path / "videos")
+    return results
+
+
+def bench_forward(out_path:Path, split:str, args) -> dict:
+    """Inference of the models on batches of the preprocessed split, frames as the evaluation feeds them"""
+    models = {"snn": ("eb_transformed", load_model(args.snn_path) if args.snn_path
+                      else SpikingDetector(batch_first=True).eval())}
+    if args.ann_path:
+        models["ann"] = ("rgb", load_model(args.ann_path))
+    results = {}
+    for name, (camera, model) in models.items():
+        dataset = open_dataset(out_path, split, camera)
+        batches = [collate_tumtraf([dataset[i] for i in range(start, min(start + args.batch_size, len(dataset)))])
+                   for start in range(0, len(dataset), args.batch_size)]
+
+        @torch.inference_mode()
+        def forward(batch):
+            model(batch["frame"].float().div_(255.0))
+            return len(batch["frame"])
+
+        # warm up (allocator, lazy initializations), then measure
+        forward(batches[0])
+        results[name] = measure([lambda batch=batch: forward(batch) for batch in batches], "samples")
+    return results
+
+
+def compare(results:dict, baseline:dict, max_slowdown:float) -> List[str]:
+    """Prints the change of throughput and p50 latency of every stage run in both, returns the regressions"""
+    regressions = []
+    print(f"\nCompared to {baseline['environment'].get('commit')}:")
+    for stage, runs in results["stages"].items():
+        for key, summary in runs.items():
+            old = baseline.get("stages", {}).get(stage, {}).get(key)
+            if not old or not old.get("per_second") or not summary.get("per_second"):
+                continue
+            change = summary["per_second"] / old["per_second"] - 1
+            print(f"  {stage}/{key}: {old['per_second']:.1f} -> {summary['per_second']:.1f} {summary['unit']}/s "
+                  f"({change * 100:+.1f}%), p50 {old['p50_ms']:.2f} -> {summary['p50_ms']:.2f} ms")
+            if max_slowdown > 0 and change < -max_slowdown:
+                regressions.append(f"{stage}/{key} throughput {change * 100:+.1f}% (< -{max_slowdown * 100:.0f}%)")
+    return regressions
+
+
+def report(results:dict) -> None:
+    for stage, runs in results["stages"].items():
+        for key, summary in runs.items():
+            print(f"{stage + '/' + key:<42} {summary['per_second'] or 0:>10.1f} {summary['unit']}/s  "
+                  f"p50 {summary['p50_ms']:>9.2f} ms  p99 {summary['p99_ms']:>9.2f} ms  "
+                  f"peak RSS {summary['peak_rss_mb']:>7.0f} MiB")
+
+
+def bench(args) -> dict:
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"unknown stages {sorted(unknown)}, expected some of {STAGES}")
+    formats = [out_format for out_format in args.formats.split(",") if out_format]
+    split = "train"
+
+    work_path = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    raw_path, out_root = work_path / "raw", work_path / "preprocessed"
+    start_time = time.perf_counter()
+    dataset = generate_dataset(raw_path, [split], args.frames, parse_size(args.rgb_size), parse_size(args.eb_size),
+                               seed=args.seed)
+    print(f"Synthetic dataset: {dataset['frames']} frames per camera, {dataset['objects']} objects "
+          f"({time.perf_counter() - start_time:.1f}s)")
+
+    results = {"config": vars(args), "environment": environment(), "dataset": dataset, "stages": {}}
+    try:
+        if "group_frames" in stages:
+            results["stages"]["group_frames"] = bench_group_frames(raw_path, split, args)
+        if "roi" in stages:
+            results["stages"]["roi"] = bench_roi(raw_path, split, work_path)
+        # the later stages read the preprocessed outputs, written here even when the preprocessing is not timed
+        preprocessed = bench_preprocess(raw_path, out_root, split, formats, args)
+        if "preprocess" in stages:
+            results["stages"]["preprocess"] = preprocessed
+        if "dataset_init" in stages or "dataset_getitem" in stages:
+            init, getitem = bench_dataset(out_root, split, formats, args)
+            if "dataset_init" in stages:
+                results["stages"]["dataset_init"] = init
+            if "dataset_getitem" in stages:
+                results["stages"]["dataset_getitem"] = getitem
+        if "build_video" in stages:
+            if "jpg" in formats:
+                results["stages"]["build_video"] = bench_build_video(out_root / "jpg", split, work_path)
+            else:
+                print("build_video needs the jpg format, skipping.")
+        if "forward" in stages:
+            results["stages"]["forward"] = bench_forward(out_root / ("packed" if "packed" in formats else formats[0]),
+                                                         split, args)
+    finally:
+        if not args.work_dir:
+            rmtree(work_path, ignore_errors=True)
+    results["seconds"] = round(time.perf_counter() - start_time, 3)
+    return results
+
+
+def main():
+    args = parse_args()
+    results = bench(args)
+    report(results)
+
+    commit = results["environment"]["commit"]
+    out = Path(args.out) if args.out else Path("results/bench") / f"pipeline_{commit[:8] if commit else 'nogit'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results in {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.max_slowdown)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from src.data.events import dense_to_events
+from src.models.snn import SpikingDetector, sparse_conv2d
+from src.utils.profiling import PeakMemoryMonitor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dense vs sparse event path of the SNN across sparsity levels")
+    parser.add_argument("--density", type=str, default="0.005,0.01,0.05,0.1,0.25", help="Comma-separated fractions of non-zero pixels.")
+    parser.add_argument("--sequences", type=int, default=16, help="Sequences per epoch.")
+    parser.add_argument("--seq_len", type=int, default=8, help="Frames per sequence.")
+    parser.add_argument("--batch-size", type=int, default=2, help="Sequences per batch.")
+    parser.add_argument("--height", type=int, default=442, help="Frame height (the EB ROI by default).")
+    parser.add_argument("--width", type=int, default=482, help="Frame width (the EB ROI by default).")
+    parser.add_argument("--train", action="store_true", help="Time training steps (forward + backward) instead of inference.")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads, 0 keeps the default.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic events.")
+    parser.add_argument("--out", type=str, default=None, help="Write the results as JSON to this file.")
+    return parser.parse_args()
+
+
+def synthetic_events(sequences:int, seq_len:int, height:int, width:int, density:float, rng) -> np.ndarray:
+    """EB-like frames [N, T, 1, H, W] uint8, a density fraction of the pixels is active with a random intensity"""
+    active = rng.random((sequences, seq_len, 1, height, width)) < density
+    return (active * rng.integers(1, 256, active.shape)).astype(np.uint8)
+
+
+def to_sparse(events:dict, seq_len:int, shape) -> torch.Tensor:
+    t = np.repeat(np.arange(seq_len), np.diff(events["offsets"]))
+    indices = np.stack([t, events["c"], events["y"], events["x"]]).astype(np.int64)
+    return torch.sparse_coo_tensor(torch.from_numpy(indices), torch.from_numpy(events["values"]), (seq_len, *shape),
+                                   is_coalesced=True, check_invariants=False)
+
+
+def run_epoch(model, batches, train:bool) -> float:
+    start = time.perf_counter()
+    for x in batches:
+        x = x.float() / 255.0
+        if train:
+            outputs = model(x)
+            sum(out.mean() for out in outputs.values()).backward()
+        else:
+            with torch.inference_mode():
+                model(x)
+    return time.perf_counter() - start
+
+
+def time_first_layer(model, batches) -> float:
+    """Seconds spent in the first convolution over the epoch, dense conv or event-driven"""
+    conv = model.blocks[0].conv
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for x in batches:
+            x = (x.float() / 255.0).transpose(0, 1)
+            if x.is_sparse:
+                t, b = x.shape[:2]
+                indices = x._indices()
+                folded = torch.sparse_coo_tensor(torch.cat([(indices[0] * b + indices[1]).unsqueeze(0), indices[2:]]),
+                                                 x._values(), (t * b, *x.shape[2:]), check_invariants=False)
+                sparse_conv2d(folded, conv.weight, conv.stride[0], conv.padding[0])
+            else:
+                conv(x.flatten(0, 1))
+    return time.perf_counter() - start
+
+
+def bench(args):
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    rng = np.random.default_rng(args.seed)
+    shape = (1, args.height, args.width)
+    results = []
+    for density in [float(d) for d in args.density.split(",") if d]:
+        frames = synthetic_events(args.sequences, args.seq_len, args.height, args.width, density, rng)
+        events = [dense_to_events(sequence) for sequence in frames]
+        dense_bytes = frames[0].nbytes
+        sparse_bytes = np.mean([sum(array.nbytes for array in sequence.values()) for sequence in events])
+
+        row = {"density": density, "dense_bytes_per_sequence": int(dense_bytes),
+               "sparse_bytes_per_sequence": int(sparse_bytes)}
+        for path in ("dense", "sparse"):
+            torch.manual_seed(args.seed)
+            model = SpikingDetector(batch_first=True).train(args.train)
+            if path == "dense":
+                batches = [torch.from_numpy(frames[i:i + args.batch_size])
+                           for i in range(0, args.sequences, args.batch_size)]
+            else:
+                batches = [torch.stack([to_sparse(e, args.seq_len, shape) for e in events[i:i + args.batch_size]])
+                           for i in range(0, args.sequences, args.batch_size)]
+            # warm up, then measure
+            run_epoch(model, batches[:1], args.train)
+            with PeakMemoryMonitor() as monitor:
+                seconds = run_epoch(model, batches, args.train)
+            row[f"{path}_epoch_seconds"] = round(seconds, 3)
+            row[f"{path}_first_layer_seconds"] = round(time_first_layer(model, batches), 3)
+            row[f"{path}_peak_rss_mb"] = round(monitor.summary()["peak_rss_mb"], 1)
+        results.append(row)
+        print(f"density {density:.3f}: bytes/seq dense {dense_bytes / 2**20:.2f} MiB sparse {sparse_bytes / 2**20:.2f} MiB | "
+              f"epoch dense {row['dense_epoch_seconds']:.2f}s sparse {row['sparse_epoch_seconds']:.2f}s | "
+              f"first layer dense {row['dense_first_layer_seconds']:.2f}s sparse {row['sparse_first_layer_seconds']:.2f}s | "
+              f"peak RSS dense {row['dense_peak_rss_mb']:.0f} MiB sparse {row['sparse_peak_rss_mb']:.0f} MiB")
+
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+    return results
+
+
+def main():
+    args = parse_args()
+    bench(args)
+
+
+if __name__ == "__main__":
+    main()
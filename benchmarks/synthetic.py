@@ -0,0 +1,167 @@
+import json
+import argparse
+from pathlib import Path
+from shutil import rmtree
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from src.data.labels import ALL_CLASSES
+from src.data.timestamps import STEM_FORMAT
+
+# written at the root of a generated dataset, a dataset with the same config is not generated again
+CONFIG_NAME = "synthetic.json"
+CAMERAS = {"rgb": "rgb", "eb_transformed": "eb"}
+# capture start of the first frame, the RGB frames are RGB_OFFSET_MS (+- CAMERA_JITTER_MS) after the EB ones
+START_TIME = datetime(2023, 11, 14, 8, 43, 28, 739529)
+RGB_OFFSET_MS = 7
+CAMERA_JITTER_MS = 3
+# boxes of the EB frames stay inside the ROI of scripts/preprocess.py (load_eb_roi)
+EB_ROI = (130, 9, 612, 451)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generates a synthetic dataset with the layout of TUMTraf (frames named by timestamp, OpenLABEL labels)")
+    parser.add_argument("--out-path", type=str, default="data/synthetic", help="Root of the generated dataset.")
+    parser.add_argument("--split", type=str, default="train,test/day", help="Comma-separated list of splits.")
+    parser.add_argument("--frames", type=int, default=128, help="Frames per camera and split.")
+    parser.add_argument("--rgb-size", type=str, default="1920x1200", help="RGB frame size, WIDTHxHEIGHT.")
+    parser.add_argument("--eb-size", type=str, default="640x480", help="EB frame size, WIDTHxHEIGHT (must contain the EB ROI).")
+    parser.add_argument("--max-objects", type=int, default=12, help="Most objects in a frame.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the frames, timestamps and labels.")
+    return parser.parse_args()
+
+
+def parse_size(size:str) -> Tuple[int, int]:
+    """WIDTHxHEIGHT -> (width, height)"""
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+def synthetic_times(n:int, rng, period_ms:int=100, jitter_ms:int=10, gap_every:int=50, gap_ms:int=2500) -> np.ndarray:
+    """
+    Capture times (ms from the start) of a recording: one frame every period_ms (+- jitter_ms), with a gap of
+    gap_ms every gap_every frames so the groups are cut like on the real recordings
+    """
+    steps = period_ms + rng.integers(-jitter_ms, jitter_ms + 1, n)
+    steps[0] = 0
+    steps[gap_every::gap_every] = gap_ms
+    return np.cumsum(steps)
+
+
+def to_stems(times_ms:np.ndarray, start:datetime) -> List[str]:
+    return [(start + timedelta(milliseconds=int(ms))).strftime(STEM_FORMAT) for ms in times_ms]
+
+
+def synthetic_objects(width:int, height:int, rng, max_objects:int, area:Optional[Tuple[int, int, int, int]]=None) -> List[tuple]:
+    """(class, x_center, y_center, width, height) of the objects of a frame, inside area (x0, y0, x1, y1)"""
+    x0, y0, x1, y1 = area if area is not None else (0, 0, width, height)
+    objects = []
+    for _ in range(int(rng.integers(0, max_objects + 1))):
+        w = int(rng.integers(8, max(9, (x1 - x0) // 6)))
+        h = int(rng.integers(8, max(9, (y1 - y0) // 6)))
+        xc = int(rng.integers(x0 + w // 2, x1 - w // 2))
+        yc = int(rng.integers(y0 + h // 2, y1 - h // 2))
+        objects.append((ALL_CLASSES[int(rng.integers(len(ALL_CLASSES)))], xc, yc, w, h))
+    return objects
+
+
+def synthetic_frame(camera:str, width:int, height:int, objects:Sequence[tuple], rng) -> np.ndarray:
+    """
+    BGR frame: RGB frames are a gradient with the objects as filled boxes, EB frames are sparse
+    events (background noise and the edges of the objects), as the eb_transformed images
+    """
+    if camera == "rgb":
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:] = np.linspace(40, 200, width, dtype=np.uint8)[None, :, None]
+        for _, xc, yc, w, h in objects:
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            cv2.rectangle(frame, (xc - w // 2, yc - h // 2), (xc + w // 2, yc + h // 2), color, -1)
+        return frame
+    frame = ((rng.random((height, width)) < 0.02) * 255).astype(np.uint8)
+    for _, xc, yc, w, h in objects:
+        cv2.rectangle(frame, (xc - w // 2, yc - h // 2), (xc + w // 2, yc + h // 2), 255, 1)
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+
+def openlabel(frame_number:int, objects:Sequence[tuple]) -> dict:
+    """OpenLABEL payload of a frame, as the TUMTraf label files"""
+    return {"openlabel": {"metadata": {"schema_version": "1.0.0"}, "coordinate_systems": frame_number,
+                          "frames": {str(frame_number): {"objects": {
+                              str(i): {"object_data": {"name": f"{cls}_{i}", "type": cls, "bbox": [
+                                  {"name": "full_bbox", "val": [xc, yc, w, h],
+                                   "attributes": {"text": [{"name": "sensor_id", "val": "default_cam"}]}}]}}
+                              for i, (cls, xc, yc, w, h) in enumerate(objects)}}}}}
+
+
+def label_folder(split:str, camera:str) -> str:
+    # test splits only ship the fusion optimized labels
+    prefix = "OPENLabel_labels_fusion_gt_optimized" if split.startswith("test/") else "OPENLabel_labels"
+    return f"{prefix}_{CAMERAS[camera]}"
+
+
+def generate_dataset(out_path:Path, splits:Sequence[str], frames:int=128, rgb_size:Tuple[int, int]=(1920, 1200),
+                     eb_size:Tuple[int, int]=(640, 480), max_objects:int=12, seed:int=0, unlabelled:float=0.1) -> dict:
+    """
+    Writes a synthetic raw dataset with the layout scripts/preprocess.py reads, nothing is written when
+    out_path already holds one generated with the same config (one with another config is replaced)
+    :param out_path: root of the dataset, <split>/images/<camera>/<stem>.jpg and <split>/<label folder>/<stem>.json
+    :param frames: frames per camera and split
+    :param unlabelled: fraction of the frames without label file
+
+    :return: the config, with the number of frames and objects written
+    """
+    config = {"splits": list(splits), "frames": frames, "rgb_size": list(rgb_size), "eb_size": list(eb_size),
+              "max_objects": max_objects, "seed": seed, "unlabelled": unlabelled}
+    config_path = out_path / CONFIG_NAME
+    if config_path.exists():
+        with open(config_path) as f:
+            existing = json.load(f)
+        if {key: existing.get(key) for key in config} == config:
+            return existing
+        # generated with another config, its frames would be mixed with the new ones
+        for split in existing.get("splits", []):
+            rmtree(out_path / split, ignore_errors=True)
+    elif out_path.exists() and any(out_path.iterdir()):
+        raise ValueError(f"{out_path} is not empty and was not generated by this script, refusing to write in it")
+
+    rng = np.random.default_rng(seed)
+    objects_written = 0
+    for split in splits:
+        # both cameras record the same scene, their clocks only differ by the offset and a small jitter
+        times_ms = synthetic_times(frames, rng)
+        for camera, (width, height) in (("rgb", rgb_size), ("eb_transformed", eb_size)):
+            image_dir = out_path / split / "images" / camera
+            label_dir = out_path / split / label_folder(split, camera)
+            image_dir.mkdir(parents=True, exist_ok=True)
+            label_dir.mkdir(parents=True, exist_ok=True)
+            camera_ms = times_ms + (RGB_OFFSET_MS + rng.integers(-CAMERA_JITTER_MS, CAMERA_JITTER_MS + 1, frames)
+                                    if camera == "rgb" else 0)
+            area = EB_ROI if camera == "eb_transformed" else None
+            for i, stem in enumerate(to_stems(camera_ms, START_TIME)):
+                objects = synthetic_objects(width, height, rng, max_objects, area)
+                cv2.imwrite(str(image_dir / f"{stem}.jpg"), synthetic_frame(camera, width, height, objects, rng))
+                if rng.random() < unlabelled:
+                    continue
+                with open(label_dir / f"{stem}.json", "w") as f:
+                    json.dump(openlabel(i, objects), f)
+                objects_written += len(objects)
+
+    config["objects"] = objects_written
+    with open(config_path, "w") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def main():
+    args = parse_args()
+    config = generate_dataset(Path(args.out_path), [split for split in args.split.split(",") if split], args.frames,
+                              parse_size(args.rgb_size), parse_size(args.eb_size), args.max_objects, args.seed)
+    print(f"Synthetic dataset in {args.out_path}: {len(config['splits'])} splits, {config['frames']} frames per camera, "
+          f"{config['objects']} objects")
+
+
+if __name__ == "__main__":
+    main()
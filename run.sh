@@ -55,29 +55,30 @@ STAGE=$1
 shift  # Remove first argument (stage) so remaining args can be passed to scripts
 
 # Route to appropriate script based on stage
+# the scripts import src, they run as modules (python -m scripts.<name>) so the repo root is on the path
 case $STAGE in
     preprocess)
         echo "Running preprocessing..."
-        python scripts/preprocess.py "$@"
+        python -m scripts.preprocess "$@"
         ;;
     train-ann)
         echo "Running ANN training..."
-        python scripts/train_ann.py "$@"
+        python -m scripts.train_ann "$@"
         ;;
     train-snn)
         echo "Running SNN training..."
-        python scripts/train_snn.py "$@"
+        python -m scripts.train_snn "$@"
         ;;
     eval)
         echo "Running evaluation..."
-        python scripts/evaluate.py "$@"
+        python -m scripts.evaluate "$@"
         ;;
     pipeline)
         echo "Running full pipeline..."
         
         # Preprocess
         echo "Step 1/3: Preprocessing..."
-        python scripts/preprocess.py "$@"
+        python -m scripts.preprocess "$@"
         if [ $? -ne 0 ]; then
             echo "Preprocessing failed!"
             exit 1
@@ -86,10 +87,10 @@ case $STAGE in
         # Determine which training script to run based on arguments
         if [[ "$*" == *"--eb"* ]]; then
             echo "Step 2/3: Training SNN (event-based)..."
-            python scripts/train_snn.py "$@"
+            python -m scripts.train_snn "$@"
         else
             echo "Step 2/3: Training ANN (RGB)..."
-            python scripts/train_ann.py "$@"
+            python -m scripts.train_ann "$@"
         fi
         
         if [ $? -ne 0 ]; then
@@ -99,7 +100,7 @@ case $STAGE in
         
         # Evaluate
         echo "Step 3/3: Evaluating..."
-        python scripts/evaluate.py "$@"
+        python -m scripts.evaluate "$@"
         if [ $? -ne 0 ]; then
             echo "Evaluation failed!"
             exit 1
@@ -126,7 +127,7 @@ case $STAGE in
             
             # Preprocess both (must be sequential as it's the same script)
             echo "Step 1/3: Preprocessing both RGB and EB..."
-            python scripts/preprocess.py --all $FILTERED_ARGS
+            python -m scripts.preprocess --all $FILTERED_ARGS
             if [ $? -ne 0 ]; then
                 echo "Preprocessing failed!"
                 exit 1
@@ -134,9 +135,9 @@ case $STAGE in
             
             # Train both in parallel
             echo "Step 2/3: Training ANN and SNN in parallel..."
-            python scripts/train_ann.py --rgb $FILTERED_ARGS &
+            python -m scripts.train_ann --rgb $FILTERED_ARGS &
             PID_ANN=$!
-            python scripts/train_snn.py --eb $FILTERED_ARGS &
+            python -m scripts.train_snn --eb $FILTERED_ARGS &
             PID_SNN=$!
             
             # Wait for both to complete
@@ -156,9 +157,9 @@ case $STAGE in
             
             # Evaluate both in parallel
             echo "Step 3/3: Evaluating both models in parallel..."
-            python scripts/evaluate.py --rgb $FILTERED_ARGS &
+            python -m scripts.evaluate --rgb $FILTERED_ARGS &
             PID_EVAL_ANN=$!
-            python scripts/evaluate.py --eb $FILTERED_ARGS &
+            python -m scripts.evaluate --eb $FILTERED_ARGS &
             PID_EVAL_SNN=$!
             
             wait $PID_EVAL_ANN
@@ -181,7 +182,7 @@ case $STAGE in
             
             # Preprocess both
             echo "Step 1/6: Preprocessing both RGB and EB..."
-            python scripts/preprocess.py --all $FILTERED_ARGS
+            python -m scripts.preprocess --all $FILTERED_ARGS
             if [ $? -ne 0 ]; then
                 echo "Preprocessing failed!"
                 exit 1
@@ -189,14 +190,14 @@ case $STAGE in
             
             # RGB Pipeline
             echo "Step 2/6: Training ANN (RGB)..."
-            python scripts/train_ann.py --rgb $FILTERED_ARGS
+            python -m scripts.train_ann --rgb $FILTERED_ARGS
             if [ $? -ne 0 ]; then
                 echo "ANN training failed!"
                 exit 1
             fi
             
             echo "Step 3/6: Evaluating ANN (RGB)..."
-            python scripts/evaluate.py --rgb $FILTERED_ARGS
+            python -m scripts.evaluate --rgb $FILTERED_ARGS
             if [ $? -ne 0 ]; then
                 echo "ANN evaluation failed!"
                 exit 1
@@ -204,14 +205,14 @@ case $STAGE in
             
             # EB Pipeline
             echo "Step 4/6: Training SNN (EB)..."
-            python scripts/train_snn.py --eb $FILTERED_ARGS
+            python -m scripts.train_snn --eb $FILTERED_ARGS
             if [ $? -ne 0 ]; then
                 echo "SNN training failed!"
                 exit 1
             fi
             
             echo "Step 5/6: Evaluating SNN (EB)..."
-            python scripts/evaluate.py --eb $FILTERED_ARGS
+            python -m scripts.evaluate --eb $FILTERED_ARGS
             if [ $? -ne 0 ]; then
                 echo "SNN evaluation failed!"
                 exit 1
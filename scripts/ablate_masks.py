@@ -0,0 +1,242 @@
+import os
+import csv
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing as mp
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from scripts import evaluate
+from scripts.evaluate import DETECTION_METRICS, batch_frames, batches, detect, detection_row, drift, flatten_outputs, \
+    frame_targets, load_split
+from src.data.dataset import TUMTraf
+from src.data.masks import MaskBank, apply_masks, box_occupancy
+from src.utils.metrics import DetectionAccumulator
+
+RESULT_FIELDS = ["model", "camera", "split", "mask", "geometry", "fraction", "pixels", "samples", *DETECTION_METRICS,
+                 "drift_l2", "drift_abs", "seconds"]
+# row of the clean outputs of every split
+CLEAN_MASK = "none"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate a checkpoint under a bank of spatial masks (N removed pixels of many shapes)")
+    parser.add_argument("--data-path", type=str, default="data/preprocessed", help="Root path of the preprocessed data.")
+    parser.add_argument("--model-path", type=str, default=None, help="Checkpoint to evaluate, defaults to checkpoints/ann_rgb.pt (--rgb) or checkpoints/snn_eb.pt (--eb).")
+    parser.add_argument("--rgb", action="store_true", help="Evaluate on the RGB frames (frame by frame).")
+    parser.add_argument("--eb", action="store_true", help="Evaluate on the EB transformed frames (by group).")
+    parser.add_argument("--split", type=str, default="test/day,test/night_with_light_off,test/night_with_light_on", help="Comma-separated list of splits to evaluate.")
+    parser.add_argument("--seq_len", type=int, default=None, help="Evaluate EB on sliding windows of seq_len frames instead of the preprocessed groups.")
+    parser.add_argument("--fractions", type=str, default="0.01,0.05,0.1,0.2", help="Comma-separated fractions of removed pixels, every geometry is built at each.")
+    parser.add_argument("--bands", type=int, default=8, help="Positions of the horizontal and vertical bands.")
+    parser.add_argument("--diagonals", type=int, default=5, help="Offsets of the shifted diagonals.")
+    parser.add_argument("--random-seeds", type=int, default=4, help="Random masks per fraction.")
+    parser.add_argument("--box-split", type=str, default="train", help="Split whose labelled boxes condition the boxes_hot/boxes_cold masks, skipped when missing.")
+    parser.add_argument("--bank", type=str, default=None, help="Mask bank file, defaults to results/ablation/masks_{camera}_{H}x{W}.npz. Rebuilt when its configuration differs.")
+    parser.add_argument("--value", type=int, default=0, help="Value of the removed pixels (0 = no event).")
+    parser.add_argument("--masks-per-pass", type=int, default=4, help="Masks applied together to every batch, the forward pass sees batch-size x masks-per-pass samples.")
+    parser.add_argument("--batch-size", type=int, default=8, help="Samples per forward pass and mask.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random masks.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes evaluating chunks of masks in parallel.")
+    parser.add_argument("--device", type=str, default="cpu", help="Device of the model in the workers.")
+    parser.add_argument("--results", type=str, default=None, help="CSV results table, defaults to results/ablation_{camera}.csv. Finished masks are skipped.")
+    parser.add_argument("--top", type=int, default=5, help="Most harmful masks listed per split and fraction at the end.")
+    return parser.parse_args()
+
+
+def bank_config(args, height:int, width:int, occupancy:Optional[np.ndarray]) -> dict:
+    return {"height": height, "width": width, "fractions": [float(f) for f in args.fractions.split(",") if f],
+            "bands": args.bands, "diagonals": args.diagonals, "random_seeds": args.random_seeds, "seed": args.seed,
+            "boxes": int(occupancy.sum()) if occupancy is not None else 0}
+
+
+def open_bank(path:Path, args, height:int, width:int, occupancy:Optional[np.ndarray]) -> MaskBank:
+    """The bank at path when it was built with the same configuration, else a new one written there"""
+    config = bank_config(args, height, width, occupancy)
+    if path.exists():
+        bank = MaskBank.load(path)
+        if bank.config == config:
+            return bank
+    start_time = time.perf_counter()
+    bank = MaskBank.build(height, width, config["fractions"], args.bands, args.diagonals, args.random_seeds,
+                          occupancy, args.seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    bank.save(path)
+    print(f"Built {len(bank)} masks of {height}x{width} in {time.perf_counter() - start_time:.1f}s, "
+          f"{bank.bits.nbytes / 2**20:.1f} MiB in {path}")
+    return bank
+
+
+def split_occupancy(data_path:Path, split:str, camera:str, height:int, width:int) -> Optional[np.ndarray]:
+    """How often every pixel is covered by a labelled box of a split, None when the split is missing"""
+    label_folder = "OPENLabel_labels_fusion_gt_optimized" if split.startswith("test/") else "OPENLabel_labels"
+    label_dir = data_path / split / f"{label_folder}_{'rgb' if camera == 'rgb' else 'eb'}"
+    image_dir = data_path / split / "images" / camera
+    if not label_dir.is_dir() or not image_dir.is_dir():
+        return None
+    return box_occupancy(TUMTraf(image_dir, label_dir).labels.boxes, height, width)
+
+
+# per worker state, set by init_worker
+_bank: Optional[MaskBank] = None
+_clean: Dict[str, Tuple[List[List[torch.Tensor]], Optional[dict]]] = {}
+
+
+def init_worker(model_path:str, splits, device:str, threads:int, bank:MaskBank, clean:dict):
+    global _bank, _clean
+    evaluate.init_worker(model_path, splits, device, threads)
+    _bank = bank
+    _clean = clean
+
+
+@torch.inference_mode()
+def ablate(split:str, mask_indices:List[int], batch_size:int, value:int) -> List[dict]:
+    """
+    Outputs of a split under several masks at once: every batch is masked by all of them in one broadcast and goes
+    through the model as a single batch, then compared to the clean outputs computed once for the split
+
+    :return: one row of the results table per mask
+    """
+    start_time = time.perf_counter()
+    dataset = evaluate._splits[split].dataset
+    starts, lengths = dataset.sample_ranges()
+    masks = _bank.masks(mask_indices)
+    outputs = [[] for _ in mask_indices]
+    accumulators = [DetectionAccumulator(len(dataset.classes)) for _ in mask_indices]
+    detects = False
+    for batch in batches(lengths, batch_size):
+        x = apply_masks(batch_frames(split, starts, lengths, batch), masks, value)
+        x = x.to(evaluate._device).float().div_(255.0)
+        raw = evaluate._model(x)
+        flat = [out.float().cpu() for out in flatten_outputs(raw)]
+        detections = detect(raw, x)
+        targets = frame_targets(dataset, starts[batch] + lengths[batch] - 1) if detections is not None else None
+        # sample b of mask k is at k * B + b
+        for k, chunk in enumerate(range(0, len(mask_indices) * len(batch), len(batch))):
+            outputs[k].append([out[chunk:chunk + len(batch)] for out in flat])
+            if detections is not None:
+                detects = True
+                accumulators[k].update(detections[chunk:chunk + len(batch)], targets)
+
+    clean, _ = _clean[split]
+    seconds = round((time.perf_counter() - start_time) / len(mask_indices), 3)
+    rows = []
+    for k, index in enumerate(mask_indices):
+        mask_drift = drift(clean, outputs[k])
+        rows.append({"split": split, "mask": _bank.names[index], "geometry": _bank.geometries[index],
+                     "fraction": float(_bank.fractions[index]), "pixels": int(masks[k].sum()),
+                     "samples": mask_drift["samples"],
+                     **detection_row(accumulators[k].compute() if detects else None),
+                     "drift_l2": mask_drift["drift_l2"], "drift_abs": mask_drift["drift_abs"], "seconds": seconds})
+    return rows
+
+
+def finished_masks(results_path:Path, model:str, camera:str):
+    """(split, mask) pairs of the results table already evaluated for this model and camera"""
+    if not results_path.exists():
+        return set()
+    with open(results_path, newline="") as f:
+        return {(row["split"], row["mask"]) for row in csv.DictReader(f)
+                if row["model"] == model and row["camera"] == camera}
+
+
+def summarize(results_path:Path, model:str, camera:str, splits:List[str], top:int) -> None:
+    """Masks hurting the most per split and fraction: largest mAP drop, or output drift without detection head"""
+    with open(results_path, newline="") as f:
+        rows = [row for row in csv.DictReader(f) if row["model"] == model and row["camera"] == camera]
+    for split in splits:
+        split_rows = [row for row in rows if row["split"] == split]
+        clean = next((row for row in split_rows if row["mask"] == CLEAN_MASK), None)
+        if clean is None:
+            continue
+        use_map = not np.isnan(float(clean["map"]))
+        print(f"\n--- {split}: clean mAP {float(clean['map']):.4f} ---" if use_map else f"\n--- {split} ---")
+        # ties of the mAP drop (eg. untrained models) are ranked by drift
+        key = lambda row: (float(clean["map"]) - float(row["map"]) if use_map else 0.0, float(row["drift_l2"]))
+        for fraction in sorted({float(row["fraction"]) for row in split_rows if row["mask"] != CLEAN_MASK}):
+            same = [row for row in split_rows if row["mask"] != CLEAN_MASK and float(row["fraction"]) == fraction]
+            ranked = sorted(same, key=key, reverse=True)[:top]
+            print(f"{fraction * 100:g}% of the pixels: " + ", ".join(
+                f"{row['geometry']} ({'mAP drop ' + format(key(row)[0], '.4f') + ', ' if use_map else ''}"
+                f"drift_l2 {key(row)[1]:.4f})" for row in ranked))
+
+
+def ablation(args):
+    data_path = Path(args.data_path)
+    camera = "eb_transformed" if args.eb and not args.rgb else "rgb"
+    model_path = args.model_path or ("checkpoints/snn_eb.pt" if camera != "rgb" else "checkpoints/ann_rgb.pt")
+    results_path = Path(args.results or f"results/ablation_{'eb' if camera != 'rgb' else 'rgb'}.csv")
+    splits = [split for split in args.split.split(",") if split]
+
+    # every split is read once, the workers share its frames
+    loaded = {}
+    for split in splits:
+        start_time = time.perf_counter()
+        loaded[split] = load_split(data_path, split, camera, args.seq_len)
+        print(f"Loaded {split}: {len(loaded[split].dataset)} samples, "
+              f"{loaded[split].frames.nbytes / 2**20:.1f} MiB in {time.perf_counter() - start_time:.1f}s")
+    height, width = next(iter(loaded.values())).frames.shape[-2:]
+    occupancy = split_occupancy(data_path, args.box_split, camera, height, width) if args.box_split else None
+    bank_path = Path(args.bank or f"results/ablation/masks_{'eb' if camera != 'rgb' else 'rgb'}_{height}x{width}.npz")
+    bank = open_bank(bank_path, args, height, width, occupancy)
+
+    done = finished_masks(results_path, model_path, camera)
+    todo = {split: [i for i, name in enumerate(bank.names) if (split, name) not in done] for split in splits}
+    print(f"Ablating {model_path} on {camera}: {len(bank)} masks x {len(splits)} splits, "
+          f"{sum(len(masks) for masks in todo.values())} to run")
+
+    workers = max(1, args.workers)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # the clean outputs are computed once here and shared by every worker, not once per worker
+    evaluate.init_worker(model_path, loaded, args.device, (os.cpu_count() or 1))
+    clean = {split: evaluate.predict(split, None, args.batch_size) for split in splits
+             if todo[split] or (split, CLEAN_MASK) not in done}
+    torch.set_num_threads(os.cpu_count() or 1)
+
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    write_header = not results_path.exists() or results_path.stat().st_size == 0
+    cells = [(split, indices[i:i + args.masks_per_pass]) for split, indices in todo.items()
+             for i in range(0, len(indices), args.masks_per_pass)]
+    mp_context = mp.get_context("spawn") if args.device.startswith("cuda") else None
+    start_time = time.perf_counter()
+    with open(results_path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        if write_header:
+            writer.writeheader()
+        for split, (outputs, metrics) in clean.items():
+            if (split, CLEAN_MASK) not in done:
+                writer.writerow({"model": model_path, "camera": camera, "split": split, "mask": CLEAN_MASK,
+                                 "geometry": CLEAN_MASK, "fraction": 0.0, "pixels": 0,
+                                 **drift(outputs, outputs), **detection_row(metrics), "seconds": 0.0})
+        f.flush()
+        if cells:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=init_worker,
+                                     initargs=(model_path, loaded, args.device, threads, bank, clean)) as pool:
+                futures = [pool.submit(ablate, split, indices, args.batch_size, args.value) for split, indices in cells]
+                for i, future in enumerate(as_completed(futures), 1):
+                    rows = future.result()
+                    # streamed, so an interrupted study resumes from the finished masks
+                    for row in rows:
+                        writer.writerow({"model": model_path, "camera": camera, **row})
+                    f.flush()
+                    print(f"[{i}/{len(cells)}] {rows[0]['split']} " +
+                          " ".join(f"{row['mask']}: mAP={row['map']:.4f} drift_l2={row['drift_l2']:.4f}" for row in rows))
+    print(f"Ablated {sum(len(indices) for _, indices in cells)} masks in {time.perf_counter() - start_time:.1f}s, "
+          f"results in {results_path}")
+    summarize(results_path, model_path, camera, splits, args.top)
+
+    for split in loaded.values():
+        split.frames.close()
+
+
+def main():
+    args = parse_args()
+    ablation(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+import cv2
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from src.data.dataset import TUMTraf
+from src.data.masks import MASK_SHAPES, build_masks
+from src.utils.entropy import EntropyAccumulator
+
+CAMERAS = {"rgb": "rgb", "eb": "eb_transformed"}
+# arrays of every split/camera, with the heatmaps as png next to it
+RESULT_NAME = "entropy.npz"
+HEATMAPS = ["tile_entropy", "tile_density", "pixel_entropy", "event_density"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Regional Shannon entropy and event density of the preprocessed splits, streamed group by group")
+    parser.add_argument("--data-path", type=str, default="data/preprocessed", help="Root path of the preprocessed data (jpg, packed or sparse).")
+    parser.add_argument("--out-path", type=str, default="results/entropy", help="Where the heatmaps and statistics are written.")
+    parser.add_argument("--split", type=str, default="train,val,test/day,test/night_with_light_off,test/night_with_light_on", help="Comma-separated list of splits.")
+    parser.add_argument("--rgb", action="store_true", help="Analyze the RGB frames.")
+    parser.add_argument("--eb", action="store_true", help="Analyze the EB transformed frames.")
+    parser.add_argument("--all", action="store_true", help="Analyze both cameras.")
+    parser.add_argument("--tile", type=int, default=32, help="Side of the square tiles, in pixels.")
+    parser.add_argument("--bins", type=int, default=256, help="Gray level bins of the tile and mask histograms (power of two).")
+    parser.add_argument("--pixel-bins", type=int, default=16, help="Gray level bins of the per pixel histograms (power of two).")
+    parser.add_argument("--masks", type=str, default=",".join(MASK_SHAPES), help="Comma-separated mask shapes, see src/data/masks.py.")
+    parser.add_argument("--mask-fraction", type=float, default=0.1, help="Fraction of the pixels removed by every mask.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes, each one streams its own range of groups.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random mask.")
+    return parser.parse_args()
+
+
+def open_split(data_path:Path, split:str, camera:str) -> TUMTraf:
+    label_folder = "OPENLabel_labels_fusion_gt_optimized" if split.startswith("test/") else "OPENLabel_labels"
+    suffix = "rgb" if camera == "rgb" else "eb"
+    # by group every frame is kept, labelled or not
+    return TUMTraf(data_path / split / "images" / camera, data_path / split / f"{label_folder}_{suffix}", by_group=True)
+
+
+# per worker state, set by init_worker
+_dataset: Optional[TUMTraf] = None
+_config: dict = {}
+
+
+def init_worker(data_path:Path, split:str, camera:str, config:dict):
+    global _dataset, _config
+    torch.set_num_threads(1)
+    _dataset = open_split(data_path, split, camera)
+    _config = config
+
+
+def accumulate(start:int, end:int) -> EntropyAccumulator:
+    """Histograms of the groups start..end-1, one group in memory at a time"""
+    accumulator = EntropyAccumulator(**_config)
+    for i in range(start, end):
+        accumulator.update(_dataset[i]["frame"])
+    return accumulator
+
+
+def analyze(data_path:Path, split:str, camera:str, tile:int, bins:int, pixel_bins:int,
+            mask_shapes, mask_fraction:float, workers:int=1, seed:int=0) -> Optional[dict]:
+    """
+    Entropy heatmaps of a split/camera, see EntropyAccumulator.result
+    Every worker streams its own range of groups, their histograms are merged as they finish
+
+    :return: the result, None when the split has no groups
+    """
+    dataset = open_split(data_path, split, camera)
+    if len(dataset) == 0:
+        return None
+    height, width = dataset[0]["frame"].shape[-2:]
+    config = {"height": height, "width": width, "tile": tile, "bins": bins, "pixel_bins": pixel_bins,
+              "masks": build_masks(height, width, mask_fraction, mask_shapes, seed)}
+    total = EntropyAccumulator(**config)
+    if workers <= 1:
+        init_worker(data_path, split, camera, config)
+        for i in tqdm(range(len(dataset)), desc=f"{split}/{camera}", unit="group"):
+            total.update(_dataset[i]["frame"])
+    else:
+        # one range of groups per worker, the per pixel histograms of a full RGB frame are ~150 MB to send back
+        bounds = np.linspace(0, len(dataset), min(len(dataset), workers) + 1).astype(int)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(data_path, split, camera, config)) as executor:
+            futures = [executor.submit(accumulate, start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+            for future in tqdm(as_completed(futures), total=len(futures), desc=f"{split}/{camera}", unit="range"):
+                total.merge(future.result())
+    return total.result()
+
+
+def save_heatmap(path:Path, heatmap:np.ndarray, size) -> None:
+    """Heatmap as a color png of the frame size (nearest neighbour, so tiles stay visible)"""
+    low, high = float(heatmap.min()), float(heatmap.max())
+    scaled = ((heatmap - low) / (high - low) * 255 if high > low else np.zeros_like(heatmap)).astype(np.uint8)
+    cv2.imwrite(str(path), cv2.applyColorMap(cv2.resize(scaled, size, interpolation=cv2.INTER_NEAREST), cv2.COLORMAP_INFERNO))
+
+
+def save_result(out_path:Path, result:dict) -> dict:
+    """Writes the arrays, the heatmaps and the statistics, returns the statistics"""
+    out_path.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(out_path / RESULT_NAME, **{name: result[name] for name in HEATMAPS})
+    size = result["pixel_entropy"].shape[::-1]
+    for name in HEATMAPS:
+        save_heatmap(out_path / f"{name}.png", result[name], size)
+    stats = {"frames": result["frames"], "mean_pixel_entropy": float(result["pixel_entropy"].mean()),
+             "mean_tile_entropy": float(result["tile_entropy"].mean()),
+             "event_density": float(result["event_density"].mean()),
+             # masks removing the most information first
+             "masks": dict(sorted(result["masks"].items(), key=lambda item: -item[1]["information"]))}
+    with open(out_path / "summary.json", "w") as f:
+        json.dump(stats, f, indent=2)
+    return stats
+
+
+def report(split:str, camera:str, stats:dict, seconds:float) -> None:
+    print(f"{split}/{camera}: {stats['frames']} frames in {seconds:.1f}s, mean pixel entropy "
+          f"{stats['mean_pixel_entropy']:.3f} bits, mean tile entropy {stats['mean_tile_entropy']:.3f} bits, "
+          f"event density {stats['event_density']:.4f}")
+    for name, mask in stats["masks"].items():
+        print(f"  {name:<14} information {mask['information']:>10.1f} bits/frame  "
+              f"entropy {mask['entropy']:.3f} bits  event density {mask['event_density']:.4f}")
+
+
+def main():
+    args = parse_args()
+    cameras = [CAMERAS[name] for name in CAMERAS if getattr(args, name) or args.all]
+    if not cameras:
+        print("Nothing to analyze, use --rgb, --eb or --all.")
+        return
+    masks = [shape for shape in args.masks.split(",") if shape]
+    data_path, out_path = Path(args.data_path), Path(args.out_path)
+    for split in [split for split in args.split.split(",") if split]:
+        for camera in cameras:
+            if not (data_path / split / "images" / camera).is_dir():
+                print(f"No {camera} frames in {data_path / split}, skipping.")
+                continue
+            start_time = time.perf_counter()
+            result = analyze(data_path, split, camera, args.tile, args.bins, args.pixel_bins, masks,
+                             args.mask_fraction, args.workers, args.seed)
+            if result is None:
+                print(f"No groups in {split}/{camera}, skipping.")
+                continue
+            stats = save_result(out_path / split / camera, result)
+            report(split, camera, stats, time.perf_counter() - start_time)
+
+
+if __name__ == "__main__":
+    main()
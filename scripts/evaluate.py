@@ -0,0 +1,317 @@
+import os
+import csv
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing as mp
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import torch
+
+from src.data.cache import SharedArray
+from src.data.dataset import TUMTraf
+from src.data.noise import SEVERITIES, build_noise
+from src.models.checkpoint import load_model
+from src.models.detection import decode_detections
+from src.utils.metrics import DetectionAccumulator
+
+RESULT_FIELDS = ["model", "camera", "split", "noise", "severity", "samples", "map", "map_50", "map_75", "recall",
+                 "drift_l2", "drift_abs", "seconds"]
+DETECTION_METRICS = ["map", "map_50", "map_75", "recall"]
+# severity 0 of the "none" noise is the clean reference of every split
+CLEAN = ("none", 0)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate a checkpoint over a grid of noises x severities x test splits")
+    parser.add_argument("--data-path", type=str, default="data/preprocessed", help="Root path of the preprocessed data.")
+    parser.add_argument("--model-path", type=str, default=None, help="Checkpoint to evaluate, defaults to checkpoints/ann_rgb.pt (--rgb) or checkpoints/snn_eb.pt (--eb).")
+    parser.add_argument("--rgb", action="store_true", help="Evaluate on the RGB frames (frame by frame).")
+    parser.add_argument("--eb", action="store_true", help="Evaluate on the EB transformed frames (by group).")
+    parser.add_argument("--split", type=str, default="test/day,test/night_with_light_off,test/night_with_light_on", help="Comma-separated list of splits to evaluate.")
+    parser.add_argument("--noise", type=str, default=",".join(SEVERITIES), help="Comma-separated list of noises, see src/data/noise.py.")
+    parser.add_argument("--severity", type=str, default="1,2,3,4,5", help="Comma-separated list of severities.")
+    parser.add_argument("--seq_len", type=int, default=None, help="Evaluate EB on sliding windows of seq_len frames instead of the preprocessed groups.")
+    parser.add_argument("--batch-size", type=int, default=8, help="Samples per forward pass.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the noises.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes evaluating grid cells in parallel.")
+    parser.add_argument("--device", type=str, default="cpu", help="Device of the model in the workers.")
+    parser.add_argument("--results", type=str, default=None, help="CSV results table, defaults to results/eval_{camera}.csv. Finished cells are skipped.")
+    # run.sh forwards the arguments of every stage to the evaluation
+    args, unknown = parser.parse_known_args()
+    if unknown:
+        print(f"Ignoring arguments: {' '.join(unknown)}")
+    return args
+
+
+class Cell(NamedTuple):
+    """One point of the evaluation grid"""
+    split: str
+    noise: str
+    severity: int
+
+
+class SharedSplit(NamedTuple):
+    """A test split loaded once: the dataset (labels, samples) and every frame in shared memory"""
+    dataset: TUMTraf
+    frames: SharedArray
+
+
+class SharedOutputs(NamedTuple):
+    """Model outputs of every batch of a split in shared memory, the batches of each output stacked in one array"""
+    arrays: List[SharedArray]
+    batch_sizes: List[int]
+    metrics: Optional[dict]
+
+
+def share_outputs(outputs:List[List[torch.Tensor]], metrics:Optional[dict]) -> SharedOutputs:
+    """Copies the outputs of predict into shared memory"""
+    arrays = []
+    for i in range(len(outputs[0]) if outputs else 0):
+        stacked = torch.cat([batch[i] for batch in outputs]).numpy()
+        arrays.append(SharedArray(stacked.shape, dtype=stacked.dtype))
+        arrays[-1].array[:] = stacked
+    return SharedOutputs(arrays, [len(batch[0]) for batch in outputs], metrics)
+
+
+def shared_outputs(shared:SharedOutputs) -> Tuple[List[List[torch.Tensor]], Optional[dict]]:
+    """The outputs as predict returns them, viewing the shared memory"""
+    bounds = np.cumsum([0, *shared.batch_sizes])
+    return [[torch.from_numpy(array.array[start:end]) for array in shared.arrays]
+            for start, end in zip(bounds[:-1], bounds[1:])], shared.metrics
+
+
+def load_split(data_path:Path, split:str, camera:str, seq_len=None) -> SharedSplit:
+    """
+    Reads every frame of a split/camera into shared memory, the dataset keeps the sample table and labels
+    :param data_path: root of the preprocessed data
+    :param split: eg. test/day
+    :param camera: rgb or eb_transformed
+    :param seq_len: sliding windows of seq_len frames for EB, None uses the preprocessed groups
+    """
+    label_folder = "OPENLabel_labels_fusion_gt_optimized" if split.startswith("test/") else "OPENLabel_labels"
+    label_folder += "_rgb" if camera == "rgb" else "_eb"
+    dataset = TUMTraf(data_path / split / "images" / camera, data_path / split / label_folder,
+                      by_group=camera != "rgb" and seq_len is None, seq_len=seq_len if camera != "rgb" else None)
+    num_frames = len(dataset.file_ids)
+    frame_shape = tuple(dataset._load_frame(0).shape) if num_frames else (0,)
+    frames = SharedArray((num_frames, *frame_shape), dtype=np.uint8)
+    for group in range(len(dataset.group_names)):
+        start, end = int(dataset.group_offsets[group]), int(dataset.group_offsets[group + 1])
+        if end > start:
+            group_frames = dataset._load_frames(start, end)
+            frames.array[start:end] = (group_frames.to_dense() if group_frames.is_sparse else group_frames).numpy()
+    return SharedSplit(dataset, frames)
+
+
+def batches(lengths:np.ndarray, batch_size:int) -> List[np.ndarray]:
+    """Batches of samples of the same length, in a fixed order"""
+    out = []
+    for length in np.unique(lengths):
+        same = np.flatnonzero(lengths == length)
+        out.extend(same[i:i + batch_size] for i in range(0, len(same), batch_size))
+    return out
+
+
+def flatten_outputs(outputs) -> List[torch.Tensor]:
+    """Tensors of a model output (tensor, tuple/list or dict), each with the batch as first dimension"""
+    if isinstance(outputs, torch.Tensor):
+        return [outputs]
+    if isinstance(outputs, dict):
+        outputs = list(outputs.values())
+    return [t for out in outputs if out is not None for t in flatten_outputs(out)]
+
+
+# per worker state, set by init_worker
+_model = None
+_splits: Dict[str, SharedSplit] = {}
+_device = "cpu"
+_clean_outputs: Dict[str, Tuple[List[List[torch.Tensor]], Optional[dict]]] = {}
+
+
+def init_worker(model_path:str, splits:Dict[str, SharedSplit], device:str, threads:int,
+                clean:Optional[Dict[str, SharedOutputs]]=None):
+    """:param clean: clean outputs of the splits computed by the parent, the others are computed when first needed"""
+    global _model, _splits, _device, _clean_outputs
+    torch.set_num_threads(threads)
+    _model = load_model(model_path, map_location=device)
+    _splits = splits
+    _device = device
+    _clean_outputs = {split: shared_outputs(shared) for split, shared in (clean or {}).items()}
+
+
+def is_centernet(outputs) -> bool:
+    return isinstance(outputs, dict) and {"heatmap", "size", "offset"} <= set(outputs)
+
+
+def batch_frames(split:str, starts:np.ndarray, lengths:np.ndarray, batch:np.ndarray) -> torch.Tensor:
+    """uint8 frames of a batch of samples of the same length, [B, T, C, H, W] by group/sequence, else [B, C, H, W]"""
+    dataset, frames = _splits[split]
+    rows = starts[batch, None] + np.arange(lengths[batch[0]])
+    sequences = dataset.seq_len is not None or dataset.by_group
+    return torch.from_numpy(frames.array[rows] if sequences else frames.array[rows[:, 0]])
+
+
+def detect(outputs, x:torch.Tensor) -> Optional[List[Dict[str, torch.Tensor]]]:
+    """Detections of every sample of a detection head output (see src/models/detection.py), None for other outputs"""
+    if not is_centernet(outputs):
+        return None
+    stride = getattr(_model, "stride", None) or round(x.shape[-2] / outputs["heatmap"].shape[-2])
+    # every detection is kept (up to 100 per sample), the PR curve sweeps the score threshold
+    return decode_detections(outputs["heatmap"].float(), outputs["size"].float(), outputs["offset"].float(),
+                             stride, threshold=0.0)
+
+
+def frame_targets(dataset:TUMTraf, frames:np.ndarray) -> List[Dict[str, torch.Tensor]]:
+    """Labels of frames, as DetectionAccumulator targets"""
+    labels = [dataset._label(int(frame)) for frame in frames]
+    return [{"boxes": boxes, "classes": classes} for boxes, classes in labels]
+
+
+@torch.inference_mode()
+def predict(split:str, noise, batch_size:int) -> Tuple[List[List[torch.Tensor]], Optional[dict]]:
+    """
+    Model outputs of every batch of a split, the frames of every sample are corrupted by noise (None for clean)
+    Detection heads (see src/models/detection.py) are also scored against the labels of the last frame of every
+    sample, streamed batch by batch
+
+    :return: (outputs, detection metrics or None when the model has no detection head)
+    """
+    dataset = _splits[split].dataset
+    starts, lengths = dataset.sample_ranges()
+    accumulator = DetectionAccumulator(len(dataset.classes))
+    detects = False
+    outputs = []
+    for batch in batches(lengths, batch_size):
+        x = batch_frames(split, starts, lengths, batch)
+        if noise is not None:
+            # same seeds as TUMTraf(transform=noise), the first frame of the sample
+            x = noise(x, seeds=starts[batch])
+        x = x.to(_device).float().div_(255.0)
+        raw = _model(x)
+        outputs.append([out.float().cpu() for out in flatten_outputs(raw)])
+        detections = detect(raw, x)
+        if detections is not None:
+            detects = True
+            accumulator.update(detections, frame_targets(dataset, starts[batch] + lengths[batch] - 1))
+    return outputs, accumulator.compute() if detects else None
+
+
+def drift(clean:List[List[torch.Tensor]], noisy:List[List[torch.Tensor]]) -> dict:
+    """Relative L2 distance and mean absolute difference of the outputs to the clean ones, averaged over the samples"""
+    drift_l2, drift_abs = [], []
+    for clean_batch, noisy_batch in zip(clean, noisy):
+        diff = torch.cat([(n - c).flatten(1) for c, n in zip(clean_batch, noisy_batch)], dim=1)
+        ref = torch.cat([c.flatten(1) for c in clean_batch], dim=1)
+        drift_l2.append(diff.norm(dim=1) / ref.norm(dim=1).clamp_min(1e-12))
+        drift_abs.append(diff.abs().mean(dim=1))
+    samples = int(sum(len(d) for d in drift_l2))
+    return {"samples": samples,
+            "drift_l2": float(torch.cat(drift_l2).mean()) if samples else float("nan"),
+            "drift_abs": float(torch.cat(drift_abs).mean()) if samples else float("nan")}
+
+
+def detection_row(metrics:Optional[dict]) -> dict:
+    return {name: metrics[name] if metrics is not None else float("nan") for name in DETECTION_METRICS}
+
+
+def evaluate_cell(cell:Cell, batch_size:int, seed:int) -> dict:
+    """Runs one cell of the grid, returns its row of the results table"""
+    start_time = time.perf_counter()
+    if cell.split not in _clean_outputs:
+        # not given by the parent, computed once per worker and split
+        _clean_outputs[cell.split] = predict(cell.split, None, batch_size)
+    clean, clean_metrics = _clean_outputs[cell.split]
+    noisy, metrics = (clean, clean_metrics) if cell.noise == CLEAN[0] else \
+        predict(cell.split, build_noise(cell.noise, cell.severity, seed=seed), batch_size)
+    cell_drift = drift(clean, noisy)
+    return {"split": cell.split, "noise": cell.noise, "severity": cell.severity, "samples": cell_drift["samples"],
+            **detection_row(metrics), "drift_l2": cell_drift["drift_l2"], "drift_abs": cell_drift["drift_abs"],
+            "seconds": round(time.perf_counter() - start_time, 3)}
+
+
+def finished_cells(results_path:Path, model:str, camera:str):
+    """Cells of the results table already evaluated for this model and camera"""
+    if not results_path.exists():
+        return set()
+    with open(results_path, newline="") as f:
+        return {Cell(row["split"], row["noise"], int(row["severity"])) for row in csv.DictReader(f)
+                if row["model"] == model and row["camera"] == camera}
+
+
+def evaluate(args):
+    data_path = Path(args.data_path)
+    camera = "eb_transformed" if args.eb and not args.rgb else "rgb"
+    model_path = args.model_path or ("checkpoints/snn_eb.pt" if camera != "rgb" else "checkpoints/ann_rgb.pt")
+    results_path = Path(args.results or f"results/eval_{'eb' if camera != 'rgb' else 'rgb'}.csv")
+    splits = [split for split in args.split.split(",") if split]
+    noises = [noise for noise in args.noise.split(",") if noise]
+    severities = [int(severity) for severity in args.severity.split(",") if severity]
+    for noise in noises:
+        if noise not in SEVERITIES:
+            raise ValueError(f"unknown noise {noise}, expected one of {list(SEVERITIES)}")
+    if camera == "rgb":
+        # frame drops need sequences
+        noises = [noise for noise in noises if noise != "frame_drop"]
+
+    grid = [Cell(split, *CLEAN) for split in splits] + \
+           [Cell(split, noise, severity) for split in splits for noise in noises for severity in severities]
+    done = finished_cells(results_path, model_path, camera)
+    todo = [cell for cell in grid if cell not in done]
+    print(f"Evaluating {model_path} on {camera}: {len(grid)} cells, {len(grid) - len(todo)} already in {results_path}")
+    if not todo:
+        return
+
+    # every split of the remaining cells is read once, the workers share its frames
+    splits = {}
+    for split in sorted({cell.split for cell in todo}):
+        start_time = time.perf_counter()
+        splits[split] = load_split(data_path, split, camera, args.seq_len)
+        print(f"Loaded {split}: {len(splits[split].dataset)} samples, "
+              f"{splits[split].frames.nbytes / 2**20:.1f} MiB in {time.perf_counter() - start_time:.1f}s")
+
+    # the clean outputs every noisy cell is compared to, computed once here instead of once per worker
+    start_time = time.perf_counter()
+    init_worker(model_path, splits, args.device, os.cpu_count() or 1)
+    clean = {split: share_outputs(*predict(split, None, args.batch_size)) for split in splits}
+    print(f"Clean outputs of {len(clean)} splits in {time.perf_counter() - start_time:.1f}s")
+
+    workers = max(1, args.workers)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # CUDA cannot be used in forked workers
+    mp_context = mp.get_context("spawn") if args.device.startswith("cuda") else None
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    write_header = not results_path.exists() or results_path.stat().st_size == 0
+    start_time = time.perf_counter()
+    with open(results_path, "a", newline="") as f, \
+         ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=init_worker,
+                             initargs=(model_path, splits, args.device, threads, clean)) as pool:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        if write_header:
+            writer.writeheader()
+        futures = {pool.submit(evaluate_cell, cell, args.batch_size, args.seed): cell for cell in todo}
+        for i, future in enumerate(as_completed(futures), 1):
+            row = {"model": model_path, "camera": camera, **future.result()}
+            # streamed, so an interrupted sweep resumes from the finished cells
+            writer.writerow(row)
+            f.flush()
+            print(f"[{i}/{len(todo)}] {row['split']} {row['noise']}@{row['severity']}: "
+                  f"mAP={row['map']:.4f} AP50={row['map_50']:.4f} drift_l2={row['drift_l2']:.4f} ({row['seconds']:.1f}s)")
+    print(f"Evaluated {len(todo)} cells in {time.perf_counter() - start_time:.1f}s, results in {results_path}")
+
+    for split in splits.values():
+        split.frames.close()
+    for outputs in clean.values():
+        for array in outputs.arrays:
+            array.close()
+
+
+def main():
+    args = parse_args()
+    evaluate(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import csv
+import time
+import argparse
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import torch
+
+from scripts import evaluate
+from scripts.evaluate import DETECTION_METRICS, batch_frames, batches, detection_row, drift, load_split
+from src.data.dataset import TUMTraf
+from src.models.checkpoint import load_model
+from src.models.export import calibration_batches, export_model
+from src.utils.serving import latency_summary
+
+RESULT_FIELDS = ["model", "variant", "artifact", "size_mb", "split", "samples", *DETECTION_METRICS, "map_delta",
+                 "drift_l2", "drift_abs", "latency_p50_ms", "latency_p99_ms", "throughput", "export_seconds"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export CPU optimized variants of a checkpoint (TorchScript, torch.compile, int8) and report their accuracy against their speed")
+    parser.add_argument("--data-path", type=str, default="data/preprocessed", help="Root path of the preprocessed data.")
+    parser.add_argument("--model-path", type=str, default=None, help="Checkpoint to export, defaults to checkpoints/ann_rgb.pt (--rgb) or checkpoints/snn_eb.pt (--eb).")
+    parser.add_argument("--rgb", action="store_true", help="The model takes RGB frames.")
+    parser.add_argument("--eb", action="store_true", help="The model takes EB transformed groups.")
+    parser.add_argument("--seq_len", type=int, default=None, help="EB sliding windows of seq_len frames instead of the preprocessed groups.")
+    parser.add_argument("--variants", type=str, default="fp32,script,compile,dynamic,static+script", help="Comma-separated variants, see src/models/export.py.")
+    parser.add_argument("--engine", type=str, default=torch.backends.quantized.engine, help=f"Quantized backend, one of {torch.backends.quantized.supported_engines}.")
+    parser.add_argument("--calib-split", type=str, default="train", help="Split of the calibration samples of static quantization.")
+    parser.add_argument("--calib-samples", type=int, default=32, help="Calibration samples, drawn at random.")
+    parser.add_argument("--split", type=str, default="test/day,test/night_with_light_off,test/night_with_light_on", help="Comma-separated list of splits of the report.")
+    parser.add_argument("--batch-size", type=int, default=8, help="Samples per forward pass of the evaluation and the throughput.")
+    parser.add_argument("--latency-samples", type=int, default=32, help="Samples timed one by one (latency) and batched (throughput) per split.")
+    parser.add_argument("--out-dir", type=str, default="checkpoints/export", help="Where the artifacts are written, as <checkpoint>_<variant>.pt.")
+    parser.add_argument("--results", type=str, default=None, help="CSV report, defaults to results/export_{camera}.csv.")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads, defaults to every CPU.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the calibration samples.")
+    return parser.parse_args()
+
+
+def calibration_samples(data_path:Path, split:str, camera:str, count:int, seed:int=0, seq_len=None) -> List[torch.Tensor]:
+    """count random samples of a split, as the evaluation reads them"""
+    label_folder = "OPENLabel_labels_fusion_gt_optimized" if split.startswith("test/") else "OPENLabel_labels"
+    dataset = TUMTraf(data_path / split / "images" / camera,
+                      data_path / split / f"{label_folder}_{'rgb' if camera == 'rgb' else 'eb'}",
+                      by_group=camera != "rgb" and seq_len is None, seq_len=seq_len if camera != "rgb" else None)
+    if len(dataset) == 0:
+        raise ValueError(f"no samples in {data_path / split} to calibrate on")
+    indices = np.random.default_rng(seed).permutation(len(dataset))[:count]
+    return [dataset[int(i)]["frame"] for i in sorted(indices)]
+
+
+@torch.inference_mode()
+def time_model(split:str, batch_size:int, samples:int, warmup:int=2) -> dict:
+    """
+    Latency of one sample per forward pass and throughput at batch_size, over the first samples of a split,
+    the first warmup passes (eg. torch.compile) are not timed
+    """
+    dataset = evaluate._splits[split].dataset
+    starts, lengths = dataset.sample_ranges()
+    single = [batch for batch in batches(lengths, 1)][:samples]
+    timed = []
+    for i, batch in enumerate(single[:warmup] + single):
+        x = batch_frames(split, starts, lengths, batch)
+        start_time = time.perf_counter()
+        evaluate._model(x.to(evaluate._device).float().div_(255.0))
+        if i >= warmup:
+            timed.append(time.perf_counter() - start_time)
+    batched = [batch for batch in batches(lengths[:samples], batch_size)]
+    seconds, count = 0.0, 0
+    for i, batch in enumerate(batched[:1] + batched):
+        x = batch_frames(split, starts, lengths, batch)
+        start_time = time.perf_counter()
+        evaluate._model(x.to(evaluate._device).float().div_(255.0))
+        if i >= 1:
+            seconds += time.perf_counter() - start_time
+            count += len(batch)
+    summary = latency_summary(timed)
+    return {"latency_p50_ms": summary["p50_ms"], "latency_p99_ms": summary["p99_ms"],
+            "throughput": count / seconds if seconds > 0 else float("nan")}
+
+
+def export(args):
+    data_path = Path(args.data_path)
+    camera = "eb_transformed" if args.eb and not args.rgb else "rgb"
+    model_path = Path(args.model_path or ("checkpoints/snn_eb.pt" if camera != "rgb" else "checkpoints/ann_rgb.pt"))
+    results_path = Path(args.results or f"results/export_{'eb' if camera != 'rgb' else 'rgb'}.csv")
+    variants = [variant for variant in args.variants.split(",") if variant]
+    # the reference of the deltas
+    variants = ["fp32"] + [variant for variant in variants if variant != "fp32"]
+    splits = [split for split in args.split.split(",") if split]
+    threads = args.threads or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+
+    model = load_model(model_path)
+    start_time = time.perf_counter()
+    calibration = calibration_batches(calibration_samples(data_path, args.calib_split, camera, args.calib_samples,
+                                                          args.seed, args.seq_len), args.batch_size)
+    print(f"Calibration: {sum(len(x) for x in calibration)} samples of {args.calib_split} "
+          f"in {time.perf_counter() - start_time:.1f}s")
+
+    artifacts = {}
+    for variant in variants:
+        path = Path(args.out_dir) / f"{model_path.stem}_{variant.replace('+', '_')}.pt"
+        start_time = time.perf_counter()
+        try:
+            export_model(model, variant, calibration, path, args.engine, str(model_path))
+        except (ValueError, RuntimeError) as e:
+            print(f"Skipping {variant}: {e}")
+            continue
+        artifacts[variant] = (path, time.perf_counter() - start_time)
+        print(f"Exported {variant} to {path} ({path.stat().st_size / 2**20:.1f} MiB) "
+              f"in {artifacts[variant][1]:.1f}s")
+
+    loaded = {split: load_split(data_path, split, camera, args.seq_len) for split in splits}
+    reference = {}
+    rows = []
+    for variant, (path, export_seconds) in artifacts.items():
+        # loaded back like any checkpoint, as the evaluation does
+        evaluate.init_worker(str(path), loaded, "cpu", threads)
+        for split in splits:
+            outputs, metrics = evaluate.predict(split, None, args.batch_size)
+            if variant == "fp32":
+                reference[split] = (outputs, metrics)
+            clean, clean_metrics = reference[split]
+            row = {"model": str(model_path), "variant": variant, "artifact": str(path),
+                   "size_mb": round(path.stat().st_size / 2**20, 2), "split": split,
+                   **drift(clean, outputs), **detection_row(metrics),
+                   **time_model(split, args.batch_size, args.latency_samples),
+                   "export_seconds": round(export_seconds, 2)}
+            row["map_delta"] = row["map"] - detection_row(clean_metrics)["map"]
+            rows.append(row)
+            print(f"{variant:<14} {split:<28} mAP {row['map']:.4f} ({row['map_delta']:+.4f}) "
+                  f"drift_l2 {row['drift_l2']:.4f}  latency p50 {row['latency_p50_ms']:.1f} ms "
+                  f"p99 {row['latency_p99_ms']:.1f} ms  {row['throughput']:.1f} samples/s")
+
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Report in {results_path}")
+    for split in loaded.values():
+        split.frames.close()
+
+
+def main():
+    args = parse_args()
+    export(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,19 @@
+import os
+import time
 import argparse
-import json
+from collections import deque
+from functools import partial
+from concurrent.futures import Executor, ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Tuple
+from queue import Queue
+from threading import Thread
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 import cv2
+import numpy as np
+from tqdm import tqdm
+
+from src.data.labels import ALL_CLASSES, ALL_CLASSES_CACHE_NAME, LabelIndex
 
 TYPE_COLOR_MAP: Dict[str, Tuple[int, int, int]] = {
     "CAR": (0, 255, 0),
@@ -27,6 +37,9 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--draw-bboxes", action="store_true", help="Overlay bounding boxes on top of each frame.")
     parser.add_argument("--bbox-color", type=str, default="0,255,0", help="Comma-separated BGR color to use as fallback when drawing boxes.")
     parser.add_argument("--bbox-thickness", type=int, default=2, help="Rectangle thickness when drawing boxes.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes rendering groups in parallel.")
+    parser.add_argument("--prefetch", type=int, default=None, help="Frames decoded ahead of the encoder in a producer thread, 0 disables it. Defaults to 4 when there are more cores than workers, else 0 (the threads would only compete for the same core).")
+    parser.add_argument("--concat", action="store_true", help="Write one video per split and camera with all its groups in order, instead of one video per group.")
     return parser.parse_args()
 
 
@@ -70,54 +83,31 @@ def ensure_output_dir(output_root: Path, split: str, camera: str) -> Path:
     return target
 
 
-def load_openlabel_root(payload: Dict) -> Optional[Dict]:
-    if "openlabel" in payload:
-        return payload.get("openlabel")
-    data_block = payload.get("data")
-    if isinstance(data_block, dict):
-        return data_block.get("openlabel")
-    return None
-
-
-def iter_frame_objects(openlabel_root: Dict) -> Iterable[Dict]:
-    frames = openlabel_root.get("frames", {})
-    for frame_key in sorted(frames.keys(), key=lambda item: int(item) if item.isdigit() else item):
-        frame = frames[frame_key]
-        objects = frame.get("objects", {})
-        for obj in objects.values():
-            yield obj
-
-
 BoundingBox = Tuple[int, int, int, int, str, Optional[str]]
 
 
-def extract_bboxes(label_file: Path) -> List[BoundingBox]:
-    if not label_file.exists():
-        return []
-    with label_file.open("r", encoding="utf-8") as handle:
-        payload = json.load(handle)
-    openlabel_root = load_openlabel_root(payload)
-    if not openlabel_root:
-        return []
-    boxes: List[BoundingBox] = []
-    for obj in iter_frame_objects(openlabel_root):
-        object_data = obj.get("object_data", {})
-        obj_name = object_data.get("name") or obj.get("name") or "object"
-        obj_type = object_data.get("type") or obj.get("type")
-        bbox_entries = object_data.get("bbox", [])
-        if not bbox_entries:
-            continue
-        full_bbox = next((entry for entry in bbox_entries if entry.get("name") == "full_bbox"), bbox_entries[0])
-        vals = full_bbox.get("val", [])
-        if len(vals) != 4:
-            continue
-        x_center, y_center, width, height = [float(val) for val in vals]
-        x_min = int(round(x_center - width / 2.0))
-        y_min = int(round(y_center - height / 2.0))
-        x_max = int(round(x_center + width / 2.0))
-        y_max = int(round(y_center + height / 2.0))
-        label_text = f"{obj_name} ({obj_type})" if obj_type else obj_name
-        boxes.append((x_min, y_min, x_max, y_max, label_text, obj_type))
+def open_labels(label_dir: Path) -> LabelIndex:
+    # every class is drawn, so the index over all of them is used (cached apart from the datasets' one)
+    return LabelIndex.open(label_dir, ALL_CLASSES, label_dir / ALL_CLASSES_CACHE_NAME)
+
+
+def group_boxes(labels: LabelIndex, group: str) -> Dict[str, List[BoundingBox]]:
+    """
+    Boxes of every labelled frame of a group, keyed by frame id, converted once for the whole group
+    full_bbox values (x_center, y_center, width, height) become pixel corners
+    """
+    group_id = int(np.searchsorted(labels.groups, group))
+    if group_id >= len(labels.groups) or labels.groups[group_id] != group:
+        return {}
+    frames = labels.group_frames(group_id)
+    objects = slice(int(labels.frame_offsets[frames.start]), int(labels.frame_offsets[frames.stop]))
+    centers, sizes = labels.boxes[objects, :2], labels.boxes[objects, 2:]
+    corners = np.round(np.concatenate([centers - sizes / 2.0, centers + sizes / 2.0], axis=1)).astype(int).tolist()
+    names = [labels.classes[class_id] for class_id in labels.class_ids[objects]]
+    boxes = {}
+    for frame in frames:
+        first, last = int(labels.frame_offsets[frame]) - objects.start, int(labels.frame_offsets[frame + 1]) - objects.start
+        boxes[str(labels.frame_ids[frame])] = [(*corners[i], names[i], names[i]) for i in range(first, last)]
     return boxes
 
 
@@ -146,40 +136,145 @@ def draw_bboxes(frame, boxes: List[BoundingBox], default_color: Tuple[int, int,
         cv2.putText(frame, text, (text_x, text_y - baseline), cv2.FONT_HERSHEY_SIMPLEX, text_scale, color, text_thickness, cv2.LINE_AA)
 
 
-def build_video(
-    group_dir: Path,
-    label_group_dir: Path,
-    video_path: Path,
-    fps: int,
-    draw_boxes: bool,
-    default_color: Tuple[int, int, int],
-    thickness: int,
-) -> None:
-    frames = sorted(group_dir.glob("*.jpg"))
-    if not frames:
-        print(f"No frames found in {group_dir}, skipping.")
-        return
-    sample = cv2.imread(str(frames[0]))
-    if sample is None:
-        print(f"Cannot read sample frame {frames[0]}, skipping.")
-        return
-    height, width = sample.shape[:2]
-    writer = cv2.VideoWriter(str(video_path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
-    if not writer.isOpened():
-        print(f"Failed to open VideoWriter for {video_path}.")
-        return
-    for frame_path in frames:
+class GroupVideo(NamedTuple):
+    """One group to render: its frames in order and the boxes of every frame"""
+    name: str
+    frames: List[Path]
+    boxes: List[List[BoundingBox]]
+    # None when the frames go into the video of the whole split
+    video_path: Optional[Path] = None
+
+
+class LazyVideoWriter:
+    """VideoWriter opened with the size of the first frame written, no frame is decoded just to know it"""
+
+    def __init__(self, video_path: Path, fps: int):
+        self.video_path = video_path
+        self.fps = fps
+        self.writer = None
+        self.size = None
+        self.frames = 0
+
+    def write(self, frame: np.ndarray) -> bool:
+        size = (frame.shape[1], frame.shape[0])
+        if self.writer is None:
+            self.writer = cv2.VideoWriter(str(self.video_path), cv2.VideoWriter_fourcc(*"mp4v"), self.fps, size)
+            self.size = size
+            if not self.writer.isOpened():
+                raise RuntimeError(f"Failed to open VideoWriter for {self.video_path}.")
+        if size != self.size:
+            print(f"Frame of size {size} does not fit {self.video_path} ({self.size}), skipping frame.")
+            return False
+        self.writer.write(frame)
+        self.frames += 1
+        return True
+
+    def release(self) -> None:
+        if self.writer is not None:
+            self.writer.release()
+
+
+def render_frames(task: GroupVideo, default_color: Tuple[int, int, int], thickness: int) -> Iterator[np.ndarray]:
+    """Decodes every frame of a group once and draws its boxes"""
+    for frame_path, boxes in zip(task.frames, task.boxes):
         frame = cv2.imread(str(frame_path))
         if frame is None:
             print(f"Failed to read frame {frame_path}, skipping frame.")
             continue
-        if draw_boxes:
-            label_file = label_group_dir / f"{frame_path.stem}.json"
-            boxes = extract_bboxes(label_file)
-            if boxes:
-                draw_bboxes(frame, boxes, default_color, thickness)
-        writer.write(frame)
-    writer.release()
+        if boxes:
+            draw_bboxes(frame, boxes, default_color, thickness)
+        yield frame
+
+
+def prefetch(items: Iterable, size: int) -> Iterator:
+    """
+    Producer/consumer stream: items are produced in a background thread, up to size ahead of the consumer
+    opencv releases the GIL, so decoding and drawing overlap with the encoding of the consumer
+    """
+    queue: Queue = Queue(maxsize=size)
+    done = object()
+    errors: List[BaseException] = []
+
+    def produce() -> None:
+        try:
+            for item in items:
+                queue.put(item)
+        except BaseException as error:
+            errors.append(error)
+        finally:
+            queue.put(done)
+
+    thread = Thread(target=produce, daemon=True)
+    thread.start()
+    while True:
+        item = queue.get()
+        if item is done:
+            break
+        yield item
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def ordered_map(function: Callable, items: Iterable, executor: Optional[Executor], ahead: int) -> Iterator:
+    """Results of function over items in order, computed in the executor with at most ahead of them pending"""
+    if executor is None:
+        yield from map(function, items)
+        return
+    pending: deque = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def build_video(task: GroupVideo, fps: int, default_color: Tuple[int, int, int], thickness: int, ahead: int = 0) -> int:
+    """
+    Renders a group to its own video
+    :param ahead: with > 0, frames are decoded and drawn up to ahead frames in advance while the previous ones are encoded
+
+    :return: number of frames written
+    """
+    writer = LazyVideoWriter(task.video_path, fps)
+    frames = render_frames(task, default_color, thickness)
+    try:
+        for frame in (prefetch(frames, ahead) if ahead > 0 else frames):
+            writer.write(frame)
+    finally:
+        writer.release()
+    return writer.frames
+
+
+def render_group(task: GroupVideo, default_color: Tuple[int, int, int], thickness: int) -> List[np.ndarray]:
+    """Decoded frames of a group with their boxes, for the video of the whole split"""
+    return list(render_frames(task, default_color, thickness))
+
+
+def init_worker() -> None:
+    # each process already gets its own core, keep opencv from spawning threads on top
+    cv2.setNumThreads(1)
+
+
+def plan_groups(image_dir: Path, label_dir: Path, output_dir: Optional[Path], draw_boxes: bool, rewrite: bool) -> List[GroupVideo]:
+    """
+    Groups of a split/camera to render, with their boxes read from the label index
+    :param output_dir: folder of the per group videos, None for the video of the whole split (nothing is skipped)
+    """
+    labels = open_labels(label_dir) if draw_boxes else None
+    tasks = []
+    for group_dir in sorted(entry for entry in image_dir.iterdir() if entry.is_dir()):
+        video_path = output_dir / f"{group_dir.name}.mp4" if output_dir is not None else None
+        if video_path is not None and video_path.exists() and not rewrite:
+            continue
+        frames = sorted(group_dir.glob("*.jpg"))
+        if not frames:
+            print(f"No frames found in {group_dir}, skipping.")
+            continue
+        boxes = group_boxes(labels, group_dir.name) if labels is not None else {}
+        tasks.append(GroupVideo(group_dir.name, frames, [boxes.get(frame.stem, []) for frame in frames], video_path))
+    return tasks
 
 
 def select_cameras(args: argparse.Namespace) -> List[str]:
@@ -200,8 +295,12 @@ def main() -> None:
     if not input_root.exists():
         raise FileNotFoundError(f"Input path {input_root} does not exist.")
     cameras = select_cameras(args)
-    fallback_color: Optional[Tuple[int, int, int]] = parse_color(args.bbox_color) if args.draw_bboxes else None
+    default_color = parse_color(args.bbox_color) if args.draw_bboxes else (0, 255, 0)
     splits = [entry.strip() for entry in args.split.split(",") if entry.strip()]
+
+    # (video path, groups) of every split/camera with --concat, else a single list of per group videos
+    concat_jobs: List[Tuple[Path, List[GroupVideo]]] = []
+    group_jobs: List[GroupVideo] = []
     for split in splits:
         split_root = split_path(input_root, split)
         if not split_root.exists():
@@ -215,24 +314,55 @@ def main() -> None:
             label_dir = camera_label_dir(split_root, split, camera)
             if not label_dir.exists() and args.draw_bboxes:
                 print(f"Label directory {label_dir} missing; videos will be generated without boxes.")
-            output_dir = ensure_output_dir(output_root, split, camera)
-            group_dirs = [entry for entry in sorted(image_dir.iterdir()) if entry.is_dir()]
-            for group_dir in group_dirs:
-                video_path = output_dir / f"{group_dir.name}.mp4"
+            draw_boxes = args.draw_bboxes and label_dir.exists()
+            if args.concat:
+                video_path = split_path(output_root, split) / f"{'rgb' if camera == 'rgb' else 'eb'}.mp4"
+                video_path.parent.mkdir(parents=True, exist_ok=True)
                 if video_path.exists() and not args.rewrite:
                     print(f"Video {video_path} already exists, skipping.")
                     continue
-                label_group_dir = label_dir / group_dir.name if label_dir.exists() else Path()
-                build_video(
-                    group_dir,
-                    label_group_dir,
-                    video_path,
-                    args.fps,
-                    args.draw_bboxes and label_dir.exists(),
-                    fallback_color if fallback_color else (0, 255, 0),
-                    args.bbox_thickness,
-                )
-                print(f"Wrote {video_path}")
+                concat_jobs.append((video_path, plan_groups(image_dir, label_dir, None, draw_boxes, args.rewrite)))
+            else:
+                output_dir = ensure_output_dir(output_root, split, camera)
+                tasks = plan_groups(image_dir, label_dir, output_dir, draw_boxes, args.rewrite)
+                skipped = sum(1 for entry in image_dir.iterdir() if entry.is_dir()) - len(tasks)
+                if skipped:
+                    print(f"{skipped} videos of {split}/{camera} already exist, skipping them.")
+                group_jobs += tasks
+
+    start = time.perf_counter()
+    total_frames = sum(len(task.frames) for task in group_jobs) + \
+        sum(len(task.frames) for _, tasks in concat_jobs for task in tasks)
+    executor = ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) if args.workers > 1 else None
+    ahead = args.prefetch if args.prefetch is not None else (4 if (os.cpu_count() or 1) > args.workers else 0)
+    render_video = partial(build_video, fps=args.fps, default_color=default_color, thickness=args.bbox_thickness,
+                           ahead=ahead)
+    render_frames_of = partial(render_group, default_color=default_color, thickness=args.bbox_thickness)
+    try:
+        with tqdm(total=total_frames, unit="frame", desc="Rendering") as progress:
+            # every group is an independent video, fanned out to the workers
+            for written in ordered_map(render_video, group_jobs, executor, ahead=4 * args.workers):
+                progress.update(written)
+            for video_path, tasks in concat_jobs:
+                # workers decode and draw the next groups, in order, while this process encodes the split video
+                writer = LazyVideoWriter(video_path, args.fps)
+                groups = ordered_map(render_frames_of, tasks, executor, ahead=2 * args.workers)
+                try:
+                    for frames in (prefetch(groups, 2) if ahead > 0 else groups):
+                        for frame in frames:
+                            writer.write(frame)
+                        progress.update(len(frames))
+                finally:
+                    writer.release()
+                print(f"Wrote {video_path} ({writer.frames} frames of {len(tasks)} groups)")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if group_jobs:
+        print(f"Wrote {len(group_jobs)} videos to {output_root}")
+    elapsed = time.perf_counter() - start
+    print(f"Rendered {total_frames} frames in {elapsed:.1f}s with {args.workers} worker(s): "
+          f"{total_frames / max(elapsed, 1e-9):.1f} frames/s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+from src.data.alignment import ALIGNMENT_NAME, load_alignment
+from src.data.dataset import TUMTraf
+from src.data.labels import ALL_CLASSES, ALL_CLASSES_CACHE_NAME, LabelIndex
+from src.data.timestamps import TIMESTAMPS_NAME, load_timestamps
+
+CAMERAS = {"rgb": "rgb", "eb": "eb_transformed"}
+# COCO area ranges, in pixels
+SMALL_AREA, MEDIUM_AREA = 32 ** 2, 96 ** 2
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Class statistics and label audit of the preprocessed splits, from the label index (no image is read)")
+    parser.add_argument("--data-path", type=str, default="data/preprocessed", help="Root path of the preprocessed data.")
+    parser.add_argument("--split", type=str, default="train,val,test/day,test/night_with_light_off,test/night_with_light_on", help="Comma-separated list of splits.")
+    parser.add_argument("--all-classes", action="store_true", help="Count every class of the labels, including the ones the datasets drop (eg. MOTORCYCLE).")
+    parser.add_argument("--min-count", type=int, default=0, help="Exit with an error when a class has fewer objects than this in a split/camera.")
+    parser.add_argument("--max-ratio", type=float, default=0, help="Exit with an error when the most frequent class of a split/camera has more than this times the objects of the least frequent one (0 disables).")
+    parser.add_argument("--json", type=str, default=None, help="Also write the statistics as JSON to this file.")
+    return parser.parse_args()
+
+
+def label_dir(split_path:Path, split:str, camera:str) -> Path:
+    # test splits only ship the fusion optimized labels
+    folder = "OPENLabel_labels_fusion_gt_optimized" if split.startswith("test/") else "OPENLabel_labels"
+    return split_path / f"{folder}_{camera}"
+
+
+def open_labels(path:Path, classes:Sequence[str]) -> LabelIndex:
+    # the datasets' cache is only reused for their own classes, so the two never invalidate each other
+    cache_path = None if list(classes) == list(TUMTraf.CLASSES) else path / ALL_CLASSES_CACHE_NAME
+    return LabelIndex.open(path, classes, cache_path)
+
+
+def camera_stats(labels:LabelIndex, num_frames:Optional[int]=None) -> dict:
+    """
+    Statistics of the labels of a split/camera, all computed on the columns of the index
+    :param labels: label index of the split/camera
+    :param num_frames: frames of the split/camera (with or without label file), when known
+
+    :return: dict of counts, ratios and box size percentiles
+    """
+    objects_per_frame = np.diff(labels.frame_offsets)
+    counts = np.bincount(labels.class_ids.astype(np.int64), minlength=len(labels.classes))
+    objects_per_group = np.add.reduceat(objects_per_frame, labels.group_offsets[:-1]) \
+        if len(labels) else np.zeros(0, dtype=np.int64)
+    # reduceat takes the next frame for empty groups, groups without frames have no objects
+    objects_per_group[np.diff(labels.group_offsets) == 0] = 0
+
+    sizes = labels.boxes[:, 2:4].astype(np.float64)
+    area = sizes[:, 0] * sizes[:, 1]
+    box_sizes = {}
+    for class_id, name in enumerate(labels.classes):
+        of_class = labels.class_ids == class_id
+        if not of_class.any():
+            continue
+        width, height = np.percentile(sizes[of_class], [5, 50, 95], axis=0).T
+        class_area = area[of_class]
+        box_sizes[name] = {"width_p5_p50_p95": width.round(1).tolist(), "height_p5_p50_p95": height.round(1).tolist(),
+                           "small": int((class_area < SMALL_AREA).sum()),
+                           "medium": int(((class_area >= SMALL_AREA) & (class_area < MEDIUM_AREA)).sum()),
+                           "large": int((class_area >= MEDIUM_AREA).sum())}
+
+    empty_frames = int((objects_per_frame == 0).sum())
+    stats = {"label_files": len(labels), "objects": labels.num_objects,
+             "classes": {name: int(count) for name, count in zip(labels.classes, counts)},
+             "empty_frames": empty_frames, "empty_frame_ratio": empty_frames / max(len(labels), 1),
+             "groups": len(labels.groups), "empty_groups": int((objects_per_group == 0).sum()),
+             "objects_per_frame_mean": float(objects_per_frame.mean()) if len(labels) else 0.0,
+             "box_sizes": box_sizes}
+    if num_frames is not None:
+        # frames without label file count as empty
+        stats["frames"] = num_frames
+        stats["unlabelled_frames"] = num_frames - len(labels)
+    return stats
+
+
+def paired_stats(rgb:LabelIndex, eb:LabelIndex, alignment:dict) -> dict:
+    """Object counts of the RGB/EB frame pairs of the alignment index, per frame and per class"""
+    counts = []
+    for labels, stems in ((rgb, alignment["rgb_frame"]), (eb, alignment["eb_frame"])):
+        objects_per_frame = np.diff(labels.frame_offsets)
+        order = np.argsort(labels.frame_ids)
+        pos = np.minimum(np.searchsorted(labels.frame_ids[order], stems), max(len(order) - 1, 0))
+        found = labels.frame_ids[order][pos] == stems if len(order) else np.zeros(len(stems), dtype=bool)
+        counts.append(np.where(found, objects_per_frame[order[pos]] if len(order) else 0, 0))
+    rgb_counts, eb_counts = counts
+    diff = np.abs(rgb_counts - eb_counts)
+    return {"frame_pairs": len(rgb_counts), "same_count": int((diff == 0).sum()),
+            "close_count": int((diff <= np.maximum(rgb_counts, eb_counts) * 0.1).sum()),
+            "rgb_objects": int(rgb_counts.sum()), "eb_objects": int(eb_counts.sum())}
+
+
+def report(split:str, stats:dict) -> None:
+    print(f"\n--- {split} ---")
+    for camera, camera_stats in stats["cameras"].items():
+        frames = f", {camera_stats['unlabelled_frames']} frames without labels" if "frames" in camera_stats else ""
+        print(f"{camera.upper()}: {camera_stats['objects']} objects in {camera_stats['label_files']} labelled frames{frames}, "
+              f"empty frames {camera_stats['empty_frames']} ({camera_stats['empty_frame_ratio'] * 100:.2f}%), "
+              f"empty groups {camera_stats['empty_groups']}/{camera_stats['groups']}")
+        for name, count in sorted(camera_stats["classes"].items(), key=lambda item: -item[1]):
+            sizes = camera_stats["box_sizes"].get(name)
+            size = f"  w p50 {sizes['width_p5_p50_p95'][1]:.0f} h p50 {sizes['height_p5_p50_p95'][1]:.0f} " \
+                   f"S/M/L {sizes['small']}/{sizes['medium']}/{sizes['large']}" if sizes else ""
+            print(f"  {name:<11} {count:>7}{size}")
+    if "ratio" in stats:
+        print(f"Objects EB/RGB: {stats['ratio']['objects']:.2f}  " +
+              " ".join(f"{name}={ratio:.2f}" for name, ratio in stats["ratio"]["classes"].items()))
+    if "pairs" in stats:
+        pairs = stats["pairs"]
+        print(f"Aligned frame pairs: {pairs['frame_pairs']}, same object count {pairs['same_count']}, "
+              f"close (<10% diff) {pairs['close_count']}")
+
+
+def audit(stats:dict, min_count:int, max_ratio:float):
+    """Failed checks of every split/camera, as messages"""
+    failures = []
+    for split, split_stats in stats.items():
+        for camera, camera_stats in split_stats["cameras"].items():
+            counts = camera_stats["classes"]
+            for name, count in counts.items():
+                if count < min_count:
+                    failures.append(f"{split}/{camera}: {name} has {count} objects (< {min_count})")
+            if max_ratio > 0 and counts:
+                most, least = max(counts.values()), min(counts.values())
+                if most > max_ratio * least:
+                    failures.append(f"{split}/{camera}: class imbalance {most}/{least} (> {max_ratio})")
+    return failures
+
+
+def label_stats(args) -> dict:
+    data_path = Path(args.data_path)
+    classes = ALL_CLASSES if args.all_classes else TUMTraf.CLASSES
+    stats = {}
+    for split in [split for split in args.split.split(",") if split]:
+        start_time = time.perf_counter()
+        split_path = data_path / split
+        labels, split_stats = {}, {"cameras": {}}
+        for camera, folder in CAMERAS.items():
+            path = label_dir(split_path, split, camera)
+            if not path.is_dir():
+                continue
+            labels[camera] = open_labels(path, classes)
+            timestamps_path = split_path / "images" / folder / TIMESTAMPS_NAME
+            num_frames = len(load_timestamps(timestamps_path)["file_ids"]) if timestamps_path.exists() else None
+            split_stats["cameras"][camera] = camera_stats(labels[camera], num_frames)
+        if len(labels) == 2:
+            rgb, eb = split_stats["cameras"]["rgb"], split_stats["cameras"]["eb"]
+            split_stats["ratio"] = {"objects": eb["objects"] / max(rgb["objects"], 1),
+                                    "classes": {name: eb["classes"][name] / rgb["classes"][name]
+                                                for name in classes if rgb["classes"][name]}}
+            if (split_path / ALIGNMENT_NAME).exists():
+                split_stats["pairs"] = paired_stats(labels["rgb"], labels["eb"], load_alignment(split_path / ALIGNMENT_NAME))
+        split_stats["seconds"] = round(time.perf_counter() - start_time, 3)
+        stats[split] = split_stats
+        report(split, split_stats)
+    return stats
+
+
+def main():
+    args = parse_args()
+    stats = label_stats(args)
+    if args.json:
+        Path(args.json).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump(stats, f, indent=2)
+    failures = audit(stats, args.min_count, args.max_ratio)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
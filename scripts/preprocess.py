@@ -1,18 +1,34 @@
 import os
 import json
+import time
+import hashlib
 import argparse
 from pathlib import Path
 from collections import defaultdict
-from shutil import copy2
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from shutil import copy2, rmtree
+from typing import List, NamedTuple, Optional, Tuple
 import cv2
+import numpy as np
+from tqdm import tqdm
+
+from src.data.alignment import ALIGNMENT_NAME, build_alignment, load_alignment, save_alignment
+from src.data.events import SPARSE_GROUP_NAME, dense_to_events, save_events
+from src.data.sequences import find_windows
+from src.data.timestamps import TIMESTAMPS_NAME, load_timestamps, parse_timestamps, save_timestamps, timestamp_index
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# index of the packed and sparse formats, shared with src.data.dataset
+PACKED_INDEX_NAME = "index.json"
+SHARD_NAME = "frames_{:05d}.npy"
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Preprocess data frm TUMTraf Event dataset")
     parser.add_argument("--data-path", type=str, default="data/TUMTraf_Event_Dataset", help="Root path of the data.")
     parser.add_argument("--out-path", type=str, default="data/preprocessed", help="Output path for preprocessed data.")
-    parser.add_argument("--rewrite", action="store_true", help="Rewrite existing content in output path.")
+    parser.add_argument("--rewrite", action="store_true", help="Rewrite existing content in output path, ignoring the manifest.")
     parser.add_argument("--rgb", action="store_true", help="Process only RGB split.")
     parser.add_argument("--eb", action="store_true", help="Process only EB transformed split.")
     parser.add_argument("--all", action="store_true", help="Process both RGB and EB transformed splits.")
@@ -20,60 +36,260 @@ def parse_args():
     parser.add_argument("--eb_roi_path", type=str, default="data/TUMTraf_Event_Dataset/calibration/intrinsic/eb_8mm_roi.txt", help="Path to EB ROI JSON file.")
     parser.add_argument("--n_frames", type=int, default=8, help="Number of frames per video group.")
     parser.add_argument("--max_time_diff", type=int, default=1000, help="Maximum time difference (ms) between frames in a group.")
+    parser.add_argument("--format", type=str, choices=["jpg", "packed", "sparse"], default="jpg", help="Write grouped frames as jpg folders, packed into memory-mappable .npy shards, or as per group lists of non-zero pixels (sparse, for the EB frames).")
+    parser.add_argument("--groups-per-shard", type=int, default=128, help="Number of groups stored in each .npy shard with --format packed.")
+    parser.add_argument("--fingerprint", type=str, choices=["stat", "content"], default="stat", help="How source files are fingerprinted in the manifest: size/mtime or content hash.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes writing groups in parallel.")
+    parser.add_argument("--align_tolerance", type=float, default=50, help="Maximum time difference (ms) of a RGB/EB frame pair in the alignment index, rebuilt when a camera is rewritten.")
     return parser.parse_args()
 
 
 
-def group_frames(src_image_path:Path, dest_image_path:Path, 
-                 src_label_path:Path, dest_label_path:Path, 
-                 n_frames:int, max_time_diff:int=1000) -> None:
+class GroupTask(NamedTuple):
+    """One unit of preprocessing work: a single group of frames of one split and camera"""
+    split: str
+    camera: str
+    group_id: int
+    frames: List[Path]
+    dest_image_path: Path
+    src_label_path: Path
+    dest_label_path: Path
+    roi: Optional[dict] = None
+    # (shard file, first frame index in the shard) when writing the packed format
+    pack: Optional[Tuple[Path, int]] = None
+    # coordinate list file of the group when writing the sparse format
+    sparse: Optional[Path] = None
+
+
+def group_frames(frame_files:List[Path], n_frames:int, max_time_diff:int=1000) -> List[List[Path]]:
     """
-    Group images and labels from src_path into dest_path in n_frames chunks, ensuring that the time difference between consecutive frames does not exceed max_time_diff.
+    Group frames in n_frames chunks, ensuring that the time difference between consecutive frames does not exceed max_time_diff.
+    Groups are returned in timestamp order, so the position of a group in the list is its (deterministic) group id.
+    All stems are parsed at once, runs are split where the gap exceeds max_time_diff and cut into n_frames chunks
+    from their first frame, incomplete chunks at the end of a run are dropped.
+    :param frame_files: Sorted list of frame images, named by timestamp
+    :param n_frames: Number of frames per group
+    :param max_time_diff: Maximum time difference (ms) between frames in a group
+
+    :return: list of groups, each one a list of n_frames frame paths
+    """
+    # gaps are compared in whole milliseconds
+    timestamps_ms = parse_timestamps([frame_file.stem for frame_file in frame_files]) // 1000
+    starts, _ = find_windows(timestamps_ms * 1000, n_frames, stride=n_frames, max_time_diff=max_time_diff)
+    return [frame_files[start:start + n_frames] for start in starts]
+
+
+def plan_groups(split:str, camera:str,
+                src_image_path:Path, dest_image_path:Path,
+                src_label_path:Path, dest_label_path:Path,
+                n_frames:int, max_time_diff:int=1000, roi:Optional[dict]=None) -> List[GroupTask]:
+    """
+    Finds the groups of a split/camera and turns them into work units, nothing is written yet.
+    :param split: Name of the split (eg. train, test/day)
+    :param camera: Camera folder name (rgb or eb_transformed)
     :param src_image_path: Path to the directory containing frame images
     :param dest_image_path: Path to the directory where grouped frames will be written
     :param src_label_path: Path to the directory containing frame labels
-    :param out_label_path: Path to the directory where grouped labels will be written
+    :param dest_label_path: Path to the directory where grouped labels will be written
     :param n_frames: Number of frames per group
     :param max_time_diff: Maximum time difference (ms) between frames in a group
+    :param roi: ROI to crop every frame and label to, None to copy the frames as they are
 
-    :return: None, it writes direclty all the data
+    :return: list of GroupTask, one per group
     """
-    
     frame_files = sorted(src_image_path.glob("*.jpg"))
     print(f"Found {len(frame_files)} frames in {src_image_path}")
-    grouped_frames = []
-    current_group = []
-    last_timestamp = None
-    for frame_file in frame_files:
-        timestamp = int(datetime.strptime(frame_file.stem, "%Y%m%d-%H%M%S.%f").timestamp() * 1000)
-        # ValueError: invalid literal for int() with base 10: '20231114-084328.739529
-        if last_timestamp is None:
-            current_group.append(frame_file)
-        else:
-            time_diff = timestamp - last_timestamp
-            if time_diff <= max_time_diff and len(current_group) < n_frames:
-                current_group.append(frame_file)
-            else:
-                if len(current_group) == n_frames:
-                    grouped_frames.append(current_group)
-                current_group = [frame_file]
-        last_timestamp = timestamp
-    if len(current_group) == n_frames:
-        grouped_frames.append(current_group)
-    # now write the grouped frames and labels
-    for group_id, group in enumerate(grouped_frames):
-        group_dir = dest_image_path / f"{group_id:04d}"
-        os.makedirs(group_dir, exist_ok=True)
-
-        label_group_dir = dest_label_path / f"{group_id:04d}"
-        os.makedirs(label_group_dir, exist_ok=True)
-
-        for frame in group:
+    return [GroupTask(split, camera, group_id, group,
+                      dest_image_path, src_label_path, dest_label_path, roi)
+            for group_id, group in enumerate(group_frames(frame_files, n_frames, max_time_diff))]
+
+
+def write_group(task:GroupTask) -> int:
+    """
+    Writes the frames and labels of one group. Without ROI files are copied as they are,
+    with ROI every source frame and label is read once and the cropped version is written straight
+    to the destination (no intermediate copy to read back and overwrite).
+    Only touches the group's own folders, so tasks can run in any order or process.
+    :param task: the group to write
+
+    :return: number of frames written
+    """
+    label_group_dir = task.dest_label_path / f"{task.group_id:04d}"
+    os.makedirs(label_group_dir, exist_ok=True)
+
+    if task.sparse is not None:
+        frames = np.stack([load_frame_array(frame, task.roi) for frame in task.frames])
+        save_events(task.sparse, dense_to_events(frames))
+        copy_labels(task, label_group_dir)
+        return len(task.frames)
+
+    if task.pack is not None:
+        shard_path, offset = task.pack
+        shard = np.load(shard_path, mmap_mode="r+")
+        for i, frame in enumerate(task.frames):
+            shard[offset + i] = load_frame_array(frame, task.roi)
+        copy_labels(task, label_group_dir)
+        shard.flush()
+        del shard
+        return len(task.frames)
+
+    group_dir = task.dest_image_path / f"{task.group_id:04d}"
+    os.makedirs(group_dir, exist_ok=True)
+
+    for frame in task.frames:
+        label_file = task.src_label_path / f"{frame.stem}.json"
+        if task.roi is None:
             copy2(frame, group_dir / frame.name)
             # copy the corresponding label
-            label_file = src_label_path / f"{frame.stem}.json"
             if label_file.exists():
                 copy2(label_file, label_group_dir / label_file.name)
+        else:
+            roi_frame(frame, group_dir / frame.name, task.roi)
+            if label_file.exists():
+                roi_label(label_file, label_group_dir / label_file.name, task.roi)
+    return len(task.frames)
+
+
+def copy_labels(task:GroupTask, label_group_dir:Path) -> None:
+    """Copies the labels of the frames of a group, shifted to the ROI when there is one"""
+    for frame in task.frames:
+        label_file = task.src_label_path / f"{frame.stem}.json"
+        if label_file.exists():
+            if task.roi is None:
+                copy2(label_file, label_group_dir / label_file.name)
+            else:
+                roi_label(label_file, label_group_dir / label_file.name, task.roi)
+
+
+def load_frame_array(src_frame:Path, roi:Optional[dict]=None) -> np.ndarray:
+    """
+    Decodes a frame in the layout of torchvision's decode_image, [C, H, W] uint8 in RGB order
+    With ROI the frame is cropped and converted to grayscale like roi_frame does, and goes through the same
+    JPEG round trip as the frames roi_frame writes, so every --format gives the model the same pixels
+    :param src_frame: path to the original frame
+    :param roi: ROI coordinates (x, y, width, height), or None to keep the full RGB frame
+
+    :return: array of shape [C, H, W]
+    """
+    img = cv2.imread(str(src_frame))
+    if roi is None:
+        return np.ascontiguousarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB).transpose(2, 0, 1))
+    x, y, w, h = roi["x"], roi["y"], roi["width"], roi["height"]
+    gray_img = cv2.cvtColor(img[y:h, x:w], cv2.COLOR_BGR2GRAY)
+    # the raw crop is up to a few gray levels away from the re-encoded one on about half of the pixels
+    _, encoded = cv2.imencode(".jpg", gray_img)
+    return cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED)[None]
+
+
+def plan_packed(tasks:List[GroupTask], dest_image_path:Path, groups_per_shard:int) -> List[GroupTask]:
+    """
+    Allocates the .npy shards of a split/camera and assigns every group its slot, groups are never split across shards.
+    Writes the index (frame shape, and shard/offset/frame ids of every group) next to the shards.
+    :param tasks: groups of one split/camera, as returned by plan_groups
+    :param dest_image_path: folder for the shards and index
+    :param groups_per_shard: number of groups per shard
+
+    :return: the same tasks with their shard slot set
+    """
+    os.makedirs(dest_image_path, exist_ok=True)
+    if not tasks:
+        shape = []
+    else:
+        # all frames of a camera share the size, the first one defines the shard shape
+        shape = list(load_frame_array(tasks[0].frames[0], tasks[0].roi).shape)
+    index = {"shape": shape, "dtype": "uint8", "groups": []}
+    packed_tasks = []
+    for shard_id, start in enumerate(range(0, len(tasks), groups_per_shard)):
+        shard_tasks = tasks[start:start + groups_per_shard]
+        shard_name = SHARD_NAME.format(shard_id)
+        n_shard_frames = sum(len(task.frames) for task in shard_tasks)
+        shard = np.lib.format.open_memmap(dest_image_path / shard_name, mode="w+", dtype=np.uint8,
+                                          shape=(n_shard_frames, *shape))
+        del shard
+        offset = 0
+        for task in shard_tasks:
+            index["groups"].append({"id": f"{task.group_id:04d}", "shard": shard_name, "offset": offset,
+                                    "frames": [frame.stem for frame in task.frames]})
+            packed_tasks.append(task._replace(pack=(dest_image_path / shard_name, offset)))
+            offset += len(task.frames)
+    with open(dest_image_path / PACKED_INDEX_NAME, "w") as f:
+        json.dump(index, f)
+    return packed_tasks
+
+
+def plan_sparse(tasks:List[GroupTask], dest_image_path:Path) -> List[GroupTask]:
+    """
+    Assigns every group its coordinate list file and writes the index (frame shape, file and frame ids of every group).
+    Mostly empty frames (the EB ones) become a few events instead of dense pixels, see src/data/events.py.
+    :param tasks: groups of one split/camera, as returned by plan_groups
+    :param dest_image_path: folder for the group files and index
+
+    :return: the same tasks with their file set
+    """
+    os.makedirs(dest_image_path, exist_ok=True)
+    shape = list(load_frame_array(tasks[0].frames[0], tasks[0].roi).shape) if tasks else []
+    index = {"format": "sparse", "shape": shape, "dtype": "uint8", "groups": []}
+    sparse_tasks = []
+    for task in tasks:
+        file_name = SPARSE_GROUP_NAME.format(task.group_id)
+        index["groups"].append({"id": f"{task.group_id:04d}", "file": file_name,
+                                "frames": [frame.stem for frame in task.frames]})
+        sparse_tasks.append(task._replace(sparse=dest_image_path / file_name))
+    with open(dest_image_path / PACKED_INDEX_NAME, "w") as f:
+        json.dump(index, f)
+    return sparse_tasks
+
+
+def write_alignment(split_path:Path, rgb:dict, eb:dict, tolerance_ms:float) -> dict:
+    """
+    Pairs the RGB and EB frames and groups of a split by capture time, group ids of the two cameras are unrelated
+    otherwise (each camera is grouped on its own). See src/data/alignment.py
+    :param split_path: output folder of the split, the index is written there
+    :param rgb: timestamp index of the RGB frames
+    :param eb: timestamp index of the EB frames
+    :param tolerance_ms: Maximum time difference (ms) of a frame pair
+
+    :return: the alignment index
+    """
+    alignment = build_alignment(rgb, eb, tolerance_ms)
+    save_alignment(split_path / ALIGNMENT_NAME, alignment)
+    group_ids, group_sizes = np.unique(rgb["group_ids"], return_counts=True)
+    group_sizes = dict(zip(group_ids, group_sizes))
+    full = sum(int(count) == group_sizes[group_id]
+               for group_id, count in zip(alignment["group_rgb"], alignment["group_frames"]))
+    print(f"Aligned {split_path}: {len(alignment['rgb_frame'])} frame pairs "
+          f"({len(rgb['file_ids'])} RGB, {len(eb['file_ids'])} EB frames), "
+          f"{len(alignment['group_rgb'])} group pairs, {full} with every frame paired")
+    return alignment
+
+
+def init_worker() -> None:
+    # each process already gets its own core, keep opencv from spawning threads on top
+    cv2.setNumThreads(1)
+
+
+def run_tasks(tasks:List[GroupTask], workers:int=1) -> None:
+    """
+    Writes all the groups, serially or spread across a pool of worker processes.
+    The output does not depend on the number of workers, group ids are fixed when planning.
+    :param tasks: groups to write
+    :param workers: number of worker processes, 1 runs everything in the current process
+    """
+    total_frames = sum(len(task.frames) for task in tasks)
+    start = time.perf_counter()
+    with tqdm(total=total_frames, unit="frame", desc="Writing groups") as progress:
+        if workers <= 1:
+            for task in tasks:
+                progress.update(write_group(task))
+        else:
+            chunksize = max(1, len(tasks) // (workers * 8))
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+                for written in executor.map(write_group, tasks, chunksize=chunksize):
+                    progress.update(written)
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {len(tasks)} groups ({total_frames} frames) in {elapsed:.1f}s "
+          f"with {workers} worker(s): {len(tasks) / max(elapsed, 1e-9):.1f} groups/s, "
+          f"{total_frames / max(elapsed, 1e-9):.1f} frames/s")
 
 
 
@@ -93,117 +309,230 @@ def load_eb_roi(eb_roi_path):
     return {"x": 130, "width": 612, "y": 9, "height": 451 }
 
 
-import time
-def apply_roi(image_path:Path, label_path:Path, roi:dict) -> None:
+def roi_frame(src_frame:Path, dest_frame:Path, roi:dict) -> None:
     """
-    Applies the ROI transformation to labels and grouped images
+    Crops a frame to the ROI and converts it to grayscale, in a single read and write
     Assumes the images used are the eb_transformed ones. RGB roi not implemented
-    :param image_path: path to gruped frames
-    :param label_path: path to labels
+    :param src_frame: path to the original frame
+    :param dest_frame: path where the cropped frame is written, can be the same as src_frame
     :param roi: ROI coordinates (x, y, width, height)
+    """
+    # load image
+    img = cv2.imread(str(src_frame))
+    # crop
+    x, y, w, h = roi["x"], roi["y"], roi["width"], roi["height"]
+    cropped_img = img[y:h, x:w]
+    gray_img = cv2.cvtColor(cropped_img, cv2.COLOR_BGR2GRAY)
+    status = cv2.imwrite(str(dest_frame), gray_img)
+    if not status:
+        print (f"Error writing cropped image {dest_frame}")
+
+
+def roi_label(src_label:Path, dest_label:Path, roi:dict) -> None:
+    """
+    Shifts the full_bbox of every object in a label file to the ROI coordinates
+    :param src_label: path to the original OpenLABEL file
+    :param dest_label: path where the shifted labels are written, can be the same as src_label
+    :param roi: ROI coordinates (x, y, width, height)
+    """
+    with open(src_label, 'r') as f:
+        label_data = json.load(f)
+
+    # example dict {'openlabel': {'metadata': {'schema_version': '1.0.0'}, 'coordinate_systems': 169, 'frames': {'169': {'objects': {'0': {'object_data': {'name': 'PEDESTRIAN_0', 'type': 'PEDESTRIAN', 'bbox': [{'name': 'full_bbox', 'val': [568, 167, 38, 58], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '1': {'object_data': {'name': 'PEDESTRIAN_1', 'type': 'PEDESTRIAN', 'bbox': [{'name': 'full_bbox', 'val': [574, 241, 46, 87], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '2': {'object_data': {'name': 'CAR_2', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [258, 24, 46, 39], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '3': {'object_data': {'name': 'TRUCK_3', 'type': 'TRUCK', 'bbox': [{'name': 'full_bbox', 'val': [309, 137, 81, 135], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '4': {'object_data': {'name': 'CAR_4', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [392, 22, 34, 36], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '5': {'object_data': {'name': 'TRAILER_5', 'type': 'TRAILER', 'bbox': [{'name': 'full_bbox', 'val': [347, 28, 48, 56], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '6': {'object_data': {'name': 'CAR_6', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [262, 33, 45, 43], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '7': {'object_data': {'name': 'CAR_7', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [375, 40, 41, 43], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '8': {'object_data': {'name': 'TRAILER_8', 'type': 'TRAILER', 'bbox': [{'name': 'full_bbox', 'val': [126, 107, 27, 166], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '9': {'object_data': {'name': 'CAR_9', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [195, 49, 56, 49], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}}}}}}
+    for frame_id, frame_content in label_data.get("openlabel", {}).get("frames", {}).items():
+        for obj_id, obj_content in frame_content.get("objects", {}).items():
+            bbox_list = obj_content.get("object_data", {}).get("bbox", [])
+            for bbox in bbox_list:
+                if bbox.get("name") == "full_bbox":
+                    x_val, y_val, box_w, box_h = bbox.get("val", [0,0,0,0])
+                    # adjust coordinates
+                    x_val -= roi['x']
+                    y_val -= roi['y']
+                    # update bbox
+                    bbox["val"] = [x_val, y_val, box_w, box_h]
+
+    with open(dest_label, 'w') as f:
+        json.dump(label_data, f)
+
+
+def camera_paths(data_path:Path, out_path:Path, split:str, camera:str):
+    """
+    Source and destination folders of a split/camera
+    :param camera: rgb or eb_transformed
 
-    :return: None, writes directly to disk
-    """
-
-    frame_files = sorted(image_path.glob("*/*.jpg"))
-    print (f"Found {len(frame_files)} frame files to process.")
-    label_data = None
-    for frame_file in frame_files:
-        # load image
-        img = cv2.imread(str(frame_file))
-        # crop
-        x, y, w, h = roi["x"], roi["y"], roi["width"], roi["height"]
-        cropped_img = img[y:h, x:w]
-        # overwrite
-        gray_img = cv2.cvtColor(cropped_img, cv2.COLOR_BGR2GRAY)
-        status = cv2.imwrite(str(frame_file), gray_img)
-        if not status:
-            print (f"Error writing cropped image {frame_file}")
-
-    # process labels
-    label_files = sorted(label_path.glob("*/*.json"))
-    print (f"Found {len(label_files)} label files to process.")    
-    for label_file in label_files:
-        with open(label_file, 'r') as f:
-            label_data = json.load(f)
-
-        # example dict {'openlabel': {'metadata': {'schema_version': '1.0.0'}, 'coordinate_systems': 169, 'frames': {'169': {'objects': {'0': {'object_data': {'name': 'PEDESTRIAN_0', 'type': 'PEDESTRIAN', 'bbox': [{'name': 'full_bbox', 'val': [568, 167, 38, 58], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '1': {'object_data': {'name': 'PEDESTRIAN_1', 'type': 'PEDESTRIAN', 'bbox': [{'name': 'full_bbox', 'val': [574, 241, 46, 87], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '2': {'object_data': {'name': 'CAR_2', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [258, 24, 46, 39], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '3': {'object_data': {'name': 'TRUCK_3', 'type': 'TRUCK', 'bbox': [{'name': 'full_bbox', 'val': [309, 137, 81, 135], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '4': {'object_data': {'name': 'CAR_4', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [392, 22, 34, 36], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '5': {'object_data': {'name': 'TRAILER_5', 'type': 'TRAILER', 'bbox': [{'name': 'full_bbox', 'val': [347, 28, 48, 56], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '6': {'object_data': {'name': 'CAR_6', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [262, 33, 45, 43], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '7': {'object_data': {'name': 'CAR_7', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [375, 40, 41, 43], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '8': {'object_data': {'name': 'TRAILER_8', 'type': 'TRAILER', 'bbox': [{'name': 'full_bbox', 'val': [126, 107, 27, 166], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '9': {'object_data': {'name': 'CAR_9', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [195, 49, 56, 49], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}}}}}}
-        for frame_id, frame_content in label_data.get("openlabel", {}).get("frames", {}).items():
-            for obj_id, obj_content in frame_content.get("objects", {}).items():
-                bbox_list = obj_content.get("object_data", {}).get("bbox", [])
-                for bbox in bbox_list:
-                    if bbox.get("name") == "full_bbox":
-                        x_val, y_val, box_w, box_h = bbox.get("val", [0,0,0,0])
-                        # adjust coordinates
-                        x_val -= roi['x']
-                        y_val -= roi['y']
-                        # update bbox
-                        bbox["val"] = [x_val, y_val, box_w, box_h]
-
-        with open(label_file, 'w') as f:
-            json.dump(label_data, f)
+    :return: (src_image_path, dest_image_path, src_label_path, dest_label_path)
+    """
+    suffix = "rgb" if camera == "rgb" else "eb"
+    # test splits only ship the fusion optimized labels
+    if split.startswith("test/"):
+        label_folder = f"OPENLabel_labels_fusion_gt_optimized_{suffix}"
+    else:
+        label_folder = f"OPENLabel_labels_{suffix}"
+    return (data_path / split / "images" / camera, out_path / split / "images" / camera,
+            data_path / split / label_folder, out_path / split / label_folder)
+
+
+def fingerprint_sources(src_image_path:Path, src_label_path:Path, mode:str="stat") -> str:
+    """
+    Hash of every source frame and label of a split/camera, changes when any file is added, removed or modified
+    :param src_image_path: Path to the directory containing frame images
+    :param src_label_path: Path to the directory containing frame labels
+    :param mode: stat to hash name, size and mtime (fast), content to hash the bytes of every file
+
+    :return: hex digest
+    """
+    digest = hashlib.sha1()
+    for folder in (src_image_path, src_label_path):
+        if not folder.exists():
+            digest.update(f"missing:{folder.name}".encode())
+            continue
+        entries = sorted((entry for entry in os.scandir(folder) if entry.is_file()), key=lambda entry: entry.name)
+        for entry in entries:
+            digest.update(entry.name.encode())
+            if mode == "content":
+                with open(entry.path, "rb") as f:
+                    digest.update(hashlib.sha1(f.read()).digest())
+            else:
+                stat = entry.stat()
+                digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def load_manifest(out_path:Path) -> dict:
+    manifest_path = out_path / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {"version": MANIFEST_VERSION, "entries": {}}
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        # unknown layout, everything gets rebuilt
+        return {"version": MANIFEST_VERSION, "entries": {}}
+    return manifest
+
+
+def save_manifest(out_path:Path, manifest:dict) -> None:
+    # write to a temp file first so an interrupted run never leaves a half written manifest
+    manifest_path = out_path / MANIFEST_NAME
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
 
 
 def preprocess_data(args):
     splits = args.split.split(',')
+    data_path = Path(args.data_path)
+    out_path = Path(args.out_path)
+    eb_roi = None
 
     if args.eb or args.all:
         # load roi
         eb_roi = load_eb_roi(args.eb_roi_path)
         print(f"Loaded EB ROI: {eb_roi}")
 
+    cameras = []
+    if args.rgb or args.all:
+        cameras.append("rgb")
+    if args.eb or args.all:
+        cameras.append("eb_transformed")
+
+    os.makedirs(out_path, exist_ok=True)
+    manifest = load_manifest(out_path)
+    updated_entries = {}
+
+    # plan every (split, camera) first, so group ids are fixed before any work is dispatched
+    tasks = []
+    # timestamp index of every planned split/camera, for the alignment index
+    planned_timestamps = {}
     for split in splits:
         print (f"Processing split: {split}")
-        out_split_path = Path(args.out_path) / split
+        out_split_path = out_path / split
         os.makedirs(out_split_path, exist_ok=True)
 
-        if args.rgb or args.all:
-            # get images path
-            src_rgb_image_path = Path(args.data_path) / split / "images" / "rgb"
-            out_rgb_image_path = Path(args.out_path) / split / "images" / "rgb"
-            # get labels path
-            if split.startswith("test/"):
-                src_rgb_labels_path = Path(args.data_path) / split / "OPENLabel_labels_fusion_gt_optimized_rgb"
-                dest_rgb_labels_path = Path(args.out_path) / split / "OPENLabel_labels_fusion_gt_optimized_rgb"
-            else:
-                src_rgb_labels_path = Path(args.data_path) / split / "OPENLabel_labels_rgb"
-                dest_rgb_labels_path = Path(args.out_path) / split / "OPENLabel_labels_rgb"
-            
-            group_frames(src_rgb_image_path, out_rgb_image_path, 
-                         src_rgb_labels_path, dest_rgb_labels_path,
-                         args.n_frames, args.max_time_diff)
-
-    
-        if args.eb or args.all:
-    
-
-            # get images path
-            src_eb_image_path = Path(args.data_path) / split / "images" / "eb_transformed"
-            out_eb_image_path = Path(args.out_path) / split / "images" / "eb_transformed"
-
-            # get labels path
-            if split.startswith("test/"):
-                src_eb_labels_path = Path(args.data_path) / split / "OPENLabel_labels_fusion_gt_optimized_eb"
-                dest_eb_labels_path = Path(args.out_path) / split / "OPENLabel_labels_fusion_gt_optimized_eb"
-            else:
-                src_eb_labels_path = Path(args.data_path) / split / "OPENLabel_labels_eb"
-                dest_eb_labels_path = Path(args.out_path) / split / "OPENLabel_labels_eb"
-
-
-            group_frames(src_eb_image_path, out_eb_image_path, 
-                         src_eb_labels_path, dest_eb_labels_path,
-                         args.n_frames, args.max_time_diff)
-            
-            apply_roi(out_eb_image_path, dest_eb_labels_path, eb_roi)
-            
+        for camera in cameras:
+            src_image_path, dest_image_path, src_label_path, dest_label_path = camera_paths(data_path, out_path, split, camera)
+            roi = eb_roi if camera == "eb_transformed" else None
+            key = f"{split}/{camera}"
+            entry = {
+                "params": {"n_frames": args.n_frames, "max_time_diff": args.max_time_diff, "roi": roi,
+                           "format": args.format, "groups_per_shard": args.groups_per_shard if args.format == "packed" else None},
+                "fingerprint_mode": args.fingerprint,
+                "fingerprint": fingerprint_sources(src_image_path, src_label_path, args.fingerprint),
+            }
+            if not args.rewrite and manifest["entries"].get(key) == entry:
+                print(f"{key} is up to date, skipping.")
+                continue
+
+            # stale groups would otherwise survive a change of n_frames/max_time_diff
+            for stale in (dest_image_path, dest_label_path):
+                if stale.exists():
+                    rmtree(stale)
+            camera_tasks = plan_groups(split, camera,
+                                       src_image_path, dest_image_path,
+                                       src_label_path, dest_label_path,
+                                       args.n_frames, args.max_time_diff, roi)
+            if args.format == "packed":
+                camera_tasks = plan_packed(camera_tasks, dest_image_path, args.groups_per_shard)
+            elif args.format == "sparse":
+                camera_tasks = plan_sparse(camera_tasks, dest_image_path)
+            tasks += camera_tasks
+            updated_entries[key] = entry
+            # kept next to the frames, the dataset and the alignment read it instead of parsing file names again
+            planned_timestamps[key] = timestamp_index([(f"{task.group_id:04d}", [frame.stem for frame in task.frames])
+                                                       for task in camera_tasks])
+            os.makedirs(dest_image_path, exist_ok=True)
+            save_timestamps(dest_image_path / TIMESTAMPS_NAME, planned_timestamps[key])
+
+    # drop the outdated entries before writing anything, so an interrupted run is rebuilt next time
+    for key in updated_entries:
+        manifest["entries"].pop(key, None)
+    save_manifest(out_path, manifest)
+
+    if tasks:
+        run_tasks(tasks, args.workers)
+    manifest["entries"].update(updated_entries)
+    save_manifest(out_path, manifest)
+
+    tolerance_us = int(round(args.align_tolerance * 1000))
+    for split in splits:
+        alignment_path = out_path / split / ALIGNMENT_NAME
+        rewritten = any(f"{split}/{camera}" in updated_entries for camera in cameras)
+        if not rewritten and (len(cameras) < 2 or (not args.rewrite and alignment_path.exists()
+                                                   and int(load_alignment(alignment_path)["tolerance_us"]) == tolerance_us)):
+            continue
+        # a rewritten camera is paired again with the frames of the other one, processed in this run or before
+        indexes = []
+        for camera in ["rgb", "eb_transformed"]:
+            key = f"{split}/{camera}"
+            if key not in planned_timestamps:
+                # up to date camera, its index was written when it was processed
+                src_image_path, dest_image_path = camera_paths(data_path, out_path, split, camera)[:2]
+                if not (dest_image_path / TIMESTAMPS_NAME).exists():
+                    if camera not in cameras:
+                        # not preprocessed (or before the index existed, with unknown parameters)
+                        break
+                    # written before the index existed, same files and parameters give the same groups
+                    groups = group_frames(sorted(src_image_path.glob("*.jpg")), args.n_frames, args.max_time_diff)
+                    save_timestamps(dest_image_path / TIMESTAMPS_NAME, timestamp_index(
+                        [(f"{group_id:04d}", [frame.stem for frame in group]) for group_id, group in enumerate(groups)]))
+                planned_timestamps[key] = load_timestamps(dest_image_path / TIMESTAMPS_NAME)
+            indexes.append(planned_timestamps[key])
+        if len(indexes) < 2:
+            # it would pair the rewritten frames with groups that no longer exist
+            if alignment_path.exists():
+                alignment_path.unlink()
+                print(f"Removed the stale alignment of {out_path / split}, no {TIMESTAMPS_NAME} of the other camera.")
+            continue
+        write_alignment(out_path / split, *indexes, args.align_tolerance)
 
 def main():
     args = parse_args()
-    if not args.rewrite and Path(args.out_path).exists():
-        print(f"Output path {args.out_path} already exists. Use --rewrite to overwrite.")
+    out_path = Path(args.out_path)
+    if not args.rewrite and out_path.exists() and not (out_path / MANIFEST_NAME).exists():
+        print(f"Output path {args.out_path} already exists and has no {MANIFEST_NAME}. Use --rewrite to overwrite.")
         return
     preprocess_data(args)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
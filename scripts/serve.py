@@ -0,0 +1,69 @@
+import os
+import signal
+import asyncio
+import argparse
+
+import torch
+
+from src.models.checkpoint import load_model
+from src.utils.serving import InferenceServer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local inference server of a checkpoint, micro-batching frames (ANN) or EB groups (SNN, state kept per stream)")
+    parser.add_argument("--model-path", type=str, required=True, help="Checkpoint to serve, see src/models/checkpoint.py.")
+    parser.add_argument("--socket", type=str, default=None, help="Unix socket path, else TCP on --host/--port.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="TCP host.")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port.")
+    parser.add_argument("--device", type=str, default="cpu", help="Device of the model.")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads, defaults to every CPU.")
+    parser.add_argument("--max-batch", type=int, default=16, help="Most samples per forward pass.")
+    parser.add_argument("--max-delay-ms", type=float, default=5.0, help="Longest wait of a request for others to batch with.")
+    parser.add_argument("--max-streams", type=int, default=1024, help="Stream states kept, the least recently used is dropped beyond.")
+    parser.add_argument("--stats-every", type=float, default=10.0, help="Seconds between statistics prints, 0 to disable.")
+    return parser.parse_args()
+
+
+def format_stats(stats:dict) -> str:
+    return (f"{stats['requests']} requests ({stats['errors']} errors) in {stats['batches']} batches, "
+            f"mean batch {stats['mean_batch']:.1f}, {stats['requests_per_s']:.1f} req/s, "
+            f"p50 {stats['p50_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms, forward p50 {stats['compute_p50_ms']:.1f} ms")
+
+
+async def serve(args):
+    torch.set_num_threads(args.threads or os.cpu_count() or 1)
+    model = load_model(args.model_path, map_location=args.device).to(args.device)
+    server = InferenceServer(model, args.device, args.max_batch, args.max_delay_ms, args.max_streams)
+    await server.start(args.socket, args.host, args.port)
+    print(f"Serving {args.model_path} ({'stateful' if server.stateful else 'stateless'}) on "
+          f"{args.socket or '%s:%d' % server.address[:2]}")
+    # SIGTERM stops the server as ctrl-c does, so the socket is removed
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    printed = 0
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), args.stats_every or None)
+            except asyncio.TimeoutError:
+                pass
+            # only when there was traffic since the last print
+            if args.stats_every and server.stats.requests > printed:
+                printed = server.stats.requests
+                print(format_stats(server.stats.snapshot()))
+    finally:
+        await server.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+def main():
+    args = parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("Stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import torch
+
+from scripts.serve import format_stats
+from src.data.dataset import TUMTraf
+from src.models.checkpoint import load_model
+from src.utils.serving import InferenceClient, InferenceServer, accepts_state, latency_summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Streams a preprocessed split to an inference server (scripts/serve.py) as concurrent live streams")
+    parser.add_argument("--data-path", type=str, default="data/preprocessed", help="Root path of the preprocessed data.")
+    parser.add_argument("--split", type=str, default="test/day", help="Split to stream.")
+    parser.add_argument("--rgb", action="store_true", help="Stream the RGB frames one by one.")
+    parser.add_argument("--eb", action="store_true", help="Stream the EB transformed groups.")
+    parser.add_argument("--streams", type=int, default=4, help="Concurrent streams, each one a contiguous range of the split.")
+    parser.add_argument("--samples", type=int, default=None, help="Most samples sent per stream.")
+    parser.add_argument("--decode", action="store_true", help="Ask for detections instead of the raw outputs.")
+    parser.add_argument("--socket", type=str, default=None, help="Unix socket of the server, else TCP on --host/--port.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="TCP host of the server.")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port of the server.")
+    parser.add_argument("--model-path", type=str, default=None, help="Serve this checkpoint in process instead of connecting to a server.")
+    parser.add_argument("--max-batch", type=int, default=16, help="Most samples per forward pass of the in process server.")
+    parser.add_argument("--max-delay-ms", type=float, default=5.0, help="Batching delay of the in process server.")
+    parser.add_argument("--check", action="store_true", help="Replay every stream through --model-path one sample at a time and compare the outputs.")
+    return parser.parse_args()
+
+
+def stream_samples(data_path:Path, split:str, camera:str, streams:int, samples=None) -> List[List[np.ndarray]]:
+    """Samples of every stream: EB groups [T, C, H, W] or RGB frames [C, H, W], in time order"""
+    label_folder = "OPENLabel_labels_fusion_gt_optimized" if split.startswith("test/") else "OPENLabel_labels"
+    dataset = TUMTraf(data_path / split / "images" / camera,
+                      data_path / split / f"{label_folder}_{'rgb' if camera == 'rgb' else 'eb'}", by_group=True)
+    bounds = np.linspace(0, len(dataset), streams + 1).astype(int)
+    result = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        items = []
+        for i in range(start, end):
+            frames = dataset[i]["frame"]
+            frames = (frames.to_dense() if frames.is_sparse else frames).numpy()
+            items += list(frames) if camera == "rgb" else [frames]
+        result.append(items[:samples])
+    return result
+
+
+async def run_stream(client:InferenceClient, name:str, samples:List[np.ndarray], decode:bool, latencies:List[float]):
+    """Sends the samples of a stream one after the other, as a live source would"""
+    outputs = []
+    for i, x in enumerate(samples):
+        start_time = time.perf_counter()
+        output, _ = await client.infer(x, stream=name, reset=i == 0, decode=decode)
+        latencies.append(time.perf_counter() - start_time)
+        outputs.append(output)
+    return outputs
+
+
+@torch.inference_mode()
+def replay(model:torch.nn.Module, samples:List[np.ndarray]) -> List[Dict[str, np.ndarray]]:
+    """Outputs of a stream computed locally, one sample per forward pass"""
+    state, outputs = None, []
+    for x in samples:
+        x = torch.from_numpy(x)[None].float().div_(255.0)
+        if accepts_state(model):
+            if not getattr(model, "batch_first", True):
+                x = x.transpose(0, 1)
+            output, state = model(x, state, return_state=True)
+        else:
+            output = model(x)
+        output = output if isinstance(output, dict) else {
+            f"output{i}": out for i, out in enumerate(output if isinstance(output, (list, tuple)) else [output])}
+        outputs.append({name: out[0].float().numpy() for name, out in output.items()})
+    return outputs
+
+
+async def run(args):
+    camera = "eb_transformed" if args.eb and not args.rgb else "rgb"
+    streams = stream_samples(Path(args.data_path), args.split, camera, args.streams, args.samples)
+    print(f"{len(streams)} streams of {[len(samples) for samples in streams]} samples from {args.split}/{camera}")
+
+    server, socket_dir = None, None
+    if args.model_path is not None:
+        socket_dir = tempfile.TemporaryDirectory()
+        server = InferenceServer(load_model(args.model_path), max_batch=args.max_batch, max_delay_ms=args.max_delay_ms)
+        await server.start(os.path.join(socket_dir.name, "server.sock"))
+        client = await InferenceClient.connect(os.path.join(socket_dir.name, "server.sock"))
+    else:
+        client = await InferenceClient.connect(args.socket, args.host, args.port)
+
+    latencies = []
+    start_time = time.perf_counter()
+    outputs = await asyncio.gather(*(run_stream(client, f"stream{i}", samples, args.decode, latencies)
+                                     for i, samples in enumerate(streams)))
+    seconds = time.perf_counter() - start_time
+    summary = latency_summary(latencies)
+    print(f"{len(latencies)} requests in {seconds:.2f}s, {len(latencies) / seconds:.1f} req/s, "
+          f"p50 {summary['p50_ms']:.1f} ms, p99 {summary['p99_ms']:.1f} ms (client side)")
+    print(f"Server: {format_stats(await client.stats())}")
+    await client.close()
+    if server is not None:
+        await server.close()
+        socket_dir.cleanup()
+
+    if args.check and args.model_path and not args.decode:
+        model = load_model(args.model_path)
+        error = max(np.abs(served[name] - local[name]).max()
+                    for samples, stream_outputs in zip(streams, outputs)
+                    for served, local in zip(stream_outputs, replay(model, samples)) for name in local)
+        print(f"Largest difference to the local replay: {error:.2e}")
+
+
+def main():
+    args = parse_args()
+    if args.check and (args.model_path is None or args.decode):
+        print("--check needs --model-path and the raw outputs (no --decode).")
+        return
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from scripts.preprocess import load_eb_roi
+from src.data.streaming import stream_frames
+from src.models.checkpoint import load_model
+from src.models.detection import decode_detections
+from src.models.snn import SpikingDetector
+from src.utils.serving import latency_summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Streaming SNN inference over a directory of timestamped EB frames, one time step per frame")
+    parser.add_argument("--frames-path", type=str, required=True, help="Folder of eb_transformed JPEGs named by capture time.")
+    parser.add_argument("--model-path", type=str, default="checkpoints/snn_eb.pt", help="SpikingDetector checkpoint.")
+    parser.add_argument("--window", type=int, default=8, help="Time steps of the firing rate seen by the head, the n_frames of the training groups.")
+    parser.add_argument("--eb_roi_path", type=str, default="data/TUMTraf_Event_Dataset/calibration/intrinsic/eb_8mm_roi.txt", help="Path to EB ROI JSON file.")
+    parser.add_argument("--no-roi", action="store_true", help="The frames are already cropped (eg. preprocessed jpg frames).")
+    parser.add_argument("--max_time_diff", type=int, default=1000, help="Gap (ms) after which the stream restarts from rest, as the groups of preprocess.")
+    parser.add_argument("--follow", action="store_true", help="Keep watching the folder for new frames.")
+    parser.add_argument("--idle-timeout", type=float, default=None, help="With --follow, stop after this many seconds without a new frame.")
+    parser.add_argument("--threshold", type=float, default=0.3, help="Score threshold of the detections written to --out.")
+    parser.add_argument("--out", type=str, default=None, help="JSON lines file of the detections of every frame.")
+    parser.add_argument("--device", type=str, default="cpu", help="Device of the model.")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads, defaults to every CPU.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    torch.set_num_threads(args.threads or os.cpu_count() or 1)
+    model = load_model(args.model_path, map_location=args.device)
+    if not isinstance(model, SpikingDetector):
+        print(f"{args.model_path} is a {type(model).__name__}, streaming needs a SpikingDetector.")
+        return
+    stream = model.stream(args.window)
+    roi = None if args.no_roi else load_eb_roi(args.eb_roi_path)
+    out = open(args.out, "w") if args.out else None
+
+    decode_times, step_times = [], []
+    frames, runs = 0, 0
+    start_time = time.perf_counter()
+    decode_start = time.perf_counter()
+    for item in stream_frames(Path(args.frames_path), roi, gray=True, max_time_diff=args.max_time_diff,
+                              follow=args.follow, idle_timeout=args.idle_timeout):
+        decode_times.append(time.perf_counter() - decode_start)
+        if item.new_run:
+            stream.reset()
+            runs += 1
+        step_start = time.perf_counter()
+        outputs = stream.step(torch.from_numpy(item.frame).to(args.device))
+        step_times.append(time.perf_counter() - step_start)
+        frames += 1
+        if out is not None:
+            detections = decode_detections(outputs["heatmap"], outputs["size"], outputs["offset"], model.stride,
+                                           threshold=args.threshold)[0]
+            out.write(json.dumps({"frame": item.path.name, "timestamp": item.timestamp,
+                                  **{name: detections[name].tolist() for name in ("boxes", "scores", "classes")}}) + "\n")
+        decode_start = time.perf_counter()
+    if out is not None:
+        out.close()
+
+    if not frames:
+        print(f"No frames in {args.frames_path}.")
+        return
+    seconds = time.perf_counter() - start_time
+    step, decode = latency_summary(step_times), latency_summary(decode_times)
+    print(f"{frames} frames in {runs} runs, {seconds:.2f}s ({frames / seconds:.1f} frames/s), window {args.window}")
+    print(f"step: p50 {step['p50_ms']:.1f} ms, p99 {step['p99_ms']:.1f} ms, decode: p50 {decode['p50_ms']:.1f} ms, "
+          f"p99 {decode['p99_ms']:.1f} ms")
+    # the step cost does not grow once the window is full
+    if frames > args.window:
+        print(f"step p50 over the first window {np.median(step_times[:args.window]) * 1e3:.1f} ms, "
+              f"after it {np.median(step_times[args.window:]) * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import csv
+import time
+import argparse
+from pathlib import Path
+
+import torch
+from torch.utils.data import DataLoader
+
+from src.data.dataset import TUMTraf, collate_tumtraf
+from src.data.sequences import LengthBucketBatchSampler
+from src.models.detection import centernet_loss, encode_targets
+from src.models.snn import NEURONS, SpikingDetector
+from src.utils.profiling import PeakMemoryMonitor
+
+MEMORY_FIELDS = ["split", "seq_len", "batch_size", "tbptt", "checkpoint", "fused", "backend",
+                 "steps", "sequences_per_sec", "peak_rss_mb", "start_rss_mb", "seconds"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the SNN detector on the EB frames")
+    parser.add_argument("--data-path", type=str, default="data/preprocessed", help="Root path of the preprocessed data.")
+    parser.add_argument("--split", type=str, default="train", help="Split to train on.")
+    parser.add_argument("--epochs", type=int, default=10, help="Number of epochs.")
+    parser.add_argument("--batch-size", type=int, default=2, help="Sequences per batch.")
+    parser.add_argument("--lr", type=float, default=1e-3, help="Learning rate.")
+    parser.add_argument("--seq_len", type=int, default=None, help="Train on sliding windows of seq_len frames instead of the preprocessed groups.")
+    parser.add_argument("--tbptt", type=int, default=0, help="Truncated BPTT: backpropagate through chunks of this many steps, detaching the state between them (0 = full BPTT).")
+    parser.add_argument("--checkpoint", action="store_true", help="Recompute the activations of every block in backward instead of storing them.")
+    parser.add_argument("--fused", action="store_true", help="Run the blocks step by step instead of folding time into the batch.")
+    parser.add_argument("--backend", type=str, choices=list(NEURONS), default="native", help="Neuron implementation.")
+    parser.add_argument("--workers", type=int, default=0, help="DataLoader workers.")
+    parser.add_argument("--device", type=str, default="cpu", help="Training device.")
+    parser.add_argument("--max-steps", type=int, default=0, help="Stop after this many optimizer steps (0 = no limit), eg. to measure the memory of a configuration.")
+    parser.add_argument("--out", type=str, default="checkpoints/snn_eb.pt", help="Where the trained model is saved.")
+    parser.add_argument("--memory-log", type=str, default="results/train_snn_memory.csv", help="CSV the peak memory of every run is appended to.")
+    # run.sh forwards the arguments of every stage to the training
+    args, unknown = parser.parse_known_args()
+    if unknown:
+        print(f"Ignoring arguments: {' '.join(unknown)}")
+    return args
+
+
+def chunk_targets(batch:dict, end:int, num_classes:int, feature_shape, stride:int) -> dict:
+    """Targets of a chunk ending at step end, the labels of its last frame (the last real one for shorter sequences)"""
+    last = (torch.clamp(batch["lengths"], max=end) - 1).view(-1, 1, 1)
+    boxes = batch["boxes"].gather(1, last.unsqueeze(-1).expand(-1, 1, *batch["boxes"].shape[2:])).squeeze(1)
+    classes = batch["classes"].gather(1, last.expand(-1, 1, batch["classes"].shape[2])).squeeze(1)
+    mask = batch["mask"].gather(1, last.expand(-1, 1, batch["mask"].shape[2])).squeeze(1)
+    return encode_targets(boxes, classes, mask, num_classes, feature_shape, stride)
+
+
+def train_batch(model:SpikingDetector, batch:dict, optimizer, tbptt:int, device:str) -> float:
+    """
+    One optimizer step on a batch of sequences [B, T, C, H, W]
+    With tbptt, the sequence is cut in chunks of tbptt steps: each chunk is backpropagated on its own
+    and the state is detached before the next one, so only one chunk of graph is alive at a time.
+    Gradients of the chunks are accumulated into a single step.
+    """
+    frames = batch["frame"]
+    steps = frames.shape[1]
+    chunk = tbptt if tbptt > 0 else steps
+    num_chunks = (steps + chunk - 1) // chunk
+    optimizer.zero_grad(set_to_none=True)
+    state, total = None, 0.0
+    for start in range(0, steps, chunk):
+        end = min(start + chunk, steps)
+        # sparse event batches stay sparse, the first block consumes the events directly
+        x = frames.narrow_copy(1, start, end - start) if frames.is_sparse else frames[:, start:end]
+        x = x.to(device).float() / 255.0
+        outputs, state = model(x, state, return_state=True)
+        targets = chunk_targets(batch, end, outputs["heatmap"].shape[1], outputs["heatmap"].shape[2:], model.stride)
+        loss = centernet_loss(outputs, targets)["loss"] / num_chunks
+        loss.backward()
+        total += loss.item()
+        # truncation: the next chunk starts from the values of the state, not from its graph
+        state = [mem.detach() for mem in state]
+    optimizer.step()
+    return total
+
+
+def log_memory(path:Path, row:dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_header = not path.exists() or path.stat().st_size == 0
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=MEMORY_FIELDS)
+        if write_header:
+            writer.writeheader()
+        writer.writerow(row)
+
+
+def train(args):
+    data_path = Path(args.data_path)
+    label_folder = "OPENLabel_labels_fusion_gt_optimized_eb" if args.split.startswith("test/") else "OPENLabel_labels_eb"
+    dataset = TUMTraf(data_path / args.split / "images" / "eb_transformed", data_path / args.split / label_folder,
+                      by_group=args.seq_len is None, seq_len=args.seq_len)
+    sampler = LengthBucketBatchSampler(dataset.lengths, args.batch_size, shuffle=True)
+    loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_tumtraf, num_workers=args.workers)
+    print(f"Training on {args.split}: {len(dataset)} sequences of up to {int(dataset.lengths.max())} frames"
+          f"{' (sparse events)' if dataset.sparse else ''}")
+
+    in_channels = int(dataset[0]["frame"].shape[1])
+    model = SpikingDetector(in_channels=in_channels, num_classes=len(dataset.classes), backend=args.backend,
+                            batch_first=True, fused=args.fused, checkpoint=args.checkpoint).to(args.device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+    out_path = Path(args.out)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    steps, sequences = 0, 0
+    with PeakMemoryMonitor() as monitor:
+        for epoch in range(args.epochs):
+            sampler.set_epoch(epoch)
+            model.train()
+            epoch_loss, epoch_batches, epoch_start = 0.0, 0, time.perf_counter()
+            for batch in loader:
+                epoch_loss += train_batch(model, batch, optimizer, args.tbptt, args.device)
+                epoch_batches += 1
+                steps += 1
+                sequences += len(batch["lengths"])
+                if args.max_steps and steps >= args.max_steps:
+                    break
+            print(f"Epoch {epoch + 1}/{args.epochs}: loss={epoch_loss / max(epoch_batches, 1):.4f} "
+                  f"({time.perf_counter() - epoch_start:.1f}s, peak RSS {monitor.update() / 2**20:.0f} MiB)")
+            torch.save(model, out_path)
+            if args.max_steps and steps >= args.max_steps:
+                break
+
+    memory = monitor.summary()
+    row = {"split": args.split, "seq_len": args.seq_len or int(dataset.lengths.max()), "batch_size": args.batch_size,
+           "tbptt": args.tbptt, "checkpoint": args.checkpoint, "fused": args.fused, "backend": args.backend,
+           "steps": steps, "sequences_per_sec": round(sequences / max(memory["seconds"], 1e-9), 3),
+           "peak_rss_mb": round(memory["peak_rss_mb"], 1), "start_rss_mb": round(memory["start_rss_mb"], 1),
+           "seconds": round(memory["seconds"], 2)}
+    log_memory(Path(args.memory_log), row)
+    print(f"Peak RSS {row['peak_rss_mb']} MiB (tbptt={args.tbptt}, checkpoint={args.checkpoint}), "
+          f"{row['sequences_per_sec']} sequences/s, model saved to {out_path}")
+
+
+def main():
+    args = parse_args()
+    train(args)
+
+
+if __name__ == "__main__":
+    main()
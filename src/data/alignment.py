@@ -0,0 +1,83 @@
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+# written by scripts/preprocess.py next to the images/ folder of every split processed with both cameras
+ALIGNMENT_NAME = "alignment.npz"
+
+
+def match_nearest(src:np.ndarray, dst:np.ndarray, tolerance:int) -> np.ndarray:
+    """
+    Nearest dst timestamp of every src timestamp, one binary search per src (no N x M distance table)
+    :param src: int64 timestamps, sorted
+    :param dst: int64 timestamps, sorted
+    :param tolerance: largest accepted distance, same unit as the timestamps
+
+    :return: int64 [len(src)] index into dst, -1 where the nearest one is further than tolerance
+    """
+    if len(dst) == 0:
+        return np.full(len(src), -1, dtype=np.int64)
+    insert = np.searchsorted(dst, src)
+    left = np.clip(insert - 1, 0, len(dst) - 1)
+    right = np.clip(insert, 0, len(dst) - 1)
+    # ties go to the earlier frame
+    nearest = np.where(np.abs(dst[right] - src) < np.abs(src - dst[left]), right, left).astype(np.int64)
+    nearest[np.abs(dst[nearest] - src) > tolerance] = -1
+    return nearest
+
+
+def align_frames(src:np.ndarray, dst:np.ndarray, tolerance:int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    One to one pairs of frames of two cameras, the mutual nearest neighbours within tolerance
+    :param src: int64 timestamps of the first camera, sorted
+    :param dst: int64 timestamps of the second camera, sorted
+    :param tolerance: largest accepted distance, same unit as the timestamps
+
+    :return: (src indices, dst indices) of the pairs, both increasing
+    """
+    forward = match_nearest(src, dst, tolerance)
+    backward = match_nearest(dst, src, tolerance)
+    src_idx = np.flatnonzero(forward >= 0)
+    src_idx = src_idx[backward[forward[src_idx]] == src_idx]
+    return src_idx, forward[src_idx]
+
+
+def build_alignment(rgb:dict, eb:dict, tolerance_ms:float) -> dict:
+    """
+    Alignment index of a split: RGB/EB frame pairs and the EB group overlapping most with every RGB group
+    :param rgb: timestamp index of the RGB frames (see src/data/timestamps.py), in timestamp order
+    :param eb: timestamp index of the EB frames, in timestamp order
+    :param tolerance_ms: largest time difference of a frame pair
+
+    :return: dict of arrays
+        rgb_frame, eb_frame, rgb_group, eb_group [P]: stems and group ids of every frame pair
+        dt_us [P]: EB minus RGB capture time
+        group_rgb, group_eb, group_frames [G]: group pairs and how many of their frames are paired
+        tolerance_us: the tolerance used
+    """
+    tolerance_us = int(round(tolerance_ms * 1000))
+    rgb_idx, eb_idx = align_frames(rgb["timestamps"], eb["timestamps"], tolerance_us)
+    rgb_group_ids, eb_group_ids = rgb["group_ids"].astype(str), eb["group_ids"].astype(str)
+
+    # group pairs: the most frequent EB group among the pairs of every RGB group
+    pairs, counts = np.unique(np.stack([rgb_group_ids[rgb_idx], eb_group_ids[eb_idx]]), axis=1, return_counts=True)
+    # stable sort by rgb group then decreasing count, the first pair of every rgb group wins
+    order = np.lexsort((-counts, pairs[0]))
+    pairs, counts = pairs[:, order], counts[order]
+    first = np.concatenate([[True], pairs[0, 1:] != pairs[0, :-1]]) if len(counts) else np.zeros(0, dtype=bool)
+    return {"rgb_frame": rgb["file_ids"][rgb_idx], "eb_frame": eb["file_ids"][eb_idx],
+            "rgb_group": rgb_group_ids[rgb_idx], "eb_group": eb_group_ids[eb_idx],
+            "dt_us": eb["timestamps"][eb_idx] - rgb["timestamps"][rgb_idx],
+            "group_rgb": pairs[0, first].astype(str), "group_eb": pairs[1, first].astype(str),
+            "group_frames": counts[first].astype(np.int64),
+            "tolerance_us": np.int64(tolerance_us)}
+
+
+def save_alignment(path:Path, alignment:dict) -> None:
+    np.savez(path, **alignment)
+
+
+def load_alignment(path:Path) -> dict:
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
@@ -0,0 +1,156 @@
+import os
+import multiprocessing as mp
+import weakref
+from multiprocessing import shared_memory
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+import torch
+
+
+def _release(segments, owner_pid):
+    for segment in segments:
+        segment.close()
+        # forked workers inherit the finalizer, only the creating process frees the memory
+        if owner_pid == os.getpid():
+            segment.unlink()
+
+
+class SharedFrameCache:
+    """
+    Bounded LRU cache of decoded frames living in shared memory, so every DataLoader worker of a node reads
+    and fills the same cache. Frames are stored in fixed-size slots (all frames of a camera have the same shape),
+    the slot table, access clock and hit/miss counters are shared too and guarded by a single lock.
+    Must be created in the main process before the workers are started.
+    """
+
+    # shared counters
+    _CLOCK, _HITS, _MISSES = 0, 1, 2
+
+    def __init__(self, max_bytes:int, frame_shape:Sequence[int], dtype=np.uint8, mp_context:Optional[str]=None):
+        """
+        :param max_bytes: memory budget for the frames, the number of slots is max_bytes // frame size
+        :param frame_shape: shape of every cached frame, eg. [C, H, W]
+        :param dtype: numpy dtype of the frames
+        :param mp_context: multiprocessing start method of the workers (fork, spawn...), None for the default one
+        """
+        self.frame_shape = tuple(int(dim) for dim in frame_shape)
+        self.dtype = np.dtype(dtype)
+        frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.capacity = max_bytes // frame_bytes
+        if self.capacity < 1:
+            raise ValueError(f"cache budget of {max_bytes} bytes cannot hold a single frame of {frame_bytes} bytes")
+
+        self._data_shm = shared_memory.SharedMemory(create=True, size=self.capacity * frame_bytes)
+        # keys, last access tick, then the counters
+        self._meta_shm = shared_memory.SharedMemory(create=True, size=(2 * self.capacity + 3) * 8)
+        self._lock = mp.get_context(mp_context).Lock()
+        self._attach()
+        self._keys[:] = -1
+        self._ticks[:] = -1
+        self._counters[:] = 0
+        self._finalizer = weakref.finalize(self, _release, (self._data_shm, self._meta_shm), os.getpid())
+
+    def _attach(self):
+        self._slots = np.ndarray((self.capacity, *self.frame_shape), dtype=self.dtype, buffer=self._data_shm.buf)
+        meta = np.ndarray((2 * self.capacity + 3,), dtype=np.int64, buffer=self._meta_shm.buf)
+        self._keys = meta[:self.capacity]
+        self._ticks = meta[self.capacity:2 * self.capacity]
+        self._counters = meta[2 * self.capacity:]
+
+    def __getstate__(self):
+        # workers attach to the same segments by name
+        return {"frame_shape": self.frame_shape, "dtype": self.dtype, "capacity": self.capacity,
+                "data_name": self._data_shm.name, "meta_name": self._meta_shm.name, "lock": self._lock}
+
+    def __setstate__(self, state):
+        self.frame_shape, self.dtype, self.capacity = state["frame_shape"], state["dtype"], state["capacity"]
+        self._data_shm = shared_memory.SharedMemory(name=state["data_name"])
+        self._meta_shm = shared_memory.SharedMemory(name=state["meta_name"])
+        self._lock = state["lock"]
+        self._attach()
+        self._finalizer = weakref.finalize(self, _release, (self._data_shm, self._meta_shm), None)
+
+    def close(self) -> None:
+        """Detaches from the shared memory, the owner also frees it"""
+        self._slots = self._keys = self._ticks = self._counters = None
+        self._finalizer()
+
+    def _tick(self) -> int:
+        self._counters[self._CLOCK] += 1
+        return int(self._counters[self._CLOCK])
+
+    def get(self, key:int) -> Optional[torch.Tensor]:
+        """Copy of the cached frame of key, or None (counted as a miss)"""
+        with self._lock:
+            slot = np.flatnonzero(self._keys == key)
+            if len(slot) == 0:
+                self._counters[self._MISSES] += 1
+                return None
+            self._ticks[slot[0]] = self._tick()
+            self._counters[self._HITS] += 1
+            # copied under the lock, the slot can be reused by another worker right after
+            return torch.from_numpy(self._slots[slot[0]].copy())
+
+    def put(self, key:int, frame:torch.Tensor) -> None:
+        """Stores a frame, evicting the least recently used one when the cache is full"""
+        if tuple(frame.shape) != self.frame_shape:
+            return
+        with self._lock:
+            if (self._keys == key).any():
+                return
+            # empty slots have tick -1 so they are used first
+            slot = int(np.argmin(self._ticks))
+            self._slots[slot] = frame.numpy()
+            self._keys[slot] = key
+            self._ticks[slot] = self._tick()
+
+    def get_or_load(self, key:int, loader:Callable[[], torch.Tensor]) -> torch.Tensor:
+        frame = self.get(key)
+        if frame is None:
+            frame = loader()
+            self.put(key, frame)
+        return frame
+
+    def stats(self) -> dict:
+        """Counters summed over every process using the cache"""
+        with self._lock:
+            hits, misses = int(self._counters[self._HITS]), int(self._counters[self._MISSES])
+            size = int((self._keys >= 0).sum())
+        return {"hits": hits, "misses": misses, "hit_rate": hits / max(hits + misses, 1),
+                "size": size, "capacity": self.capacity,
+                "bytes": size * int(np.prod(self.frame_shape)) * self.dtype.itemsize}
+
+
+class SharedArray:
+    """
+    numpy array living in shared memory, pickled by name so the worker processes it is sent to attach
+    to the same pages instead of receiving a copy. Created and filled in the main process,
+    the creating process frees the memory.
+    """
+
+    def __init__(self, shape:Sequence[int], dtype=np.uint8):
+        self.shape = tuple(int(dim) for dim in shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        self._finalizer = weakref.finalize(self, _release, (self._shm,), os.getpid())
+
+    def __getstate__(self):
+        return {"shape": self.shape, "dtype": self.dtype, "name": self._shm.name}
+
+    def __setstate__(self, state):
+        self.shape, self.dtype = state["shape"], state["dtype"]
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        self._finalizer = weakref.finalize(self, _release, (self._shm,), None)
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+    def close(self) -> None:
+        """Detaches from the shared memory, the owner also frees it"""
+        self.array = None
+        self._finalizer()
@@ -1,10 +1,22 @@
+import os
 import json
-from os import listdir
-from os.path import isfile, join, isdir, exists
+from os.path import join, isdir, exists
+import numpy as np
+import torch
 from torchvision.io import decode_image
 from torch.utils.data import Dataset
 from pathlib import Path
-from collections import defaultdict
+from typing import Callable, Optional
+
+from src.data.alignment import align_frames, load_alignment
+from src.data.cache import SharedFrameCache
+from src.data.events import events_to_coo, load_events, stack_sparse
+from src.data.labels import LabelIndex
+from src.data.sequences import find_windows
+from src.data.timestamps import TIMESTAMPS_NAME, load_timestamps, parse_timestamps
+
+# written by scripts/preprocess.py --format packed/sparse
+PACKED_INDEX_NAME = "index.json"
 
 
 class TUMTraf(Dataset):
@@ -17,59 +29,391 @@ class TUMTraf(Dataset):
                'TRAILER', 
                'TRUCK']
 
-    def __init__(self, img_dir:Path, label_dir:Path, by_group:bool=False):
+    def __init__(self, img_dir:Path, label_dir:Path, by_group:bool=False,
+                 seq_len:Optional[int]=None, seq_stride:int=1, min_seq_len:Optional[int]=None, max_time_diff:int=1000,
+                 cache_bytes:int=0, cache_context:Optional[str]=None, transform:Optional[Callable]=None):
         """
         Assumes data is on groups, wont work if doesnt run preprocessed/
         if data is loaded by group, each item is a set of frames, else every item is a frame
-        
+        with seq_len, items are sliding windows over all the frames of the split (ignoring the preprocessed groups),
+        built on the fly from the frame timestamps, so any temporal length can be used without preprocessing again.
+        img_dir can also be a flat folder of frames (eg. the raw dataset) in this mode
+        img_dir can hold jpg group folders or the packed .npy shards of preprocess.py --format packed,
+        packed frames are returned as zero-copy views of the memory-mapped shards.
+        With the coordinate lists of preprocess.py --format sparse, frames are returned as sparse COO tensors
+        of the same shape (only the non-zero pixels), never densified unless a transform needs it
+
+        Items are indexed by integer, 0..len-1 in timestamp order, and are dicts of tensors:
+            frame: [C, H, W] uint8, or [T, C, H, W] by group/sequence
+            boxes: [K, 4] full_bbox values (x_center, y_center, width, height), or a list with one per frame by group/sequence
+            classes: [K] index into self.classes, or a list with one per frame by group/sequence
+        by frame only the frames with a label file are used, by group/sequence every frame is kept
+        (frames without label file have no boxes). Use collate_tumtraf to batch them, and
+        LengthBucketBatchSampler(dataset.lengths, ...) to batch windows of different length.
+
         :param img_dir: Path where preprocessed images are stored
         :type img_dir: Path
         :param label_dir: Path where preprocessed labels are stored
         :type label_dir: Path
         :param by_group: Whether to load data by group
         :type by_group: bool
+        :param seq_len: frames per window, enables the sequence mode
+        :param seq_stride: frames between the start of two windows
+        :param min_seq_len: shortest window kept at the end of a run of frames, defaults to seq_len (fixed length)
+        :param max_time_diff: Maximum time difference (ms) between consecutive frames of a window
+        :param cache_bytes: budget of the shared LRU cache of decoded jpg frames (0 disables it),
+            create the dataset before the DataLoader so all its workers share the cache, see cache_stats()
+        :param cache_context: multiprocessing start method of the DataLoader workers, when it is not the default one
+        :param transform: batched frame transform (eg. a noise of src/data/noise.py), called as
+            transform(frames[None], seeds=[first frame of the item]) so an item always gets the same corruption
         """
         # TODO check when data structure is not the same, or not using preprocessed bc if not it just quietly fails
         self.img_dir = img_dir
         self.label_dir = label_dir
         self.by_group = by_group
+        self.seq_len = seq_len
+        self.transform = transform
         self.classes = self.CLASSES
-    
+
         if not isdir(self.img_dir) or not exists(self.img_dir):
             raise ValueError("invalid img_dir", self.img_dir)
 
         if not isdir(self.label_dir) or not exists(self.label_dir):
             raise ValueError("invalid label_dir", self.label_dir)
-        
-
-        self.img_labels = defaultdict(dict)
-        # # example dict {'openlabel': {'metadata': {'schema_version': '1.0.0'}, 'coordinate_systems': 169, 'frames': {'169': {'objects': {'0': {'object_data': {'name': 'PEDESTRIAN_0', 'type': 'PEDESTRIAN', 'bbox': [{'name': 'full_bbox', 'val': [568, 167, 38, 58], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '1': {'object_data': {'name': 'PEDESTRIAN_1', 'type': 'PEDESTRIAN', 'bbox': [{'name': 'full_bbox', 'val': [574, 241, 46, 87], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '2': {'object_data': {'name': 'CAR_2', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [258, 24, 46, 39], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '3': {'object_data': {'name': 'TRUCK_3', 'type': 'TRUCK', 'bbox': [{'name': 'full_bbox', 'val': [309, 137, 81, 135], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '4': {'object_data': {'name': 'CAR_4', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [392, 22, 34, 36], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '5': {'object_data': {'name': 'TRAILER_5', 'type': 'TRAILER', 'bbox': [{'name': 'full_bbox', 'val': [347, 28, 48, 56], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '6': {'object_data': {'name': 'CAR_6', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [262, 33, 45, 43], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '7': {'object_data': {'name': 'CAR_7', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [375, 40, 41, 43], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '8': {'object_data': {'name': 'TRAILER_8', 'type': 'TRAILER', 'bbox': [{'name': 'full_bbox', 'val': [126, 107, 27, 166], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}, '9': {'object_data': {'name': 'CAR_9', 'type': 'CAR', 'bbox': [{'name': 'full_bbox', 'val': [195, 49, 56, 49], 'attributes': {'text': [{'name': 'sensor_id', 'val': 'default_cam'}]}}]}}}}}}}
-        group_folders = [f for f in listdir(self.label_dir) 
-                            if not isfile(join(self.label_dir, f))]
-        for group in group_folders:
-            group_path = join(self.label_dir, group)
-            onlyfiles = [f for f in listdir(group_path) 
-                            if isfile(join(group_path, f))]
-            for i,file in enumerate(onlyfiles):
-                with open(f"{group_path}/{file}") as f:
-                    d = json.load(f)
-                    file_id = file.split(".json")[0]
-                    if self.by_group:
-                        self.img_labels[group][file_id] = d
-                    else:
-                        self.img_labels[file_id] = {'group': group, 'data': d}
+
+        # frame table, frames of group g are [group_offsets[g], group_offsets[g+1])
+        self.packed = self.sparse = False
+        self._shards = {}
+        if exists(join(self.img_dir, PACKED_INDEX_NAME)):
+            self._read_packed_index()
+        else:
+            self._list_jpg_frames()
+
+        # compact label table (see src/data/labels.py), cached on disk so no JSON is parsed here
+        self.labels = LabelIndex.open(self.label_dir, self.classes)
+        self.label_rows = self._match_labels()
+
+        # capture time (int64 us) of every frame, from the index of preprocess.py when it matches the frame table
+        self.timestamps = self._read_timestamps()
+        if self.seq_len is not None:
+            # frames are sorted by group and groups by time, so the frame table is already chronological
+            self.samples, self.lengths = find_windows(self.timestamps, seq_len, seq_stride, min_seq_len, max_time_diff)
+        elif self.by_group:
+            self.samples = np.arange(len(self.group_names))
+            self.lengths = np.diff(self.group_offsets)
+        else:
+            self.samples = np.flatnonzero(self.label_rows >= 0)
+            self.lengths = np.ones(len(self.samples), dtype=np.int64)
+
+        # packed and sparse frames are never decoded, nothing to cache
+        self.cache = None
+        if cache_bytes > 0 and not self.packed and not self.sparse and len(self.file_ids):
+            self.cache = SharedFrameCache(cache_bytes, self._decode_frame(0).shape, mp_context=cache_context)
+
+    def _list_jpg_frames(self):
+        group_names, file_ids, counts = [], [], []
+        with os.scandir(self.img_dir) as entries:
+            entries = list(entries)
+        groups = sorted(entry.name for entry in entries if entry.is_dir())
+        if any(entry.name.endswith(".jpg") for entry in entries):
+            # flat folder of frames, a single unnamed group
+            groups = [""]
+        for group in groups:
+            with os.scandir(join(self.img_dir, group)) as entries:
+                frames = sorted(entry.name[:-len(".jpg")] for entry in entries if entry.name.endswith(".jpg"))
+            group_names.append(group)
+            file_ids.extend(frames)
+            counts.append(len(frames))
+        self._set_frames(group_names, file_ids, counts)
+
+    def _read_packed_index(self):
+        # packed backend, every frame has a (shard, row), shards are opened lazily in each worker
+        # sparse backend, every frame has a (group file, row), the same tables are used
+        with open(join(self.img_dir, PACKED_INDEX_NAME)) as f:
+            index = json.load(f)
+        self.sparse = index.get("format") == "sparse"
+        self.packed = not self.sparse
+        self.frame_shape = tuple(index["shape"])
+        groups = index["groups"]
+        shard_key = "file" if self.sparse else "shard"
+        self.shard_names = sorted({group[shard_key] for group in groups})
+        shard_ids = {name: i for i, name in enumerate(self.shard_names)}
+        self._set_frames([group["id"] for group in groups],
+                         [file_id for group in groups for file_id in group["frames"]],
+                         [len(group["frames"]) for group in groups])
+        self.frame_shard = np.repeat([shard_ids[group[shard_key]] for group in groups],
+                                     [len(group["frames"]) for group in groups]).astype(np.int32)
+        self.frame_shard_row = np.concatenate([group.get("offset", 0) + np.arange(len(group["frames"]))
+                                               for group in groups] or [np.empty(0)]).astype(np.int64)
+
+    def _read_timestamps(self):
+        path = join(self.img_dir, TIMESTAMPS_NAME)
+        if exists(path):
+            index = load_timestamps(path)
+            if np.array_equal(index["file_ids"], self.file_ids):
+                return index["timestamps"]
+        return parse_timestamps(self.file_ids)
+
+    def _set_frames(self, group_names, file_ids, counts):
+        self.group_names = list(group_names)
+        self.file_ids = np.asarray(file_ids, dtype=str)
+        self.group_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.frame_group = np.repeat(np.arange(len(counts)), counts).astype(np.int32)
+
+    def _match_labels(self):
+        """Row of the label index of every frame, -1 for frames without label file"""
+        label_keys = np.char.add(np.char.add(self.labels.groups[self.labels.frame_groups].astype(str), "/"),
+                                 self.labels.frame_ids.astype(str))
+        frame_keys = np.char.add(np.char.add(np.asarray(self.group_names, dtype=str)[self.frame_group], "/"),
+                                 self.file_ids) if len(self.file_ids) else np.empty(0, dtype=str)
+        order = np.argsort(label_keys)
+        pos = np.minimum(np.searchsorted(label_keys[order], frame_keys), max(len(order) - 1, 0))
+        rows = np.full(len(frame_keys), -1, dtype=np.int64)
+        if len(order):
+            found = label_keys[order][pos] == frame_keys
+            rows[found] = order[pos[found]]
+        return rows
+
+    def __getstate__(self):
+        # memmaps are reopened in every DataLoader worker instead of being pickled
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def _shard(self, shard_id):
+        if self.sparse:
+            # a group at a time, windows read their groups in order
+            if shard_id not in self._shards:
+                self._shards = {shard_id: load_events(join(self.img_dir, self.shard_names[shard_id]))}
+            return self._shards[shard_id]
+        if shard_id not in self._shards:
+            # copy-on-write keeps the pages shared between workers and the tensors writable
+            self._shards[shard_id] = np.load(join(self.img_dir, self.shard_names[shard_id]), mmap_mode="c")
+        return self._shards[shard_id]
+
+    def _decode_frame(self, frame):
+        group = self.group_names[self.frame_group[frame]]
+        return decode_image(join(self.img_dir, group, f"{self.file_ids[frame]}.jpg"))
+
+    def _load_sparse(self, start, end):
+        """Sparse COO [T, C, H, W] of the frames [start, end), read from their groups' coordinate lists"""
+        indices, values = [], []
+        frame = start
+        while frame < end:
+            shard = self.frame_shard[frame]
+            # frames of the same group are consecutive
+            last = frame + int(np.searchsorted(self.frame_shard[frame:end], shard, side="right"))
+            row = int(self.frame_shard_row[frame])
+            group_indices, group_values = events_to_coo(self._shard(shard), row, row + last - frame,
+                                                        self.frame_shape, t_offset=frame - start)
+            indices.append(group_indices)
+            values.append(group_values)
+            frame = last
+        indices = np.concatenate(indices, axis=1) if indices else np.zeros((4, 0), dtype=np.int64)
+        values = np.concatenate(values) if values else np.zeros(0, dtype=np.uint8)
+        return torch.sparse_coo_tensor(torch.from_numpy(indices), torch.from_numpy(values),
+                                       (end - start, *self.frame_shape), is_coalesced=True,
+                                       check_invariants=False)
+
+    def _load_frame(self, frame):
+        if self.sparse:
+            return self._load_sparse(frame, frame + 1)[0]
+        if not self.packed:
+            if self.cache is not None:
+                return self.cache.get_or_load(int(frame), lambda: self._decode_frame(frame))
+            return self._decode_frame(frame)
+        return torch.from_numpy(self._shard(self.frame_shard[frame])[self.frame_shard_row[frame]])
+
+    def _load_frames(self, start, end):
+        if self.sparse:
+            return self._load_sparse(start, end)
+        if self.packed and end > start:
+            first, last = self.frame_shard_row[start], self.frame_shard_row[end - 1]
+            if self.frame_shard[start] == self.frame_shard[end - 1] and last - first == end - 1 - start:
+                # contiguous in one shard (always the case for a group), one view for all the frames
+                return torch.from_numpy(self._shard(self.frame_shard[start])[first:last + 1])
+        return torch.stack([self._load_frame(frame) for frame in range(start, end)])
+
+    def _label(self, frame):
+        """
+        Objects of a frame
+        boxes are the OpenLABEL full_bbox values (x_center, y_center, width, height), classes index self.classes
+        """
+        row = self.label_rows[frame]
+        if row < 0:
+            return torch.zeros((0, 4), dtype=torch.float32), torch.zeros(0, dtype=torch.int64)
+        objects = self.labels.frame_slice(row)
+        return (torch.from_numpy(self.labels.boxes[objects]),
+                torch.from_numpy(self.labels.class_ids[objects].astype(np.int64)))
+
+    def _transform(self, frames, first_frame):
+        if self.transform is None:
+            return frames
+        if frames.is_sparse:
+            frames = frames.to_dense()
+        return self.transform(frames.unsqueeze(0), seeds=[first_frame]).squeeze(0)
+
+    def sample_ranges(self):
+        """(first frame, number of frames) of every sample"""
+        if self.seq_len is not None:
+            return self.samples.astype(np.int64), self.lengths.astype(np.int64)
+        if self.by_group:
+            return self.group_offsets[self.samples], self.lengths.astype(np.int64)
+        return self.samples.astype(np.int64), np.ones(len(self.samples), dtype=np.int64)
+
+    def frame_index(self, file_ids):
+        """Frame of every file id, -1 for the ones not in the dataset"""
+        file_ids = np.asarray(file_ids, dtype=str)
+        order = np.argsort(self.file_ids)
+        pos = np.minimum(np.searchsorted(self.file_ids[order], file_ids), max(len(order) - 1, 0))
+        frames = np.full(len(file_ids), -1, dtype=np.int64)
+        if len(order):
+            found = self.file_ids[order][pos] == file_ids
+            frames[found] = order[pos[found]]
+        return frames
+
+    def cache_stats(self):
+        """hits/misses/size of the decoded frame cache, summed over all workers, None without cache"""
+        return self.cache.stats() if self.cache is not None else None
 
     def __len__(self):
-        return len(self.img_labels)
-    
+        return len(self.samples)
+
     def __getitem__(self, idx):
+        if not -len(self.samples) <= idx < len(self.samples):
+            raise IndexError(f"index {idx} out of range for {len(self.samples)} samples")
+        sample = int(self.samples[idx])
 
-        # TODO consider to change idx to by index and not literal group id?
+        if self.seq_len is not None or self.by_group:
+            # returns all frames in the window/group of idx
+            if self.seq_len is not None:
+                start, end = sample, sample + int(self.lengths[idx])
+            else:
+                start, end = int(self.group_offsets[sample]), int(self.group_offsets[sample + 1])
+            labels = [self._label(frame) for frame in range(start, end)]
+            return {"frame": self._transform(self._load_frames(start, end), start),
+                    "boxes": [boxes for boxes, _ in labels],
+                    "classes": [classes for _, classes in labels]}
+        boxes, classes = self._label(sample)
+        return {"frame": self._transform(self._load_frame(sample), sample), "boxes": boxes, "classes": classes}
 
-        if self.by_group:
-            # returns all frames in the group of idx
 
-            return [{"frame":decode_image(f"{self.img_dir}/{idx}/{key}.jpg"),"label":item} 
-                    for key,item in self.img_labels[idx].items()]
-        image = decode_image(f"{self.img_dir}/{self.img_labels[idx]['group']}/{self.img_labels[idx]['id']}.jpg")
-        return {"frame":image,"label":self.img_labels[idx]['data']}
\ No newline at end of file
+class PairedTUMTraf(Dataset):
+
+    def __init__(self, rgb:TUMTraf, eb:TUMTraf, alignment:Optional[Path]=None, tolerance_ms:float=50):
+        """
+        Synchronized RGB/EB samples of a split, items are {"rgb": item of rgb, "eb": item of eb}
+        Both datasets must use the same mode. An RGB sample is paired with the EB sample that starts at the frame
+        paired with its first one, has the same length and every frame paired in order: by frame these are the frame
+        pairs, by group only groups the two cameras cut at the same frames, with seq_len windows are re-cut on the fly
+        so every synchronized stretch of frames is used. Noise transforms of the two datasets stay independent.
+
+        :param rgb: TUMTraf of the rgb frames
+        :param eb: TUMTraf of the eb_transformed frames of the same split
+        :param alignment: alignment.npz written by preprocess.py for the split, None pairs the frames from their timestamps
+        :param tolerance_ms: Maximum time difference (ms) of a frame pair, only used without alignment
+        """
+        if (rgb.by_group, rgb.seq_len) != (eb.by_group, eb.seq_len):
+            raise ValueError("rgb and eb datasets must use the same mode (frame, by_group or seq_len)")
+        self.rgb = rgb
+        self.eb = eb
+
+        if alignment is not None:
+            pairs = load_alignment(alignment)
+            rgb_frames, eb_frames = rgb.frame_index(pairs["rgb_frame"]), eb.frame_index(pairs["eb_frame"])
+            keep = (rgb_frames >= 0) & (eb_frames >= 0)
+            rgb_frames, eb_frames = rgb_frames[keep], eb_frames[keep]
+        else:
+            tolerance_us = int(round(tolerance_ms * 1000))
+            rgb_ts, eb_ts = rgb.timestamps, eb.timestamps
+            rgb_order, eb_order = np.argsort(rgb_ts, kind="stable"), np.argsort(eb_ts, kind="stable")
+            rgb_frames, eb_frames = align_frames(rgb_ts[rgb_order], eb_ts[eb_order], tolerance_us)
+            rgb_frames, eb_frames = rgb_order[rgb_frames], eb_order[eb_frames]
+        # EB frame of every RGB frame, -1 if unpaired
+        self.frame_pairs = np.full(len(rgb.file_ids), -1, dtype=np.int64)
+        self.frame_pairs[rgb_frames] = eb_frames
+
+        # a stretch is synchronized while the EB frame advances by one with the RGB frame
+        steps = self.frame_pairs - np.arange(len(self.frame_pairs))
+        breaks = np.ones(len(steps), dtype=np.int64)
+        breaks[1:] = ((self.frame_pairs[1:] < 0) | (self.frame_pairs[:-1] < 0) | (steps[1:] != steps[:-1]))
+        breaks = np.cumsum(breaks)
+        rgb_starts, rgb_lengths = rgb.sample_ranges()
+        eb_starts, eb_lengths = eb.sample_ranges()
+        first = self.frame_pairs[rgb_starts]
+        synchronized = np.zeros(len(rgb_starts), dtype=bool)
+        eb_sample = np.zeros(len(rgb_starts), dtype=np.int64)
+        if len(rgb_starts) and len(eb_starts):
+            # eb samples are in frame order
+            eb_sample = np.minimum(np.searchsorted(eb_starts, first), len(eb_starts) - 1)
+            synchronized = (first >= 0) & (breaks[rgb_starts + rgb_lengths - 1] == breaks[rgb_starts]) & \
+                           (eb_starts[eb_sample] == first) & (eb_lengths[eb_sample] == rgb_lengths)
+        self.samples = np.stack([np.flatnonzero(synchronized), eb_sample[synchronized]], axis=1)
+        self.lengths = rgb_lengths[synchronized]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        if not -len(self.samples) <= idx < len(self.samples):
+            raise IndexError(f"index {idx} out of range for {len(self.samples)} samples")
+        rgb_sample, eb_sample = self.samples[idx]
+        return {"rgb": self.rgb[int(rgb_sample)], "eb": self.eb[int(eb_sample)]}
+
+
+def collate_paired(batch):
+    """collate_fn for DataLoader over PairedTUMTraf, each camera is batched by collate_tumtraf"""
+    return {"rgb": collate_tumtraf([item["rgb"] for item in batch]), "eb": collate_tumtraf([item["eb"] for item in batch])}
+
+
+def pad_boxes(boxes, classes):
+    """
+    Packs variable-length box lists into padded tensors, without a python loop per box
+    :param boxes: list of N tensors [K_i, 4]
+    :param classes: list of N tensors [K_i]
+
+    :return: boxes [N, K, 4], classes [N, K] (-1 as padding), mask [N, K] with K = max K_i
+    """
+    counts = torch.tensor([len(c) for c in classes], dtype=torch.int64)
+    n, k = len(classes), int(counts.max()) if len(classes) else 0
+    padded_boxes = torch.zeros((n, k, 4), dtype=torch.float32)
+    padded_classes = torch.full((n, k), -1, dtype=torch.int64)
+    mask = torch.arange(k).unsqueeze(0) < counts.unsqueeze(1)
+    if k:
+        # row-major order of the mask matches the concatenation order
+        padded_boxes[mask] = torch.cat(boxes).float()
+        padded_classes[mask] = torch.cat(classes)
+    return padded_boxes, padded_classes, mask
+
+
+def collate_tumtraf(batch):
+    """
+    collate_fn for DataLoader over TUMTraf, works for every mode
+    frames are stacked to [B, C, H, W] or [B, T, C, H, W], boxes/classes/mask are padded to
+    [B, K, 4] / [B, K] / [B, K], or [B, T, K, 4] / [B, T, K] / [B, T, K] by group/sequence (classes are -1 where mask is False)
+    sequences of different length are zero padded up to the longest one, lengths [B] gives the real length of each
+    sparse frames are batched into a single sparse tensor of the same shape
+    """
+    if not isinstance(batch[0]["boxes"], list):
+        frames = [item["frame"] for item in batch]
+        frames = stack_sparse(frames) if frames[0].is_sparse else torch.stack(frames)
+        boxes, classes, mask = pad_boxes([item["boxes"] for item in batch], [item["classes"] for item in batch])
+        return {"frame": frames, "boxes": boxes, "classes": classes, "mask": mask}
+
+    lengths = torch.tensor([len(item["frame"]) for item in batch], dtype=torch.int64)
+    b, t = len(batch), int(lengths.max())
+    if batch[0]["frame"].is_sparse:
+        frames = stack_sparse([item["frame"] for item in batch], t)
+    elif bool((lengths == t).all()):
+        frames = torch.stack([item["frame"] for item in batch])
+    else:
+        frames = batch[0]["frame"].new_zeros((b, t, *batch[0]["frame"].shape[1:]))
+        for i, item in enumerate(batch):
+            frames[i, :len(item["frame"])] = item["frame"]
+    # every (sample, frame) becomes a row, padded frames get empty rows, and is reshaped back
+    empty_boxes, empty_classes = torch.zeros((0, 4)), torch.zeros(0, dtype=torch.int64)
+    boxes, classes, mask = pad_boxes(
+        [b for item in batch for b in item["boxes"] + [empty_boxes] * (t - len(item["boxes"]))],
+        [c for item in batch for c in item["classes"] + [empty_classes] * (t - len(item["classes"]))])
+    boxes, classes, mask = boxes.view(b, t, -1, 4), classes.view(b, t, -1), mask.view(b, t, -1)
+    return {"frame": frames, "boxes": boxes, "classes": classes, "mask": mask, "lengths": lengths}
@@ -0,0 +1,180 @@
+import os
+import json
+import zlib
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import torch
+
+
+def _as_intensity(frames:torch.Tensor) -> torch.Tensor:
+    """[T, H, W] or [T, C, H, W] frames, uint8 or float in [0, 1], as float [T, C, H, W] in [0, 1]"""
+    if frames.dim() == 3:
+        frames = frames.unsqueeze(1)
+    if frames.dim() != 4:
+        raise ValueError(f"expected frames of shape [T, H, W] or [T, C, H, W], got {tuple(frames.shape)}")
+    if frames.dtype == torch.uint8:
+        return frames.float().div_(255.0)
+    return frames.float().clamp(0.0, 1.0)
+
+
+def rate_encode(frames:torch.Tensor, num_steps:int=1, gain:float=1.0,
+                generator:Optional[torch.Generator]=None) -> torch.Tensor:
+    """
+    Rate coding, every pixel spikes with probability gain * intensity at each step
+    :param frames: [T, H, W] or [T, C, H, W], uint8 or float in [0, 1]
+    :param num_steps: simulation steps per frame
+    :param gain: scales the spike probability
+    :param generator: seeded torch.Generator for reproducible spikes
+
+    :return: spikes [T * num_steps, C, H, W] float
+    """
+    prob = _as_intensity(frames).mul_(gain).clamp_(0.0, 1.0)
+    prob = prob.repeat_interleave(num_steps, dim=0)
+    return torch.bernoulli(prob, generator=generator)
+
+
+def latency_encode(frames:torch.Tensor, num_steps:int=8, threshold:float=0.01) -> torch.Tensor:
+    """
+    Latency / time-to-first-spike coding, brighter pixels spike earlier inside the num_steps window of their frame,
+    pixels below threshold never spike
+    :param frames: [T, H, W] or [T, C, H, W], uint8 or float in [0, 1]
+    :param num_steps: steps per frame, the brightest pixels spike at step 0 and the dimmest at num_steps - 1
+    :param threshold: minimum intensity to spike
+
+    :return: spikes [T * num_steps, C, H, W] float, at most one spike per pixel and frame
+    """
+    intensity = _as_intensity(frames)
+    spike_step = torch.round((1.0 - intensity) * (num_steps - 1)).long()
+    steps = torch.arange(num_steps).view(1, num_steps, 1, 1, 1)
+    spikes = (spike_step.unsqueeze(1) == steps) & (intensity >= threshold).unsqueeze(1)
+    return spikes.flatten(0, 1).float()
+
+
+def delta_encode(frames:torch.Tensor, threshold:float=0.1, polarity:bool=True, padding:bool=False) -> torch.Tensor:
+    """
+    Delta / temporal-contrast coding, a pixel spikes when its intensity changes more than threshold
+    from the previous frame
+    :param frames: [T, H, W] or [T, C, H, W], uint8 or float in [0, 1]
+    :param threshold: minimum intensity change to spike
+    :param polarity: separate ON (increase) and OFF (decrease) channels, otherwise any change spikes
+    :param padding: the first frame is compared to itself (no spikes), otherwise to a black frame
+
+    :return: spikes [T, 2C, H, W] with polarity ([:, :C] ON, [:, C:] OFF), [T, C, H, W] without, float
+    """
+    intensity = _as_intensity(frames)
+    reference = intensity[:1] if padding else torch.zeros_like(intensity[:1])
+    delta = torch.diff(intensity, dim=0, prepend=reference)
+    if not polarity:
+        return (delta.abs() >= threshold).float()
+    return torch.cat([delta >= threshold, delta <= -threshold], dim=1).float()
+
+
+def population_encode(frames:torch.Tensor, num_neurons:int=8, sigma:Optional[float]=None, num_steps:int=1,
+                      generator:Optional[torch.Generator]=None) -> torch.Tensor:
+    """
+    Population coding, every pixel drives num_neurons neurons with gaussian receptive fields evenly spread
+    over [0, 1], each neuron spikes with probability equal to its response
+    :param frames: [T, H, W] or [T, C, H, W], uint8 or float in [0, 1]
+    :param num_neurons: neurons per pixel
+    :param sigma: width of the receptive fields, defaults to the distance between two centers
+    :param num_steps: simulation steps per frame
+    :param generator: seeded torch.Generator for reproducible spikes
+
+    :return: spikes [T * num_steps, C * num_neurons, H, W] float, channel c * num_neurons + n is neuron n of channel c
+    """
+    intensity = _as_intensity(frames)
+    centers = torch.linspace(0.0, 1.0, num_neurons).view(1, 1, num_neurons, 1, 1)
+    sigma = sigma if sigma is not None else 1.0 / max(num_neurons - 1, 1)
+    response = torch.exp(-((intensity.unsqueeze(2) - centers) ** 2) / (2 * sigma ** 2)).flatten(1, 2)
+    return torch.bernoulli(response.repeat_interleave(num_steps, dim=0), generator=generator)
+
+
+ENCODINGS = {
+    "rate": rate_encode,
+    "latency": latency_encode,
+    "delta": delta_encode,
+    "population": population_encode,
+}
+# encodings that draw random numbers
+_STOCHASTIC = {"rate", "population"}
+
+
+class SpikeEncoder:
+    """
+    Turns whole frame stacks into spike trains with one of ENCODINGS, in batched tensor ops.
+    Stochastic encodings are seeded per key (eg. the group id), so a group always gets the same spikes
+    whatever the order it is visited in. With cache_dir, encoded groups are stored bit-packed on disk,
+    keyed by the key and a hash of the encoding parameters, and loaded instead of encoded on the next epochs
+    as long as the frames have the digest stored with them (a rewritten group is encoded again).
+    """
+
+    def __init__(self, method:str="rate", seed:int=0, cache_dir:Optional[Path]=None, **params):
+        """
+        :param method: one of ENCODINGS
+        :param seed: base seed of the stochastic encodings
+        :param cache_dir: folder of the spike cache, None disables it
+        :param params: keyword arguments of the encoding function (num_steps, threshold...)
+        """
+        if method not in ENCODINGS:
+            raise ValueError(f"unknown encoding {method}, expected one of {list(ENCODINGS)}")
+        self.method = method
+        self.seed = seed
+        self.params = params
+        self.encode_fn = ENCODINGS[method]
+        config = json.dumps({"method": method, "seed": seed, "params": params}, sort_keys=True)
+        self.config_hash = hashlib.sha1(config.encode()).hexdigest()[:12]
+        self.cache_dir = Path(cache_dir) / f"{method}_{self.config_hash}" if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.cache_dir / "config.json", "w") as f:
+                f.write(config)
+
+    def _generator(self, key:Optional[str]) -> torch.Generator:
+        seed = self.seed if key is None else self.seed ^ zlib.crc32(str(key).encode())
+        return torch.Generator().manual_seed(seed)
+
+    def _cache_path(self, key:str) -> Path:
+        return self.cache_dir / (str(key).replace("/", "_") + ".npz")
+
+    @staticmethod
+    def fingerprint(frames:torch.Tensor) -> str:
+        """Digest of the frames, their shape and dtype"""
+        frames = frames.to_dense() if frames.is_sparse else frames
+        digest = hashlib.blake2b(f"{tuple(frames.shape)}{frames.dtype}".encode(), digest_size=8)
+        digest.update(frames.detach().cpu().contiguous().numpy().tobytes())
+        return digest.hexdigest()
+
+    def encode(self, frames:torch.Tensor, key:Optional[str]=None) -> torch.Tensor:
+        """Encodes frames [T, H, W] or [T, C, H, W] without touching the cache"""
+        params = dict(self.params)
+        if self.method in _STOCHASTIC:
+            params["generator"] = self._generator(key)
+        return self.encode_fn(frames, **params)
+
+    def __call__(self, frames:torch.Tensor, key:Optional[str]=None) -> torch.Tensor:
+        """
+        :param frames: [T, H, W] or [T, C, H, W], uint8 or float in [0, 1]
+        :param key: identifier of the frames (eg. split/camera/group), required to use the cache
+
+        :return: spikes, float tensor with the layout of the encoding
+        """
+        if self.cache_dir is None or key is None:
+            return self.encode(frames, key)
+        path = self._cache_path(key)
+        fingerprint = self.fingerprint(frames)
+        if path.exists():
+            with np.load(path) as data:
+                if "fingerprint" in data and str(data["fingerprint"]) == fingerprint:
+                    shape = tuple(data["shape"])
+                    bits = np.unpackbits(data["bits"], count=int(np.prod(shape)))
+                    return torch.from_numpy(bits.reshape(shape)).float()
+        spikes = self.encode(frames, key)
+        # one temp file per process, DataLoader workers may encode the same key at the same time
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp.npz")
+        np.savez(tmp_path, shape=np.asarray(spikes.shape), bits=np.packbits(spikes.numpy().astype(bool)),
+                 fingerprint=np.asarray(fingerprint))
+        tmp_path.replace(path)
+        return spikes
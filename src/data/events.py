@@ -0,0 +1,66 @@
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+import torch
+
+# written by scripts/preprocess.py --format sparse, one file per group next to index.json
+SPARSE_GROUP_NAME = "{:04d}.npz"
+
+
+def dense_to_events(frames:np.ndarray) -> dict:
+    """
+    Coordinate list of the non-zero pixels of a stack of frames
+    :param frames: [T, C, H, W] uint8
+
+    :return: dict of offsets [T + 1] (frame t owns the events [offsets[t], offsets[t+1])),
+        c, y, x coordinates and values of the events, in frame then raster order
+    """
+    t, c, y, x = np.nonzero(frames)
+    offsets = np.searchsorted(t, np.arange(len(frames) + 1)).astype(np.int64)
+    return {"offsets": offsets, "c": c.astype(np.uint8), "y": y.astype(np.uint16), "x": x.astype(np.uint16),
+            "values": frames[t, c, y, x]}
+
+
+def save_events(path:Path, events:dict) -> None:
+    np.savez(path, **events)
+
+
+def load_events(path:Path) -> dict:
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def events_to_coo(events:dict, start:int, end:int, shape:Sequence[int], t_offset:int=0):
+    """
+    Indices [4, N] (t, c, y, x) and values [N] of the frames [start, end) of a group
+    :param events: dense_to_events of the group
+    :param start: first frame of the group to take
+    :param end: frame after the last one
+    :param shape: [C, H, W] of the frames
+    :param t_offset: added to the frame position, to place the frames in a longer sequence
+    """
+    first, last = int(events["offsets"][start]), int(events["offsets"][end])
+    counts = np.diff(events["offsets"][start:end + 1])
+    t = np.repeat(np.arange(t_offset, t_offset + end - start), counts)
+    indices = np.stack([t, events["c"][first:last], events["y"][first:last], events["x"][first:last]]).astype(np.int64)
+    return indices, events["values"][first:last]
+
+
+def stack_sparse(tensors:List[torch.Tensor], length:int=None) -> torch.Tensor:
+    """
+    Batches sparse COO tensors [T_i, ...] (or [...]) into one [B, T, ...] (or [B, ...]) sparse tensor,
+    shorter sequences are padded (with nothing) up to length, the longest one by default
+    """
+    shape = list(tensors[0].shape)
+    if length is not None:
+        shape[0] = length
+    elif len(shape) == 4:
+        shape[0] = max(t.shape[0] for t in tensors)
+    indices, values = [], []
+    for i, tensor in enumerate(tensors):
+        tensor_indices = tensor._indices()
+        indices.append(torch.cat([torch.full((1, tensor_indices.shape[1]), i, dtype=torch.int64), tensor_indices]))
+        values.append(tensor._values())
+    return torch.sparse_coo_tensor(torch.cat(indices, dim=1), torch.cat(values), (len(tensors), *shape),
+                                   check_invariants=False)
@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+# every class found in the labels, the datasets drop some of them (see TUMTraf.CLASSES)
+ALL_CLASSES = ["BICYCLE", "BUS", "CAR", "MOTORCYCLE", "PEDESTRIAN", "TRAILER", "TRUCK"]
+# cache of the index over ALL_CLASSES, kept apart so it never invalidates the datasets' one
+ALL_CLASSES_CACHE_NAME = ".label_index_all.npz"
+
+
+def _label_files(label_dir:Path):
+    """
+    Label files of a preprocessed label folder, sorted by group and frame id
+    Also accepts a flat folder of labels (raw dataset), those frames get the group ""
+
+    :return: list of (group, file_id, path)
+    """
+    files = []
+    with os.scandir(label_dir) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir():
+            with os.scandir(entry.path) as group_entries:
+                for group_entry in sorted(group_entries, key=lambda e: e.name):
+                    if group_entry.name.endswith(".json"):
+                        files.append((entry.name, group_entry.name[:-len(".json")], group_entry.path))
+        elif entry.name.endswith(".json"):
+            files.append(("", entry.name[:-len(".json")], entry.path))
+    return files
+
+
+def _fingerprint(files, classes:Sequence[str]) -> str:
+    # cheap to compute (no file is opened), changes when any label is added, removed or rewritten
+    digest = hashlib.sha1(",".join(classes).encode())
+    for group, file_id, path in files:
+        stat = os.stat(path)
+        digest.update(f"{group}/{file_id}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def parse_openlabel(payload:dict, class_to_id:dict):
+    """
+    Objects of an OpenLABEL file that belong to one of the classes
+
+    :return: list of (class_id, x, y, w, h) with the full_bbox values
+    """
+    objects = []
+    for frame_content in payload.get("openlabel", {}).get("frames", {}).values():
+        for obj in frame_content.get("objects", {}).values():
+            object_data = obj.get("object_data", {})
+            obj_type = object_data.get("type") or obj.get("type")
+            if obj_type not in class_to_id:
+                continue
+            bbox_entries = object_data.get("bbox", [])
+            if not bbox_entries:
+                continue
+            full_bbox = next((entry for entry in bbox_entries if entry.get("name") == "full_bbox"), bbox_entries[0])
+            vals = full_bbox.get("val", [])
+            if len(vals) != 4:
+                continue
+            objects.append((class_to_id[obj_type], *vals))
+    return objects
+
+
+class LabelIndex:
+    """
+    Columnar version of the OpenLABEL files of a split/camera, only keeps the objects of the given classes.
+    Frame i owns the objects in [frame_offsets[i], frame_offsets[i+1]), boxes are the full_bbox values
+    (x_center, y_center, width, height) as stored in the labels.
+    Built once and cached next to the labels, so opening a dataset does not parse any JSON.
+    """
+
+    CACHE_NAME = ".label_index.npz"
+    VERSION = 1
+
+    def __init__(self, classes:Sequence[str], groups:np.ndarray, frame_groups:np.ndarray, frame_ids:np.ndarray,
+                 frame_offsets:np.ndarray, frame_idx:np.ndarray, class_ids:np.ndarray, boxes:np.ndarray):
+        self.classes = list(classes)
+        self.groups = groups                # [G] group names
+        self.frame_groups = frame_groups    # [F] index into groups
+        self.frame_ids = frame_ids          # [F] file ids (timestamps)
+        self.frame_offsets = frame_offsets  # [F + 1]
+        self.frame_idx = frame_idx          # [K] frame of every object
+        self.class_ids = class_ids          # [K] index into classes
+        self.boxes = boxes                  # [K, 4] float32
+        # frames are sorted by group, group g owns the frames in [group_offsets[g], group_offsets[g+1])
+        self.group_offsets = np.searchsorted(frame_groups, np.arange(len(groups) + 1))
+
+    def __len__(self):
+        return len(self.frame_ids)
+
+    @property
+    def num_objects(self) -> int:
+        return len(self.class_ids)
+
+    def frame_slice(self, frame:int) -> slice:
+        return slice(int(self.frame_offsets[frame]), int(self.frame_offsets[frame + 1]))
+
+    def group_frames(self, group:int) -> range:
+        """Rows of the frames of a group, in frame id order"""
+        return range(int(self.group_offsets[group]), int(self.group_offsets[group + 1]))
+
+    @classmethod
+    def build(cls, label_dir:Path, classes:Sequence[str], files=None) -> "LabelIndex":
+        """
+        Parses every label file of label_dir
+        :param label_dir: preprocessed label folder (one subfolder per group) or a flat folder of labels
+        :param classes: classes to keep, their position is the class id
+        """
+        files = _label_files(Path(label_dir)) if files is None else files
+        class_to_id = {name: i for i, name in enumerate(classes)}
+        group_names = sorted({group for group, _, _ in files})
+        group_to_id = {name: i for i, name in enumerate(group_names)}
+
+        frame_groups = np.empty(len(files), dtype=np.int32)
+        frame_offsets = np.zeros(len(files) + 1, dtype=np.int64)
+        rows = []
+        for i, (group, _, path) in enumerate(files):
+            with open(path, "r") as f:
+                objects = parse_openlabel(json.load(f), class_to_id)
+            frame_groups[i] = group_to_id[group]
+            frame_offsets[i + 1] = frame_offsets[i] + len(objects)
+            rows.extend(objects)
+
+        table = np.asarray(rows, dtype=np.float32).reshape(-1, 5)
+        return cls(classes,
+                   groups=np.asarray(group_names, dtype=str),
+                   frame_groups=frame_groups,
+                   frame_ids=np.asarray([file_id for _, file_id, _ in files], dtype=str),
+                   frame_offsets=frame_offsets,
+                   frame_idx=np.repeat(np.arange(len(files), dtype=np.int32), np.diff(frame_offsets)),
+                   class_ids=table[:, 0].astype(np.int16),
+                   boxes=np.ascontiguousarray(table[:, 1:]))
+
+    def save(self, path:Path, fingerprint:str="") -> None:
+        np.savez(path, version=self.VERSION, fingerprint=fingerprint, classes=np.asarray(self.classes, dtype=str),
+                 groups=self.groups, frame_groups=self.frame_groups, frame_ids=self.frame_ids,
+                 frame_offsets=self.frame_offsets, frame_idx=self.frame_idx,
+                 class_ids=self.class_ids, boxes=self.boxes)
+
+    @classmethod
+    def load(cls, path:Path) -> "LabelIndex":
+        with np.load(path) as data:
+            return cls(data["classes"].tolist(), data["groups"], data["frame_groups"], data["frame_ids"],
+                       data["frame_offsets"], data["frame_idx"], data["class_ids"], data["boxes"])
+
+    @classmethod
+    def open(cls, label_dir:Path, classes:Sequence[str], cache_path:Optional[Path]=None) -> "LabelIndex":
+        """
+        Loads the cached index of label_dir, (re)building it when the labels or classes changed
+        :param label_dir: preprocessed label folder
+        :param classes: classes to keep
+        :param cache_path: where the index is cached, defaults to label_dir/.label_index.npz
+        """
+        label_dir = Path(label_dir)
+        cache_path = Path(cache_path) if cache_path is not None else label_dir / cls.CACHE_NAME
+        files = _label_files(label_dir)
+        fingerprint = _fingerprint(files, classes)
+        if cache_path.exists():
+            with np.load(cache_path) as data:
+                valid = int(data["version"]) == cls.VERSION and str(data["fingerprint"]) == fingerprint
+            if valid:
+                return cls.load(cache_path)
+
+        index = cls.build(label_dir, classes, files)
+        try:
+            index.save(cache_path, fingerprint)
+        except OSError as e:
+            # read-only datasets still work, they just parse the labels every time
+            print(f"Could not cache label index at {cache_path}: {e}")
+        return index
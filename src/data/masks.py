@@ -0,0 +1,188 @@
+import json
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import torch
+
+# shapes of N removed pixels, see notes.md ("which shape or distribution D removes more information?")
+MASK_SHAPES = ["diagonal", "anti_diagonal", "center", "border", "top", "bottom", "left", "right", "random"]
+
+
+def _grid(height:int, width:int):
+    """Pixel centers in normalized coordinates, rows [H, 1] and cols [1, W]"""
+    return ((np.arange(height) + 0.5) / height)[:, None], ((np.arange(width) + 0.5) / width)[None, :]
+
+
+def mask_scores(shape:str, height:int, width:int, seed:int=0) -> np.ndarray:
+    """
+    Removal order of the pixels of a frame for a mask shape, the lowest scores are removed first
+    :param shape: one of MASK_SHAPES, diagonal goes from the top left to the bottom right corner
+    :param seed: seed of the random shape
+
+    :return: float64 [H, W]
+    """
+    rows, cols = _grid(height, width)
+    # distance to the center in normalized coordinates, squares grow from the center
+    center = np.maximum(np.abs(rows - 0.5), np.abs(cols - 0.5))
+    scores = {"diagonal": lambda: np.abs(rows - cols),
+              "anti_diagonal": lambda: np.abs(rows + cols - 1),
+              "center": lambda: center,
+              "border": lambda: -center,
+              "top": lambda: rows + 0 * cols,
+              "bottom": lambda: -rows + 0 * cols,
+              "left": lambda: cols + 0 * rows,
+              "right": lambda: -cols + 0 * rows,
+              "random": lambda: np.random.default_rng(seed).random((height, width))}
+    if shape not in scores:
+        raise ValueError(f"unknown mask shape {shape}, expected one of {MASK_SHAPES}")
+    return scores[shape]()
+
+
+def budget_masks(scores:np.ndarray, fractions:Sequence[float]) -> np.ndarray:
+    """
+    Masks of exactly round(fraction * H * W) pixels, the lowest scores first (ties in raster order),
+    one sort serves every fraction
+    :param scores: [H, W] removal order
+    :param fractions: fractions of the pixels to remove
+
+    :return: bool [F, H, W], True where the pixel is removed
+    """
+    height, width = scores.shape
+    rank = np.empty(height * width, dtype=np.int64)
+    rank[np.argsort(scores.ravel(), kind="stable")] = np.arange(height * width)
+    counts = np.round(np.asarray(fractions, dtype=np.float64) * height * width).astype(np.int64)
+    return (rank[None, :] < counts[:, None]).reshape(len(counts), height, width)
+
+
+def budget_mask(shape:str, height:int, width:int, fraction:float, seed:int=0) -> np.ndarray:
+    """
+    Mask of exactly round(fraction * H * W) pixels of a shape, so every shape removes the same number of pixels
+    :return: bool [H, W], True where the pixel is removed
+    """
+    return budget_masks(mask_scores(shape, height, width, seed), [fraction])[0]
+
+
+def build_masks(height:int, width:int, fraction:float, shapes:Sequence[str]=MASK_SHAPES, seed:int=0) -> Dict[str, np.ndarray]:
+    """Masks of every shape with the same pixel budget, by shape name"""
+    return {shape: budget_mask(shape, height, width, fraction, seed) for shape in shapes}
+
+
+def box_occupancy(boxes:np.ndarray, height:int, width:int) -> np.ndarray:
+    """
+    How many boxes cover every pixel, summed with a 2D difference table (no per box painting)
+    :param boxes: [K, 4] full_bbox values (x_center, y_center, width, height) in pixels
+
+    :return: int64 [H, W]
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x0 = np.clip(np.floor(boxes[:, 0] - boxes[:, 2] / 2), 0, width).astype(np.int64)
+    x1 = np.clip(np.ceil(boxes[:, 0] + boxes[:, 2] / 2), 0, width).astype(np.int64)
+    y0 = np.clip(np.floor(boxes[:, 1] - boxes[:, 3] / 2), 0, height).astype(np.int64)
+    y1 = np.clip(np.ceil(boxes[:, 1] + boxes[:, 3] / 2), 0, height).astype(np.int64)
+    keep = (x1 > x0) & (y1 > y0)
+    x0, x1, y0, y1 = x0[keep], x1[keep], y0[keep], y1[keep]
+    table = np.zeros((height + 1) * (width + 1), dtype=np.int64)
+    for rows, cols, sign in ((y0, x0, 1), (y0, x1, -1), (y1, x0, -1), (y1, x1, 1)):
+        table += sign * np.bincount(rows * (width + 1) + cols, minlength=len(table))
+    return table.reshape(height + 1, width + 1).cumsum(axis=0).cumsum(axis=1)[:height, :width]
+
+
+def bank_geometries(height:int, width:int, bands:int=8, diagonals:int=5, random_seeds:int=4,
+                    occupancy:Optional[np.ndarray]=None, seed:int=0) -> Dict[str, np.ndarray]:
+    """
+    Removal orders of every geometry of a mask bank, by name
+        the MASK_SHAPES, random with random_seeds seeds (random_s<i>)
+        hband<i>/vband<i>: horizontal/vertical bands centered at bands evenly spaced positions
+        diagonal<i>/anti_diagonal<i>: diagonals shifted across the frame (diagonals offsets, 0 is left out)
+        boxes_hot/boxes_cold: the pixels most/least covered by the labelled boxes (occupancy)
+    """
+    rows, cols = _grid(height, width)
+    geometries = {shape: mask_scores(shape, height, width, seed) for shape in MASK_SHAPES if shape != "random"}
+    for i in range(random_seeds):
+        geometries[f"random_s{i}"] = mask_scores("random", height, width, seed + i)
+    for i, center in enumerate((np.arange(bands) + 0.5) / max(bands, 1)):
+        geometries[f"hband{i}"] = np.abs(rows - center) + 0 * cols
+        geometries[f"vband{i}"] = np.abs(cols - center) + 0 * rows
+    for i, offset in enumerate(np.linspace(-0.5, 0.5, diagonals) if diagonals > 1 else []):
+        if np.isclose(offset, 0):
+            # the diagonals of MASK_SHAPES
+            continue
+        geometries[f"diagonal{i}"] = np.abs(rows - cols - offset)
+        geometries[f"anti_diagonal{i}"] = np.abs(rows + cols - 1 - offset)
+    if occupancy is not None and occupancy.any():
+        # ties (eg. never covered pixels) are broken at random, not in raster order
+        jitter = np.random.default_rng(seed).random((height, width)) * 0.5
+        geometries["boxes_hot"] = -(occupancy + jitter)
+        geometries["boxes_cold"] = occupancy + jitter
+    return geometries
+
+
+class MaskBank:
+    """
+    Bank of boolean masks of one frame size, stored bit-packed (1 bit per pixel) and unpacked by chunk
+    Every mask has a name (<geometry>@<fraction>), its geometry and the fraction of pixels it removes
+    """
+
+    def __init__(self, names:Sequence[str], geometries:Sequence[str], fractions:Sequence[float], bits:np.ndarray,
+                 shape:Sequence[int], config:Optional[dict]=None):
+        self.names = list(names)
+        self.geometries = list(geometries)
+        self.fractions = np.asarray(fractions, dtype=np.float64)
+        self.bits = bits                    # [M, ceil(H * W / 8)] uint8
+        self.shape = tuple(int(dim) for dim in shape)
+        self.config = config or {}
+        self._index = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def index(self, name:str) -> int:
+        return self._index[name]
+
+    def masks(self, indices) -> torch.Tensor:
+        """bool [K, H, W] masks of the given indices, True where the pixel is removed"""
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+        unpacked = np.unpackbits(self.bits[indices], axis=1, count=self.shape[0] * self.shape[1])
+        return torch.from_numpy(unpacked.view(bool).reshape(len(indices), *self.shape))
+
+    @classmethod
+    def build(cls, height:int, width:int, fractions:Sequence[float], bands:int=8, diagonals:int=5,
+              random_seeds:int=4, occupancy:Optional[np.ndarray]=None, seed:int=0) -> "MaskBank":
+        """Every geometry of bank_geometries at every fraction"""
+        config = {"height": height, "width": width, "fractions": [float(f) for f in fractions], "bands": bands,
+                  "diagonals": diagonals, "random_seeds": random_seeds, "seed": seed,
+                  "boxes": int(occupancy.sum()) if occupancy is not None else 0}
+        names, geometries, mask_fractions, bits = [], [], [], []
+        for geometry, scores in bank_geometries(height, width, bands, diagonals, random_seeds, occupancy, seed).items():
+            masks = budget_masks(scores, fractions)
+            bits.append(np.packbits(masks.reshape(len(masks), -1), axis=1))
+            names += [f"{geometry}@{fraction:g}" for fraction in fractions]
+            geometries += [geometry] * len(fractions)
+            mask_fractions += list(fractions)
+        bits = np.concatenate(bits) if bits else np.zeros((0, -(-height * width // 8)), dtype=np.uint8)
+        return cls(names, geometries, mask_fractions, bits, (height, width), config)
+
+    def save(self, path:Path) -> None:
+        np.savez(path, names=np.asarray(self.names, dtype=str), geometries=np.asarray(self.geometries, dtype=str),
+                 fractions=self.fractions, bits=self.bits, shape=np.asarray(self.shape),
+                 config=np.asarray(json.dumps(self.config)))
+
+    @classmethod
+    def load(cls, path:Path) -> "MaskBank":
+        with np.load(path) as data:
+            config = json.loads(str(data["config"]))
+            return cls(data["names"].tolist(), data["geometries"].tolist(), data["fractions"], data["bits"],
+                       data["shape"].tolist(), config)
+
+
+def apply_masks(x:torch.Tensor, masks:torch.Tensor, value:float=0) -> torch.Tensor:
+    """
+    Every mask applied to every sample in one broadcast, mask k of sample b is at k * B + b
+    :param x: [B, ..., H, W] frames
+    :param masks: bool [K, H, W], True where the pixel is removed
+
+    :return: [K * B, ..., H, W]
+    """
+    masks = masks.to(x.device).view(len(masks), *([1] * (x.dim() - 2)), *masks.shape[-2:])
+    return torch.where(masks, torch.as_tensor(value, dtype=x.dtype, device=x.device), x.unsqueeze(0)).flatten(0, 1)
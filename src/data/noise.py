@@ -0,0 +1,269 @@
+import math
+from typing import Optional, Sequence, Union
+
+import torch
+
+# random numbers come from a counter-based hash (seed, element) -> uint32, so every sample of a batch
+# has its own seeded stream, and the noise of a sample does not depend on the rest of the batch,
+# while the whole batch is still generated in a few vectorized ops
+_MASK32 = 0xFFFFFFFF
+
+
+def _mix32(x:torch.Tensor) -> torch.Tensor:
+    # lowbias32 integer hash, on int64 tensors holding uint32 values
+    x = x ^ (x >> 16)
+    x = (x * 0x7FEB352D) & _MASK32
+    x = x ^ (x >> 15)
+    x = (x * 0x846CA68B) & _MASK32
+    return x ^ (x >> 16)
+
+
+def _as_seeds(seeds, batch_size:int, base_seed:int) -> torch.Tensor:
+    if seeds is None:
+        seeds = torch.arange(batch_size)
+    seeds = torch.as_tensor(seeds, dtype=torch.int64).reshape(-1)
+    if len(seeds) != batch_size:
+        raise ValueError(f"got {len(seeds)} seeds for a batch of {batch_size}")
+    return (seeds + base_seed) & _MASK32
+
+
+def uniform(seeds:torch.Tensor, shape:Sequence[int], stream:int=0) -> torch.Tensor:
+    """
+    Uniform [0, 1) numbers, one independent stream per sample
+    :param seeds: int64 [B], one seed per sample
+    :param shape: shape of the numbers of one sample
+    :param stream: selects another independent stream for the same seeds
+
+    :return: float32 [B, *shape]
+    """
+    numel = math.prod(shape)
+    key = _mix32(_mix32(seeds.view(-1, 1) ^ (stream * 0x9E3779B9 & _MASK32)) + 0x632BE5AB)
+    counter = torch.arange(numel, dtype=torch.int64).view(1, -1)
+    bits = _mix32(((counter + key) & _MASK32) ^ (key >> 7))
+    # 24 bits are exact in float32
+    return ((bits >> 8).float() * (1.0 / (1 << 24))).view(len(seeds), *shape)
+
+
+def normal(seeds:torch.Tensor, shape:Sequence[int], stream:int=0) -> torch.Tensor:
+    """Standard normal numbers, one independent stream per sample (Box-Muller)"""
+    u1 = uniform(seeds, shape, 2 * stream).clamp_min_(1e-7)
+    u2 = uniform(seeds, shape, 2 * stream + 1)
+    return torch.sqrt(-2.0 * torch.log(u1)) * torch.cos(2.0 * math.pi * u2)
+
+
+def _poisson(lam:torch.Tensor, u:torch.Tensor, z:torch.Tensor, max_small:float=12.0) -> torch.Tensor:
+    """Poisson samples from uniforms u (inversion, small rates) and normals z (normal approximation, large rates)"""
+    out = torch.clamp(torch.round(lam + torch.sqrt(lam) * z), min=0.0)
+    small = (lam < max_small) & (lam > 0)
+    out[lam <= 0] = 0.0
+    if small.any():
+        lam_s, u_s = lam[small], u[small]
+        k = torch.zeros_like(lam_s)
+        p = torch.exp(-lam_s)
+        cdf = p.clone()
+        for i in range(1, 64):
+            above = u_s > cdf
+            if not above.any():
+                break
+            k += above
+            p = p * lam_s / i
+            cdf += p
+        out[small] = k
+    return out
+
+
+class Noise:
+    """
+    Base class of the batched noise transforms.
+    Called on a whole batch [B, T, C, H, W] (or [B, C, H, W]), uint8 in [0, 255] or float in [0, 1],
+    returns a corrupted copy with the same shape and dtype. seeds gives one seed per sample
+    (defaults to 0..B-1), combined with the seed of the transform.
+    """
+
+    def __init__(self, seed:int=0):
+        self.seed = seed
+
+    def __call__(self, x:torch.Tensor, seeds:Optional[Union[Sequence[int], torch.Tensor]]=None) -> torch.Tensor:
+        if x.dim() not in (4, 5):
+            raise ValueError(f"expected a batch [B, T, C, H, W] or [B, C, H, W], got {tuple(x.shape)}")
+        seeds = _as_seeds(seeds, x.shape[0], self.seed)
+        is_uint8 = x.dtype == torch.uint8
+        values = x.float().div_(255.0) if is_uint8 else x.float()
+        out = self.apply(values, seeds).clamp_(0.0, 1.0)
+        if is_uint8:
+            return out.mul_(255.0).round_().to(torch.uint8)
+        return out.to(x.dtype)
+
+    def apply(self, x:torch.Tensor, seeds:torch.Tensor) -> torch.Tensor:
+        """x float in [0, 1], seeds int64 [B]"""
+        raise NotImplementedError
+
+    def __repr__(self):
+        params = ", ".join(f"{k}={v}" for k, v in self.__dict__.items())
+        return f"{type(self).__name__}({params})"
+
+
+class GaussianNoise(Noise):
+    """Additive gaussian noise of standard deviation sigma"""
+
+    def __init__(self, sigma:float, seed:int=0):
+        super().__init__(seed)
+        self.sigma = sigma
+
+    def apply(self, x, seeds):
+        return x + self.sigma * normal(seeds, x.shape[1:])
+
+
+class SaltPepperNoise(Noise):
+    """A fraction amount of the values is set to 1 (salt) or 0 (pepper)"""
+
+    def __init__(self, amount:float, salt_ratio:float=0.5, seed:int=0):
+        super().__init__(seed)
+        self.amount = amount
+        self.salt_ratio = salt_ratio
+
+    def apply(self, x, seeds):
+        hit = uniform(seeds, x.shape[1:], 0) < self.amount
+        salt = uniform(seeds, x.shape[1:], 1) < self.salt_ratio
+        return torch.where(hit, salt.to(x.dtype), x)
+
+
+class ShotNoise(Noise):
+    """Shot / Poisson noise, intensities are turned into photon counts with photons at full scale"""
+
+    def __init__(self, photons:float, seed:int=0):
+        super().__init__(seed)
+        self.photons = photons
+
+    def apply(self, x, seeds):
+        lam = x * self.photons
+        counts = _poisson(lam, uniform(seeds, x.shape[1:], 0), normal(seeds, x.shape[1:], 1))
+        return counts / self.photons
+
+
+class BackgroundActivityNoise(Noise):
+    """
+    Event camera background activity, spurious events fire independently on every pixel of every frame
+    with probability rate (the event sets the pixel to value)
+    """
+
+    def __init__(self, rate:float, value:float=1.0, seed:int=0):
+        super().__init__(seed)
+        self.rate = rate
+        self.value = value
+
+    def apply(self, x, seeds):
+        # one draw per pixel and frame, shared by the channels
+        shape = (*x.shape[1:-3], 1, *x.shape[-2:])
+        fire = uniform(seeds, shape) < self.rate
+        return torch.where(fire, torch.full_like(x, self.value), x)
+
+
+class HotPixelNoise(Noise):
+    """Event camera hot pixels, a fraction of the pixels of a sample is stuck at value in every frame"""
+
+    def __init__(self, fraction:float, value:float=1.0, seed:int=0):
+        super().__init__(seed)
+        self.fraction = fraction
+        self.value = value
+
+    def apply(self, x, seeds):
+        shape = (*x.shape[-2:],)
+        hot = (uniform(seeds, shape) < self.fraction).view(len(seeds), *([1] * (x.dim() - 3)), *shape)
+        return torch.where(hot, torch.full_like(x, self.value), x)
+
+
+class OcclusionNoise(Noise):
+    """
+    Spatial occlusion, num_boxes rectangles covering about area of the frame each are set to value,
+    at a random place per sample, same place in every frame
+    """
+
+    def __init__(self, area:float, num_boxes:int=1, value:float=0.0, seed:int=0):
+        super().__init__(seed)
+        self.area = area
+        self.num_boxes = num_boxes
+        self.value = value
+
+    def apply(self, x, seeds):
+        height, width = x.shape[-2:]
+        # [B, num_boxes, 3]: aspect ratio, x and y of the center
+        params = uniform(seeds, (self.num_boxes, 3))
+        aspect = torch.exp((params[..., 0] - 0.5) * math.log(4.0))
+        box_h = torch.sqrt(self.area * height * width / aspect).clamp(max=height)
+        box_w = (box_h * aspect).clamp(max=width)
+        cy, cx = params[..., 1] * height, params[..., 2] * width
+        rows = torch.arange(height).view(1, 1, height, 1)
+        cols = torch.arange(width).view(1, 1, 1, width)
+        inside = ((rows - cy[..., None, None]).abs() < box_h[..., None, None] / 2) & \
+                 ((cols - cx[..., None, None]).abs() < box_w[..., None, None] / 2)
+        mask = inside.any(dim=1).view(len(seeds), *([1] * (x.dim() - 3)), height, width)
+        return torch.where(mask, torch.full_like(x, self.value), x)
+
+
+class FrameDropNoise(Noise):
+    """
+    Temporal frame drops, every frame of a sequence is lost with probability rate
+    and replaced by zeros or by the last frame received (hold)
+    """
+
+    def __init__(self, rate:float, mode:str="zero", seed:int=0):
+        super().__init__(seed)
+        if mode not in ("zero", "hold"):
+            raise ValueError(f"unknown frame drop mode {mode}")
+        self.rate = rate
+        self.mode = mode
+
+    def apply(self, x, seeds):
+        if x.dim() != 5:
+            raise ValueError("frame drops need a batch of sequences [B, T, C, H, W]")
+        batch, steps = x.shape[:2]
+        dropped = uniform(seeds, (steps,)) < self.rate
+        if self.mode == "zero":
+            return x * (~dropped).view(batch, steps, 1, 1, 1)
+        # index of the last kept frame at every step (a dropped first frame stays zero)
+        kept_at = torch.where(dropped, -1, torch.arange(steps).expand(batch, steps))
+        source = torch.cummax(kept_at, dim=1).values
+        held = x.gather(1, source.clamp(min=0).view(batch, steps, 1, 1, 1).expand_as(x))
+        return held * (source >= 0).view(batch, steps, 1, 1, 1)
+
+
+class Compose(Noise):
+    """Applies several noises in order, each one with its own streams"""
+
+    def __init__(self, noises:Sequence[Noise]):
+        super().__init__(0)
+        self.noises = list(noises)
+
+    def apply(self, x, seeds):
+        for i, noise in enumerate(self.noises):
+            x = noise.apply(x, (seeds + noise.seed + 0x3C6EF372 * (i + 1)) & _MASK32)
+        return x
+
+
+# parameter of every noise for severities 1..5, used by build_noise and the evaluation sweeps
+SEVERITIES = {
+    "gaussian": (GaussianNoise, "sigma", [0.04, 0.08, 0.12, 0.18, 0.26]),
+    "salt_pepper": (SaltPepperNoise, "amount", [0.01, 0.02, 0.05, 0.1, 0.2]),
+    "shot": (ShotNoise, "photons", [60.0, 25.0, 12.0, 5.0, 3.0]),
+    "background_activity": (BackgroundActivityNoise, "rate", [0.001, 0.005, 0.01, 0.02, 0.05]),
+    "hot_pixel": (HotPixelNoise, "fraction", [0.0005, 0.001, 0.002, 0.005, 0.01]),
+    "occlusion": (OcclusionNoise, "area", [0.02, 0.05, 0.1, 0.2, 0.3]),
+    "frame_drop": (FrameDropNoise, "rate", [0.1, 0.2, 0.3, 0.5, 0.7]),
+}
+
+
+def build_noise(name:str, severity:int, seed:int=0, **kwargs) -> Noise:
+    """
+    Noise of the given type and severity (1 mildest .. 5 strongest)
+    :param name: one of SEVERITIES
+    :param severity: 1..5
+    :param seed: seed of the transform
+    :param kwargs: other arguments of the noise class (eg. mode for frame_drop)
+    """
+    if name not in SEVERITIES:
+        raise ValueError(f"unknown noise {name}, expected one of {list(SEVERITIES)}")
+    cls, param, levels = SEVERITIES[name]
+    if not 1 <= severity <= len(levels):
+        raise ValueError(f"severity must be in 1..{len(levels)}, got {severity}")
+    return cls(**{param: levels[severity - 1]}, seed=seed, **kwargs)
@@ -0,0 +1,88 @@
+import math
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+from torch.utils.data import Sampler
+
+
+def find_runs(timestamps:np.ndarray, max_time_diff:int=1000) -> np.ndarray:
+    """
+    Splits a sorted timestamp array into runs of frames where consecutive frames are at most max_time_diff apart
+    :param timestamps: int64 microseconds, sorted
+    :param max_time_diff: Maximum time difference (ms) between consecutive frames of a run
+
+    :return: run boundaries, run r is [bounds[r], bounds[r+1])
+    """
+    breaks = np.flatnonzero(np.diff(timestamps) > max_time_diff * 1000) + 1
+    return np.concatenate([[0], breaks, [len(timestamps)]]).astype(np.int64)
+
+
+def find_windows(timestamps:np.ndarray, seq_len:int, stride:int=1, min_seq_len:Optional[int]=None,
+                 max_time_diff:int=1000):
+    """
+    Sliding windows over the frames of a split, never crossing a gap larger than max_time_diff
+    Windows start every stride frames of a run, windows near the end of a run are shortened and kept
+    while they have at least min_seq_len frames (min_seq_len=seq_len keeps only full windows)
+    :param timestamps: int64 microseconds of every frame, sorted
+    :param seq_len: maximum frames per window
+    :param stride: frames between the start of two windows
+    :param min_seq_len: minimum frames per window, defaults to seq_len
+    :param max_time_diff: Maximum time difference (ms) between consecutive frames of a window
+
+    :return: (starts, lengths) int64 arrays, window i covers frames [starts[i], starts[i] + lengths[i])
+    """
+    min_seq_len = seq_len if min_seq_len is None else min_seq_len
+    if not 1 <= min_seq_len <= seq_len or stride < 1:
+        raise ValueError(f"invalid window, seq_len={seq_len} min_seq_len={min_seq_len} stride={stride}")
+    bounds = find_runs(timestamps, max_time_diff)
+    run_starts, run_ends = bounds[:-1], bounds[1:]
+    # windows of every run at once: run r gets counts[r] starts, stride apart from its first frame
+    counts = np.maximum(run_ends - run_starts - min_seq_len, -1) // stride + 1
+    window_run = np.repeat(np.arange(len(counts)), counts)
+    first_window = np.cumsum(counts) - counts
+    starts = run_starts[window_run] + stride * (np.arange(len(window_run)) - first_window[window_run])
+    lengths = np.minimum(seq_len, run_ends[window_run] - starts)
+    return starts.astype(np.int64), lengths.astype(np.int64)
+
+
+class LengthBucketBatchSampler(Sampler[List[int]]):
+    """
+    Batches samples of similar length together so variable-length sequences need little padding.
+    Samples are sorted by length (ties broken randomly), cut into batches and the batch order is shuffled,
+    so every epoch sees different batches while keeping the padding low.
+    """
+
+    def __init__(self, lengths:Sequence[int], batch_size:int, shuffle:bool=True, drop_last:bool=False, seed:int=0):
+        """
+        :param lengths: length of every sample, eg. TUMTraf.lengths
+        :param batch_size: samples per batch
+        :param shuffle: shuffle ties and batch order every epoch
+        :param drop_last: drop the last incomplete batch
+        :param seed: base seed, combined with the epoch (see set_epoch)
+        """
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch:int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[List[int]]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        tiebreak = rng.random(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        order = np.lexsort((tiebreak, self.lengths))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        if self.shuffle:
+            rng.shuffle(batches)
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return math.ceil(len(self.lengths) / self.batch_size)
@@ -0,0 +1,88 @@
+import time
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+from src.data.timestamps import parse_timestamps
+
+
+class StreamFrame(NamedTuple):
+    """A frame of a stream"""
+    path: Path
+    timestamp: int          # microseconds since the epoch, from the file name
+    frame: np.ndarray       # uint8 [C, H, W]
+    new_run: bool           # first frame after a gap larger than max_time_diff (or first of the stream)
+
+
+def decode_stream_frame(path:Path, roi:Optional[dict]=None, gray:bool=True) -> Optional[np.ndarray]:
+    """
+    Decodes a frame as scripts/preprocess.py writes it: cropped to the ROI (x, y, width, height, as load_eb_roi)
+    and converted to grayscale with the same cv2 calls, so the frames match the preprocessed ones
+    :param gray: one gray channel (EB), else the RGB channels
+
+    :return: uint8 [C, H, W], None when the file cannot be decoded (eg. still being written)
+    """
+    data = np.fromfile(path, dtype=np.uint8)
+    # a JPEG being written has no end of image marker yet, cv2 would decode the missing part as gray
+    if len(data) < 2 or data[-2] != 0xFF or data[-1] != 0xD9:
+        return None
+    img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    if roi is not None:
+        img = img[roi["y"]:roi["height"], roi["x"]:roi["width"]]
+    if gray:
+        gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if roi is None:
+            return gray_img[None]
+        # preprocess.py writes the crop as a JPEG again, the stream sees the same pixels as load_frame_array
+        _, encoded = cv2.imencode(".jpg", gray_img)
+        return cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED)[None]
+    return np.ascontiguousarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB).transpose(2, 0, 1))
+
+
+def stream_frames(directory:Path, roi:Optional[dict]=None, gray:bool=True, max_time_diff:int=1000,
+                  follow:bool=False, poll:float=0.05, idle_timeout:Optional[float]=None) -> Iterator[StreamFrame]:
+    """
+    Frames of a directory of timestamped JPEGs, one at a time, in the order group_frames uses (sorted names,
+    which is capture time order). The runs group_frames would cut at gaps larger than max_time_diff start with
+    new_run, where a stateful model should be reset, but no frame is dropped and nothing is grouped.
+    With follow the directory is watched for new frames until idle_timeout seconds pass without one (forever
+    when None), frames arriving with a name older than the last one yielded are skipped, as are frames that
+    cannot be decoded (the newest one is retried, it may still be being written).
+    :param directory: folder of frames named by capture time (see src/data/timestamps.py)
+    :param roi: ROI to crop the frames to, None to keep them whole
+    :param gray: decode to one gray channel, else RGB
+    :param max_time_diff: Maximum time difference (ms) between consecutive frames of a run
+    :param follow: keep watching the directory for new frames
+    :param poll: seconds between two listings of the directory when following
+    :param idle_timeout: seconds without a new frame after which following stops
+    """
+    directory = Path(directory)
+    last_name, last_ms = None, None
+    idle_since = time.monotonic()
+    while True:
+        names = sorted(path.name for path in directory.glob("*.jpg"))
+        if last_name is not None:
+            names = names[np.searchsorted(names, last_name, side="right"):]
+        # gaps are compared in whole milliseconds, as group_frames
+        timestamps = parse_timestamps([name[:-len(".jpg")] for name in names])
+        for name, timestamp in zip(names, timestamps):
+            frame = decode_stream_frame(directory / name, roi, gray)
+            if frame is None:
+                if follow and name == names[-1]:
+                    # probably still being written, retried at the next listing
+                    break
+                print(f"Cannot decode {directory / name}, skipping.")
+                last_name = name
+                continue
+            timestamp_ms = int(timestamp) // 1000
+            new_run = last_ms is None or timestamp_ms - last_ms > max_time_diff
+            last_name, last_ms = name, timestamp_ms
+            idle_since = time.monotonic()
+            yield StreamFrame(directory / name, int(timestamp), frame, new_run)
+        if not follow or (idle_timeout is not None and time.monotonic() - idle_since > idle_timeout):
+            return
+        time.sleep(poll)
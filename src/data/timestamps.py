@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# frames are named by capture time, eg. 20231114-084328.739529.jpg
+STEM_FORMAT = "%Y%m%d-%H%M%S.%f"
+STEM_LENGTH = len("20231114-084328.739529")
+_EPOCH = datetime(1970, 1, 1)
+# written by scripts/preprocess.py in the image folder of every split/camera
+TIMESTAMPS_NAME = "timestamps.npz"
+
+_US_PER_DAY = 86400 * 10**6
+# weights of the digits of a stem, per field
+_YEAR, _MONTH, _DAY = slice(0, 4), slice(4, 6), slice(6, 8)
+_HOUR, _MINUTE, _SECOND, _MICRO = slice(9, 11), slice(11, 13), slice(13, 15), slice(16, 22)
+
+
+def _digits(codes:np.ndarray, field:slice) -> np.ndarray:
+    digits = codes[:, field]
+    return digits @ (10 ** np.arange(digits.shape[1] - 1, -1, -1, dtype=np.int64))
+
+
+def _parse_strptime(stems:Sequence[str]) -> np.ndarray:
+    return np.asarray([(datetime.strptime(stem, STEM_FORMAT) - _EPOCH) // timedelta(microseconds=1) for stem in stems],
+                      dtype=np.int64)
+
+
+def parse_timestamps(stems:Sequence[str]) -> np.ndarray:
+    """
+    Capture time of every frame stem, all stems at once: the characters are read as a [N, 22] code matrix
+    and every field is a dot product with its digit weights, the date goes through datetime64.
+    Stems that are not exactly STEM_FORMAT with 6 fractional digits go through strptime (and its errors)
+    :param stems: file ids named with STEM_FORMAT
+
+    :return: int64 array of microseconds since the epoch (naive, no timezone applied)
+    """
+    stems = np.asarray(stems, dtype=str)
+    if len(stems) == 0:
+        return np.empty(0, dtype=np.int64)
+    if stems.dtype.itemsize != 4 * STEM_LENGTH:
+        return _parse_strptime(stems)
+    codes = np.ascontiguousarray(stems).view(np.uint32).reshape(-1, STEM_LENGTH).astype(np.int64)
+    separators = (codes[:, 8] == ord("-")) & (codes[:, 15] == ord("."))
+    codes -= ord("0")
+    digit_columns = np.r_[0:8, 9:15, 16:22]
+    if not (separators.all() and ((codes[:, digit_columns] >= 0) & (codes[:, digit_columns] <= 9)).all()):
+        return _parse_strptime(stems)
+
+    year, month, day = _digits(codes, _YEAR), _digits(codes, _MONTH), _digits(codes, _DAY)
+    hour, minute, second = _digits(codes, _HOUR), _digits(codes, _MINUTE), _digits(codes, _SECOND)
+    months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    days = months.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")
+    # out of range fields (eg. month 13, Feb 30) would silently roll over, strptime reports them
+    if not (((month >= 1) & (month <= 12) & (day >= 1) & (days.astype("datetime64[M]") == months)).all()
+            and (hour < 24).all() and (minute < 60).all() and (second <= 61).all()):
+        return _parse_strptime(stems)
+    return days.astype(np.int64) * _US_PER_DAY + ((hour * 60 + minute) * 60 + second) * 10**6 + _digits(codes, _MICRO)
+
+
+def timestamp_index(groups:Sequence[Tuple[str, List[str]]]) -> dict:
+    """
+    Timestamp index of a split/camera, shared by the dataset and the RGB/EB alignment
+    :param groups: (group id, frame stems) of every group, in timestamp order
+
+    :return: dict of file_ids, group_ids and timestamps (int64 microseconds), one entry per frame
+    """
+    file_ids = np.asarray([stem for _, frames in groups for stem in frames], dtype=str)
+    return {"file_ids": file_ids,
+            "group_ids": np.asarray([group_id for group_id, frames in groups for _ in frames], dtype=str),
+            "timestamps": parse_timestamps(file_ids)}
+
+
+def save_timestamps(path:Path, index:dict) -> None:
+    np.savez(path, **index)
+
+
+def load_timestamps(path:Path) -> dict:
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
@@ -0,0 +1,79 @@
+import json
+import zipfile
+from pathlib import Path
+from typing import Union
+
+import torch
+
+# export information of the optimized variants, see src/models/export.py
+EXPORT_INFO = "export.json"
+
+
+class TracedSequenceModel(torch.nn.Module):
+    """
+    A traced SNN: the time loop is unrolled for the sequence length of the tracing example, other lengths would
+    run the same number of steps and give wrong outputs, they are refused
+    """
+
+    def __init__(self, model:torch.nn.Module, time_dim:int, length:int):
+        """
+        :param model: the TorchScript module
+        :param time_dim: dimension of the inputs holding the time steps
+        :param length: time steps the model was traced with
+        """
+        super().__init__()
+        self.model = model
+        self.time_dim = time_dim
+        self.length = length
+
+    def forward(self, x:torch.Tensor):
+        if x.shape[self.time_dim] != self.length:
+            raise ValueError(f"the model was traced for sequences of {self.length} steps (dim {self.time_dim}), "
+                             f"got {x.shape[self.time_dim]}, export it again with calibration samples of that length")
+        return self.model(x)
+
+
+def is_torchscript(path:Union[str, Path]) -> bool:
+    """TorchScript archives are zip files with the serialized code next to the weights"""
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any(name.endswith("/constants.pkl") for name in archive.namelist())
+
+
+def load_model(path:Union[str, Path], map_location:Union[str, torch.device]="cpu") -> torch.nn.Module:
+    """
+    Loads a model ready for inference, whatever the way it was saved:
+    a TorchScript archive (torch.jit.save), a pickled module (torch.save(model)),
+    or a checkpoint dict holding the module under "model"
+    Optimized variants (see src/models/export.py) are loaded the same way, their export information selects the
+    quantized engine they were built for and compiles the "compile" ones, traced SNNs refuse the sequence lengths
+    they were not traced for.
+    Plain state_dicts cannot be loaded without the model class, save the whole module instead.
+
+    :param path: checkpoint file
+    :param map_location: device the weights are loaded on
+    :return: the model in eval mode
+    """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"checkpoint {path} not found")
+    export = {}
+    if is_torchscript(path):
+        extra_files = {EXPORT_INFO: ""}
+        model = torch.jit.load(str(path), map_location=map_location, _extra_files=extra_files)
+        export = json.loads(extra_files[EXPORT_INFO] or "{}")
+        if export.get("time_dim") is not None:
+            model = TracedSequenceModel(model, export["time_dim"], export["input_shape"][export["time_dim"]])
+    else:
+        obj = torch.load(path, map_location=map_location, weights_only=False)
+        model = obj.get("model") if isinstance(obj, dict) else obj
+        if not isinstance(model, torch.nn.Module):
+            raise ValueError(f"{path} holds no model (a state_dict?), save the module with torch.save(model, path)")
+        export = (obj.get("export") or {}) if isinstance(obj, dict) else {}
+    if export.get("quantization"):
+        torch.backends.quantized.engine = export["engine"]
+    model = model.eval()
+    if export.get("compile"):
+        model = torch.compile(model)
+    return model
@@ -0,0 +1,126 @@
+from typing import Dict, List
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class CenterNetHead(nn.Module):
+    """
+    CenterNet style dense head: per cell class heatmap logits, box size and sub-cell offset of the center
+    sizes are predicted in feature cells, decode_detections turns everything back into pixels
+    """
+
+    def __init__(self, in_channels:int, num_classes:int, hidden:int=64):
+        super().__init__()
+        self.num_classes = num_classes
+
+        def branch(out_channels):
+            return nn.Sequential(nn.Conv2d(in_channels, hidden, 3, padding=1), nn.ReLU(inplace=True),
+                                 nn.Conv2d(hidden, out_channels, 1))
+
+        self.heatmap = branch(num_classes)
+        self.size = branch(2)
+        self.offset = branch(2)
+        # start with a low foreground probability (0.1), as in CenterNet
+        nn.init.constant_(self.heatmap[-1].bias, -2.19)
+
+    def forward(self, features:torch.Tensor) -> Dict[str, torch.Tensor]:
+        """features [B, C, h, w] -> heatmap [B, K, h, w] (logits), size [B, 2, h, w], offset [B, 2, h, w]"""
+        return {"heatmap": self.heatmap(features), "size": self.size(features), "offset": self.offset(features)}
+
+
+@torch.no_grad()
+def decode_detections(heatmap:torch.Tensor, size:torch.Tensor, offset:torch.Tensor, stride:int,
+                      max_detections:int=100, threshold:float=0.1) -> List[Dict[str, torch.Tensor]]:
+    """
+    Peaks of the heatmap turned into boxes, batched over the whole heatmap (no loop per class or box)
+    :param heatmap: [B, K, h, w] logits
+    :param size: [B, 2, h, w] width and height in feature cells
+    :param offset: [B, 2, h, w] x and y offset of the center inside its cell
+    :param stride: pixels per feature cell
+    :param max_detections: detections kept per sample
+    :param threshold: minimum score
+
+    :return: one dict per sample with boxes [N, 4] (x_center, y_center, width, height) in pixels,
+        scores [N] and classes [N]
+    """
+    batch, num_classes, height, width = heatmap.shape
+    scores = torch.sigmoid(heatmap)
+    # a peak is its own 3x3 maximum
+    peaks = scores * (F.max_pool2d(scores, 3, stride=1, padding=1) == scores)
+    top_scores, top = peaks.flatten(1).topk(min(max_detections, num_classes * height * width), dim=1)
+    classes = top // (height * width)
+    cells = top % (height * width)
+    ys, xs = (cells // width).float(), (cells % width).float()
+    size = size.flatten(2).gather(2, cells.unsqueeze(1).expand(-1, 2, -1))
+    offset = offset.flatten(2).gather(2, cells.unsqueeze(1).expand(-1, 2, -1))
+    boxes = torch.stack([(xs + offset[:, 0]) * stride, (ys + offset[:, 1]) * stride,
+                         size[:, 0] * stride, size[:, 1] * stride], dim=2)
+    keep = top_scores >= threshold
+    return [{"boxes": boxes[i][keep[i]], "scores": top_scores[i][keep[i]], "classes": classes[i][keep[i]]}
+            for i in range(batch)]
+
+
+def encode_targets(boxes:torch.Tensor, classes:torch.Tensor, mask:torch.Tensor, num_classes:int,
+                   feature_shape, stride:int) -> Dict[str, torch.Tensor]:
+    """
+    Dense CenterNet targets of a batch of padded boxes (as collate_tumtraf), all boxes at once
+    :param boxes: [B, K, 4] (x_center, y_center, width, height) in pixels
+    :param classes: [B, K] class ids
+    :param mask: [B, K] valid boxes
+    :param num_classes: classes of the heatmap
+    :param feature_shape: (h, w) of the head output
+    :param stride: pixels per feature cell
+
+    :return: heatmap [B, num_classes, h, w] gaussian peaks at the centers, and for every valid box:
+        batch [N], cell [N] (flat index of its center cell), size [N, 2] and offset [N, 2] in cells
+    """
+    height, width = feature_shape
+    batch = boxes.shape[0]
+    batch_idx = torch.arange(batch).unsqueeze(1).expand_as(mask)[mask]
+    boxes, classes = boxes[mask].float() / stride, classes[mask]
+    centers = boxes[:, :2].clamp(min=0)
+    centers = torch.minimum(centers, torch.tensor([width - 1e-3, height - 1e-3]))
+    cells_xy = centers.floor().long()
+
+    # gaussian of every box over the whole grid, the max of the overlapping ones is kept
+    sigma = (boxes[:, 2:].clamp(min=1.0) / 6.0).view(-1, 2, 1)
+    xs = (torch.arange(width).view(1, 1, width) - cells_xy[:, :1, None]) ** 2 / (2 * sigma[:, :1] ** 2)
+    ys = (torch.arange(height).view(1, height, 1) - cells_xy[:, 1:, None]) ** 2 / (2 * sigma[:, 1:] ** 2)
+    gaussians = torch.exp(-(xs + ys)).view(len(boxes), height * width)
+    heatmap = torch.zeros(batch * num_classes, height * width)
+    if len(boxes):
+        rows = (batch_idx * num_classes + classes).view(-1, 1).expand_as(gaussians)
+        heatmap.scatter_reduce_(0, rows, gaussians, "amax")
+    return {"heatmap": heatmap.view(batch, num_classes, height, width),
+            "batch": batch_idx, "cell": cells_xy[:, 1] * width + cells_xy[:, 0],
+            "size": boxes[:, 2:], "offset": centers - cells_xy}
+
+
+def centernet_loss(outputs:Dict[str, torch.Tensor], targets:Dict[str, torch.Tensor],
+                   size_weight:float=0.1, offset_weight:float=1.0) -> Dict[str, torch.Tensor]:
+    """
+    Penalty reduced focal loss on the heatmap and L1 losses on size and offset at the box centers,
+    normalized by the number of boxes
+    :param outputs: CenterNetHead outputs
+    :param targets: encode_targets of the batch
+
+    :return: dict with the total loss and every term
+    """
+    logits = outputs["heatmap"]
+    target = targets["heatmap"].to(logits.device)
+    prob = torch.sigmoid(logits).clamp(1e-4, 1 - 1e-4)
+    positive = target.eq(1.0)
+    pos_loss = (torch.log(prob) * (1 - prob) ** 2)[positive].sum()
+    neg_loss = (torch.log(1 - prob) * prob ** 2 * (1 - target) ** 4)[~positive].sum()
+    num_boxes = max(len(targets["cell"]), 1)
+    heatmap_loss = -(pos_loss + neg_loss) / num_boxes
+
+    batch, cell = targets["batch"].to(logits.device), targets["cell"].to(logits.device)
+    size = outputs["size"].flatten(2)[batch, :, cell]
+    offset = outputs["offset"].flatten(2)[batch, :, cell]
+    size_loss = F.l1_loss(size, targets["size"].to(size.device), reduction="sum") / num_boxes
+    offset_loss = F.l1_loss(offset, targets["offset"].to(offset.device), reduction="sum") / num_boxes
+    return {"loss": heatmap_loss + size_weight * size_loss + offset_weight * offset_loss,
+            "heatmap": heatmap_loss.detach(), "size": size_loss.detach(), "offset": offset_loss.detach()}
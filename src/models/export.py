@@ -0,0 +1,137 @@
+import copy
+import json
+from pathlib import Path
+from typing import List, Sequence, Union
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import DeQuantStub, QuantStub, convert, fuse_modules, get_default_qconfig, prepare
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from src.models.checkpoint import EXPORT_INFO
+from src.models.snn import SpikingDetector
+
+# a variant is a quantization and/or a format joined by "+", eg. static+script
+QUANTIZATIONS = ["dynamic", "static"]
+FORMATS = ["script", "compile"]
+
+
+def parse_variant(variant:str):
+    """:return: (quantization or None, format or None), fp32 is neither"""
+    parts = [part for part in variant.split("+") if part and part != "fp32"]
+    quantization = [part for part in parts if part in QUANTIZATIONS]
+    formats = [part for part in parts if part in FORMATS]
+    if len(quantization) > 1 or len(formats) > 1 or len(quantization) + len(formats) != len(parts):
+        raise ValueError(f"invalid variant {variant}, expected fp32 or at most one of {QUANTIZATIONS} "
+                         f"and one of {FORMATS} joined by +")
+    return (quantization or [None])[0], (formats or [None])[0]
+
+
+class QuantizedBlock(nn.Module):
+    """Float in, float out, the wrapped modules run in int8 once converted (eager mode quantization)"""
+
+    def __init__(self, module:nn.Module):
+        super().__init__()
+        self.quant = QuantStub()
+        self.module = module
+        self.dequant = DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.module(self.quant(x)))
+
+
+def _prepare_snn(model:SpikingDetector) -> SpikingDetector:
+    """
+    Folds the batch norms into the convolutions and wraps every convolution (and the head branches, with their
+    ReLU fused) into a QuantizedBlock, the LIF neurons keep running in float on the dequantized currents
+    """
+    for block in model.blocks:
+        block.conv = QuantizedBlock(fuse_conv_bn_eval(block.conv, block.bn))
+        block.bn = nn.Identity()
+    for name in ("heatmap", "size", "offset"):
+        branch = fuse_modules(getattr(model.head, name), [["0", "1"]])
+        setattr(model.head, name, QuantizedBlock(branch))
+    return model
+
+
+@torch.inference_mode()
+def calibrate(model:nn.Module, batches:Sequence[torch.Tensor]) -> None:
+    for x in batches:
+        model(x)
+
+
+def quantize(model:nn.Module, quantization:str, calibration:Sequence[torch.Tensor], engine:str="x86") -> nn.Module:
+    """
+    int8 copy of a model
+    :param quantization: dynamic (Linear/recurrent weights in int8, activations quantized on the fly) or
+        static (convolutions in int8 with activation ranges observed on the calibration batches)
+    :param calibration: input batches as the model gets them (float, scaled as in the evaluation)
+    :param engine: quantized backend, one of torch.backends.quantized.supported_engines
+    """
+    torch.backends.quantized.engine = engine
+    model = copy.deepcopy(model).eval()
+    if quantization == "dynamic":
+        if not any(isinstance(module, (nn.Linear, nn.LSTM, nn.GRU)) for module in model.modules()):
+            raise ValueError(f"{type(model).__name__} has no Linear/LSTM/GRU layer to quantize dynamically")
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear, nn.LSTM, nn.GRU}, dtype=torch.qint8)
+    if quantization != "static":
+        raise ValueError(f"unknown quantization {quantization}, expected one of {QUANTIZATIONS}")
+    if isinstance(model, SpikingDetector):
+        # the time loop and the in place neurons cannot be traced by FX, the blocks are quantized one by one
+        if any(x.is_sparse for x in calibration):
+            raise ValueError("static quantization needs dense inputs")
+        model = _prepare_snn(model)
+        model.qconfig = get_default_qconfig(engine)
+        prepare(model, inplace=True)
+        calibrate(model, calibration)
+        return convert(model, inplace=True)
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), (calibration[0],))
+    calibrate(prepared, calibration)
+    return convert_fx(prepared)
+
+
+def export_model(model:nn.Module, variant:str, calibration:Sequence[torch.Tensor], path:Union[str, Path],
+                 engine:str="x86", source:str="") -> dict:
+    """
+    Writes an optimized variant of a model, loaded back as any checkpoint by load_model
+        script: traced TorchScript, frozen, the time loop of an SNN is unrolled for the calibration sequence length
+            (load_model refuses the other lengths)
+        compile: the module is saved as is and compiled with torch.compile when it is loaded
+    Static quantization needs the script format (the quantized modules cannot be pickled)
+    :param variant: see parse_variant
+    :param calibration: input batches, the first one is also the tracing example
+    :param path: artifact file
+    :param source: checkpoint the variant comes from, recorded in the export information
+
+    :return: the export information
+    """
+    quantization, fmt = parse_variant(variant)
+    if quantization == "static" and fmt != "script":
+        # the quantized convolutions of a module cannot be unpickled, TorchScript stores them
+        raise ValueError(f"static quantization is only saved as TorchScript, use static+script instead of {variant}")
+    # the time steps of an SNN, fixed by tracing
+    time_dim = (1 if model.batch_first else 0) if isinstance(model, SpikingDetector) and fmt == "script" else None
+    model = quantize(model, quantization, calibration, engine) if quantization else copy.deepcopy(model).eval()
+    info = {"variant": variant, "quantization": quantization, "format": fmt, "engine": engine, "source": source,
+            "compile": fmt == "compile", "input_shape": list(calibration[0].shape), "time_dim": time_dim}
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "script":
+        with torch.inference_mode(False), torch.no_grad():
+            traced = torch.jit.trace(model, (calibration[0],), strict=False, check_trace=False)
+        torch.jit.save(torch.jit.freeze(traced.eval()), str(path), _extra_files={EXPORT_INFO: json.dumps(info)})
+    else:
+        torch.save({"model": model, "export": info}, path)
+    return info
+
+
+def calibration_batches(samples:List[torch.Tensor], batch_size:int) -> List[torch.Tensor]:
+    """uint8 samples (frames [C, H, W] or sequences [T, C, H, W]) to float batches of samples of the same shape"""
+    by_shape = {}
+    for sample in samples:
+        sample = sample.to_dense() if sample.is_sparse else sample
+        by_shape.setdefault(tuple(sample.shape), []).append(sample)
+    return [torch.stack(same[i:i + batch_size]).float().div_(255.0)
+            for same in by_shape.values() for i in range(0, len(same), batch_size)]
@@ -0,0 +1,431 @@
+from typing import List, Optional, Sequence
+
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from src.models.detection import CenterNetHead
+
+
+class FastSigmoidSpike(torch.autograd.Function):
+    """Heaviside spike forward, fast sigmoid surrogate gradient backward (as snntorch's fast_sigmoid)"""
+
+    @staticmethod
+    def forward(ctx, x, slope):
+        ctx.save_for_backward(x)
+        ctx.slope = slope
+        return (x >= 0).to(x.dtype)
+
+    @staticmethod
+    def backward(ctx, grad):
+        x, = ctx.saved_tensors
+        return grad / (ctx.slope * x.abs() + 1.0) ** 2, None
+
+
+class LIF(nn.Module):
+    """
+    Leaky integrate-and-fire neurons, mem = beta * mem + input, spike when mem >= threshold, reset by subtraction.
+    The native backend: every neuron backend has the same step/scan interface, so models do not depend on it.
+    Without autograd (inference, or no_grad) the membrane and the spikes are updated in place,
+    no tensor is allocated per time step.
+    """
+
+    def __init__(self, beta:float=0.9, threshold:float=1.0, slope:float=25.0):
+        """
+        :param beta: membrane decay per step
+        :param threshold: firing threshold
+        :param slope: slope of the surrogate gradient
+        """
+        super().__init__()
+        self.beta = beta
+        self.threshold = threshold
+        self.slope = slope
+
+    def init_state(self, current:torch.Tensor) -> torch.Tensor:
+        """Membrane at rest, shaped as one step of input"""
+        return torch.zeros_like(current)
+
+    def step(self, current:torch.Tensor, mem:torch.Tensor):
+        """One time step, returns (spikes, mem), mem is updated in place without autograd"""
+        if not self._needs_grad(current, mem):
+            mem.mul_(self.beta).add_(current)
+            spikes = (mem >= self.threshold).to(mem.dtype)
+            mem.sub_(spikes, alpha=self.threshold)
+            return spikes, mem
+        mem = self.beta * mem + current
+        spikes = FastSigmoidSpike.apply(mem - self.threshold, self.slope)
+        # the reset is not differentiated through, as in snntorch
+        return spikes, mem - spikes.detach() * self.threshold
+
+    def scan(self, currents:torch.Tensor, mem:Optional[torch.Tensor]=None):
+        """
+        Runs the neurons over a time-major input
+        :param currents: [T, ...] input currents, overwritten by the spikes when autograd is off
+        :param mem: [...] initial membrane, None for rest, updated in place when autograd is off
+
+        :return: spikes [T, ...] and the final membrane
+        """
+        mem = self.init_state(currents[0]) if mem is None else mem
+        if not self._needs_grad(currents, mem):
+            return self._scan_inplace(currents, mem)
+        spikes = []
+        for t in range(len(currents)):
+            spike, mem = self.step(currents[t], mem)
+            spikes.append(spike)
+        return torch.stack(spikes), mem
+
+    def _scan_inplace(self, currents, mem):
+        # the currents buffer is reused for the spikes, step t is only read before it is written
+        fired = torch.empty_like(mem, dtype=torch.bool)
+        for t in range(len(currents)):
+            mem.mul_(self.beta).add_(currents[t])
+            torch.ge(mem, self.threshold, out=fired)
+            currents[t].copy_(fired)
+            mem.sub_(currents[t], alpha=self.threshold)
+        return currents, mem
+
+    def _scan_by_step(self, currents, mem):
+        # in place version for the backends that only have a step
+        for t in range(len(currents)):
+            spikes, mem = self.step(currents[t], mem)
+            currents[t].copy_(spikes)
+        return currents, mem
+
+    @staticmethod
+    def _needs_grad(*tensors):
+        return torch.is_grad_enabled() and any(t.requires_grad for t in tensors)
+
+    def extra_repr(self):
+        return f"beta={self.beta}, threshold={self.threshold}"
+
+
+def _without_neuron(state:dict) -> dict:
+    """Pickled state of a backend module without its third-party neuron, which is rebuilt when unpickled"""
+    state = dict(state)
+    state["_modules"] = {name: module for name, module in state["_modules"].items() if name != "neuron"}
+    return state
+
+
+class SnnTorchLIF(LIF):
+    """
+    LIF with snntorch's Leaky neuron (fast sigmoid surrogate, reset by subtraction),
+    snntorch subtracts the reset at the following step, so it is not decayed by beta
+    """
+
+    def __init__(self, beta:float=0.9, threshold:float=1.0, slope:float=25.0):
+        super().__init__(beta, threshold, slope)
+        self._build()
+
+    def _build(self):
+        import snntorch
+        from snntorch import surrogate
+        self.neuron = snntorch.Leaky(beta=self.beta, threshold=self.threshold,
+                                     spike_grad=surrogate.fast_sigmoid(self.slope), reset_mechanism="subtract")
+
+    # the surrogate of snntorch is a closure and cannot be pickled, the neuron is rebuilt from the hyperparameters
+    def __getstate__(self):
+        return _without_neuron(self.__dict__)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._build()
+
+    def step(self, current, mem):
+        return self.neuron(current, mem)
+
+    _scan_inplace = LIF._scan_by_step
+
+
+class NorseLIF(LIF):
+    """
+    LIF with norse's LIFBoxCell (SuperSpike surrogate, reset to zero), its time constant is set so that
+    the membrane follows the same mem = beta * mem + input update as the other backends
+    """
+
+    def __init__(self, beta:float=0.9, threshold:float=1.0, slope:float=25.0, dt:float=1e-3):
+        super().__init__(beta, threshold, slope)
+        self.dt = dt
+        # norse integrates v += dt * tau_mem_inv * (v_leak - v + i)
+        self.gain = 1.0 / (1.0 - beta)
+        self._build()
+
+    def _build(self):
+        from norse.torch import LIFBoxCell, LIFBoxParameters, LIFBoxFeedForwardState
+        self._state_cls = LIFBoxFeedForwardState
+        params = LIFBoxParameters(tau_mem_inv=torch.tensor((1.0 - self.beta) / self.dt),
+                                  v_th=torch.tensor(self.threshold), alpha=torch.tensor(self.slope))
+        self.neuron = LIFBoxCell(p=params, dt=self.dt)
+
+    # the parameters of norse cannot be pickled, the cell is rebuilt from the hyperparameters
+    def __getstate__(self):
+        state = _without_neuron(self.__dict__)
+        state.pop("_state_cls", None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._build()
+
+    def step(self, current, mem):
+        spikes, state = self.neuron(current * self.gain, self._state_cls(v=mem))
+        return spikes, state.v
+
+    _scan_inplace = LIF._scan_by_step
+
+
+NEURONS = {
+    "native": LIF,
+    "snntorch": SnnTorchLIF,
+    "norse": NorseLIF,
+}
+
+
+def make_neuron(backend:str="native", **params) -> LIF:
+    """LIF neurons of one of NEURONS, params are beta, threshold and slope"""
+    if backend not in NEURONS:
+        raise ValueError(f"unknown neuron backend {backend}, expected one of {list(NEURONS)}")
+    # beta >= 1 never decays (and breaks the time constant of norse), checked here for every backend
+    beta = params.get("beta", 0.9)
+    if not 0.0 <= beta < 1.0:
+        raise ValueError(f"beta must be in [0, 1), got {beta}")
+    return NEURONS[backend](**params)
+
+
+def sparse_conv2d(x:torch.Tensor, weight:torch.Tensor, stride:int=1, padding:int=0) -> torch.Tensor:
+    """
+    Event-driven convolution of a sparse COO input: every event adds its weighted kernel to the outputs
+    it reaches (index_add), so the cost follows the number of events and the input is never densified
+    :param x: sparse [N, C, H, W]
+    :param weight: [O, C, kh, kw]
+    :param stride: stride of the convolution
+    :param padding: zero padding of the convolution
+
+    :return: dense [N, O, H', W'], the same as F.conv2d(x.to_dense(), weight, stride=stride, padding=padding)
+    """
+    n, _, height, width = x.shape
+    out_channels, _, kh, kw = weight.shape
+    out_h = (height + 2 * padding - kh) // stride + 1
+    out_w = (width + 2 * padding - kw) // stride + 1
+    indices, values = x._indices(), x._values().to(weight.dtype)
+    sample, channel, ys, xs = indices[0], indices[1], indices[2] + padding, indices[3] + padding
+    # accumulated straight in the NCHW layout, every (event, output channel) pair is one flat index
+    out = weight.new_zeros(n * out_channels * out_h * out_w)
+    channel_stride = torch.arange(out_channels, device=weight.device) * (out_h * out_w)
+    for ky in range(kh):
+        for kx in range(kw):
+            # the event at (y, x) is seen by kernel tap (ky, kx) of output ((y - ky) / stride, (x - kx) / stride)
+            oy, ox = ys - ky, xs - kx
+            valid = (oy >= 0) & (ox >= 0) & (oy % stride == 0) & (ox % stride == 0)
+            oy, ox = oy // stride, ox // stride
+            valid &= (oy < out_h) & (ox < out_w)
+            if not bool(valid.any()):
+                continue
+            cells = sample[valid] * (out_channels * out_h * out_w) + oy[valid] * out_w + ox[valid]
+            taps = weight[:, :, ky, kx].t()[channel[valid]]
+            out.index_add_(0, (cells.unsqueeze(1) + channel_stride).flatten(),
+                           (taps * values[valid].unsqueeze(1)).flatten())
+    return out.view(n, out_channels, out_h, out_w)
+
+
+def _fold_time(x:torch.Tensor) -> torch.Tensor:
+    """Sparse [T, B, C, H, W] to sparse [T * B, C, H, W]"""
+    t, b = x.shape[:2]
+    indices = x._indices()
+    indices = torch.cat([(indices[0] * b + indices[1]).unsqueeze(0), indices[2:]])
+    return torch.sparse_coo_tensor(indices, x._values(), (t * b, *x.shape[2:]), check_invariants=False)
+
+
+def _swap_sparse_time(x:torch.Tensor) -> torch.Tensor:
+    """Sparse [B, T, ...] to sparse [T, B, ...] (sparse transpose is not allowed on inference tensors)"""
+    indices = x._indices()[[1, 0, *range(2, x.dim())]]
+    return torch.sparse_coo_tensor(indices, x._values(), (x.shape[1], x.shape[0], *x.shape[2:]), check_invariants=False)
+
+
+def _unbind_sparse(x:torch.Tensor) -> List[torch.Tensor]:
+    """Sparse [T, ...] to a list of T sparse [...], with a single sort of the events"""
+    indices, values = x._indices(), x._values()
+    order = torch.argsort(indices[0], stable=True)
+    indices, values = indices[:, order], values[order]
+    bounds = torch.searchsorted(indices[0], torch.arange(x.shape[0] + 1)).tolist()
+    return [torch.sparse_coo_tensor(indices[1:, bounds[t]:bounds[t + 1]], values[bounds[t]:bounds[t + 1]],
+                                    x.shape[1:], check_invariants=False) for t in range(x.shape[0])]
+
+
+class SpikingConv(nn.Module):
+    """Convolution, batch norm and LIF neurons"""
+
+    def __init__(self, in_channels:int, out_channels:int, stride:int, neuron:LIF):
+        super().__init__()
+        self.conv = nn.Conv2d(in_channels, out_channels, 3, stride=stride, padding=1, bias=False)
+        self.bn = nn.BatchNorm2d(out_channels)
+        self.neuron = neuron
+
+    def _conv(self, x):
+        if x.is_sparse:
+            return sparse_conv2d(x, self.conv.weight, self.conv.stride[0], self.conv.padding[0])
+        return self.conv(x)
+
+    def forward(self, x:torch.Tensor, mem:Optional[torch.Tensor]=None):
+        """
+        Whole sequence: the convolution has no state, so it runs once on the T * B frames,
+        only the neurons are stepped over time
+        :param x: [T, B, C, H, W] spikes, dense or sparse COO (event-driven convolution)
+        :return: spikes [T, B, C', H', W'] and the final membrane
+        """
+        currents = self.bn(self._conv(_fold_time(x) if x.is_sparse else x.flatten(0, 1))).unflatten(0, x.shape[:2])
+        return self.neuron.scan(currents, mem)
+
+    def step(self, x:torch.Tensor, mem:Optional[torch.Tensor]=None):
+        """Fused single time step, x [B, C, H, W] dense or sparse, returns (spikes, mem)"""
+        currents = self.bn(self._conv(x))
+        return self.neuron.step(currents, self.neuron.init_state(currents) if mem is None else mem)
+
+
+class SpikingDetector(nn.Module):
+    """
+    Convolutional SNN detector for event frames, simulated time-major over [T, B, C, H, W].
+    A stack of SpikingConv blocks (each halves the resolution) is followed by a CenterNet head
+    on the firing rate of the last block (see src/models/detection.py).
+    With fused=True every time step goes through all the blocks before the next one, which keeps
+    a single step of activations in memory instead of the whole sequence (and is what streaming needs).
+    With checkpoint=True the activations inside every block (the per step membranes) are not kept for backward
+    but recomputed, trading compute for memory on long sequences; batch norm statistics are then updated
+    twice per training step.
+    """
+
+    def __init__(self, in_channels:int=1, num_classes:int=6, channels:Sequence[int]=(16, 32, 64, 128),
+                 beta:float=0.9, threshold:float=1.0, slope:float=25.0, backend:str="native",
+                 batch_first:bool=False, fused:bool=False, checkpoint:bool=False):
+        """
+        :param in_channels: channels of the input frames/spikes
+        :param num_classes: classes of the heatmap
+        :param channels: channels of every spiking block
+        :param beta: membrane decay of the neurons
+        :param threshold: firing threshold of the neurons
+        :param slope: slope of the surrogate gradient
+        :param backend: neuron implementation, one of NEURONS
+        :param batch_first: inputs are [B, T, C, H, W] (as collate_tumtraf) instead of [T, B, C, H, W]
+        :param fused: run the blocks step by step instead of folding time into the batch
+        :param checkpoint: recompute the activations of every block during backward instead of storing them
+        """
+        super().__init__()
+        self.backend = backend
+        self.batch_first = batch_first
+        self.fused = fused
+        self.checkpoint = checkpoint
+        self.stride = 2 ** len(channels)
+        blocks = []
+        for c_in, c_out in zip([in_channels, *channels[:-1]], channels):
+            blocks.append(SpikingConv(c_in, c_out, 2, make_neuron(backend, beta=beta, threshold=threshold, slope=slope)))
+        self.blocks = nn.ModuleList(blocks)
+        self.head = CenterNetHead(channels[-1], num_classes)
+
+    def forward(self, x:torch.Tensor, state:Optional[List[torch.Tensor]]=None, return_state:bool=False):
+        """
+        :param x: [T, B, C, H, W] frames or spikes ([B, T, ...] with batch_first), dense or sparse COO,
+            sparse inputs are consumed event by event by the first block
+        :param state: membranes of every block from a previous call, None starts at rest, left unchanged
+            (the neurons update their membranes in place, they step on copies)
+        :param return_state: also return the final membranes, to continue the sequence later
+
+        :return: dict of heatmap/size/offset (see CenterNetHead), and the state with return_state
+        """
+        if self.batch_first:
+            x = _swap_sparse_time(x) if x.is_sparse else x.transpose(0, 1)
+        state = [None if mem is None else mem.clone() for mem in state] if state is not None else [None] * len(self.blocks)
+        use_checkpoint = self.checkpoint and torch.is_grad_enabled()
+        if self.fused:
+            rate = None
+            steps = _unbind_sparse(x) if x.is_sparse else x
+            for t in range(len(x)):
+                spikes = steps[t]
+                for i, block in enumerate(self.blocks):
+                    if use_checkpoint:
+                        spikes, state[i] = checkpoint(block.step, spikes, state[i], use_reentrant=False)
+                    else:
+                        spikes, state[i] = block.step(spikes, state[i])
+                rate = spikes if rate is None else rate + spikes
+            rate = rate / len(x)
+        else:
+            spikes = x
+            for i, block in enumerate(self.blocks):
+                if use_checkpoint:
+                    spikes, state[i] = checkpoint(block, spikes, state[i], use_reentrant=False)
+                else:
+                    spikes, state[i] = block(spikes, state[i])
+            rate = spikes.mean(dim=0)
+        outputs = self.head(rate)
+        return (outputs, state) if return_state else outputs
+
+    def stream(self, window:int=8) -> "SpikingStream":
+        """Streaming inference on one stream of frames, see SpikingStream"""
+        return SpikingStream(self, window)
+
+
+class SpikingStream:
+    """
+    Streaming inference of a SpikingDetector over an unbounded stream of frames, one time step per call:
+    every frame goes through all the blocks (as fused=True) and the membranes are carried to the next one,
+    the head sees the firing rate of the last block over the last window steps (a running sum and a ring buffer
+    of the last window spikes), so the cost of a step does not depend on the window nor on the stream length.
+    Over the first window frames of a stream from rest it gives the same outputs as the model on the whole window.
+    Several streams share the model, each one with its own SpikingStream.
+    """
+
+    def __init__(self, model:SpikingDetector, window:int=8):
+        """
+        :param model: the detector, in eval mode
+        :param window: time steps of the firing rate the head sees, the group length the model was trained on
+        """
+        if window < 1:
+            raise ValueError(f"window must be at least 1, got {window}")
+        self.model = model
+        self.window = window
+        self.reset()
+
+    def reset(self) -> None:
+        """Back to rest: membranes, spike history and step count are cleared"""
+        self.membranes: List[Optional[torch.Tensor]] = [None] * len(self.model.blocks)
+        self.spikes: Optional[torch.Tensor] = None   # [window, B, C, h, w] ring buffer of the last block spikes
+        self.total: Optional[torch.Tensor] = None    # sum of the ring buffer
+        self.steps = 0
+
+    @torch.inference_mode()
+    def step(self, frame:torch.Tensor):
+        """
+        :param frame: [B, C, H, W] (or [C, H, W]) frame of every stream in lockstep, dense or sparse COO,
+            uint8 frames are scaled to [0, 1] as in the evaluation
+
+        :return: dict of heatmap/size/offset for the firing rate of the last window steps
+        """
+        if frame.dim() == 3:
+            frame = frame.unsqueeze(0)
+        if frame.dtype == torch.uint8:
+            frame = frame.float().div_(255.0)
+        spikes = frame
+        for i, block in enumerate(self.model.blocks):
+            spikes, self.membranes[i] = block.step(spikes, self.membranes[i])
+        slot = self.steps % self.window
+        if self.spikes is None:
+            self.spikes = spikes.new_zeros((self.window, *spikes.shape))
+            self.total = torch.zeros_like(spikes)
+        # the spikes are 0/1, the running sum stays exact
+        self.total.sub_(self.spikes[slot]).add_(spikes)
+        self.spikes[slot].copy_(spikes)
+        self.steps += 1
+        return self.model.head(self.total / min(self.steps, self.window))
+
+    def state_dict(self) -> dict:
+        """Copy of the stream state, load_state_dict resumes the stream from it (eg. in another process)"""
+        clone = lambda tensor: None if tensor is None else tensor.clone()
+        return {"window": self.window, "steps": self.steps, "membranes": [clone(mem) for mem in self.membranes],
+                "spikes": clone(self.spikes), "total": clone(self.total)}
+
+    def load_state_dict(self, state:dict) -> None:
+        if state["window"] != self.window or len(state["membranes"]) != len(self.model.blocks):
+            raise ValueError(f"state of a stream with window {state['window']} and {len(state['membranes'])} blocks, "
+                             f"this one has window {self.window} and {len(self.model.blocks)} blocks")
+        clone = lambda tensor: None if tensor is None else tensor.clone()
+        self.steps = state["steps"]
+        self.membranes = [clone(mem) for mem in state["membranes"]]
+        self.spikes, self.total = clone(state["spikes"]), clone(state["total"])
@@ -0,0 +1,134 @@
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+
+
+def shannon_entropy(counts:np.ndarray) -> np.ndarray:
+    """
+    Shannon entropy in bits of histograms along the last axis, 0 for empty histograms
+    :param counts: [..., bins] counts
+
+    :return: float64 [...]
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    totals = counts.sum(axis=-1, keepdims=True)
+    p = counts / np.maximum(totals, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.where(p > 0, p * np.log2(p), 0.0)
+    return -terms.sum(axis=-1)
+
+
+def to_gray(frames) -> np.ndarray:
+    """
+    uint8 frames [N, C, H, W] (or one frame [C, H, W]) to gray levels [N, H, W], RGB with the BT.601 weights
+    and 15 bit fixed point rounding of cv2.cvtColor (bit exact), single channel frames as they are
+    """
+    if isinstance(frames, torch.Tensor):
+        frames = (frames.to_dense() if frames.is_sparse else frames).numpy()
+    frames = np.asarray(frames)
+    if frames.ndim == 3:
+        frames = frames[None]
+    if frames.shape[1] == 1:
+        return frames[:, 0]
+    r, g, b = (frames[:, c].astype(np.uint32) for c in range(3))
+    return ((r * 9798 + g * 19235 + b * 3735 + 16384) >> 15).astype(np.uint8)
+
+
+def _shift(bins:int) -> int:
+    # gray levels are binned by dropping low bits, so bins must be a power of two
+    if bins < 1 or bins > 256 or bins & (bins - 1):
+        raise ValueError(f"bins must be a power of two between 1 and 256, got {bins}")
+    return 8 - (bins.bit_length() - 1)
+
+
+class EntropyAccumulator:
+    """
+    Streaming histograms of the gray levels of a split, updated chunk by chunk and merged across workers,
+    nothing but the histograms is kept:
+        per tile: histogram of every tile x tile region over all the frames (spatial and temporal distribution)
+        per pixel: coarser histogram of every pixel over all the frames (how unpredictable the pixel is)
+        per mask: histogram of the pixels of every mask (see src/data/masks.py)
+        events: frames where every pixel is non-zero (event density of the EB frames)
+    """
+
+    def __init__(self, height:int, width:int, tile:int=32, bins:int=256, pixel_bins:int=16,
+                 masks:Optional[Dict[str, np.ndarray]]=None):
+        """
+        :param height: frame height
+        :param width: frame width
+        :param tile: side of the square tiles, the last row/column of tiles is cut by the frame
+        :param bins: bins of the tile and mask histograms
+        :param pixel_bins: bins of the per pixel histograms
+        :param masks: bool [H, W] masks by name
+        """
+        self.height, self.width, self.tile = height, width, tile
+        self.bins, self.pixel_bins = bins, pixel_bins
+        self._tile_shift, self._pixel_shift = _shift(bins), _shift(pixel_bins)
+        self.grid = (-(-height // tile), -(-width // tile))
+        tile_ids = (np.arange(height) // tile)[:, None] * self.grid[1] + (np.arange(width) // tile)[None, :]
+        # offset of the histogram of every pixel in the flat tile counts
+        self._tile_offsets = (tile_ids * bins).ravel()
+        self.masks = {name: np.asarray(mask, dtype=bool) for name, mask in (masks or {}).items()}
+        for name, mask in self.masks.items():
+            if mask.shape != (height, width):
+                raise ValueError(f"mask {name} is {mask.shape}, frames are {(height, width)}")
+        self._mask_pixels = {name: np.flatnonzero(mask) for name, mask in self.masks.items()}
+
+        self.tile_counts = np.zeros(self.grid[0] * self.grid[1] * bins, dtype=np.int64)
+        # [pixel_bins, H * W], a pixel is counted once per frame so int32 is enough (and halves the memory)
+        self.pixel_counts = np.zeros((pixel_bins, height * width), dtype=np.int32)
+        self.mask_counts = {name: np.zeros(bins, dtype=np.int64) for name in self.masks}
+        self.events = np.zeros(height * width, dtype=np.int64)
+        self.frames = 0
+
+    def update(self, frames) -> None:
+        """
+        :param frames: uint8 [N, C, H, W] or [C, H, W], numpy or torch (sparse COO frames are densified)
+        """
+        gray = to_gray(frames).reshape(-1, self.height * self.width)
+        tile_bins = gray >> self._tile_shift
+        self.tile_counts += np.bincount((tile_bins + self._tile_offsets).ravel(), minlength=len(self.tile_counts))
+        # one pass per bin, a bincount over H * W * pixel_bins counts would allocate all of them every update
+        pixel_bins = gray >> self._pixel_shift
+        for b in range(self.pixel_bins):
+            self.pixel_counts[b] += (pixel_bins == b).sum(axis=0, dtype=np.int32)
+        for name, pixels in self._mask_pixels.items():
+            self.mask_counts[name] += np.bincount(tile_bins[:, pixels].ravel(), minlength=self.bins)
+        self.events += (gray > 0).sum(axis=0)
+        self.frames += len(gray)
+
+    def merge(self, other:"EntropyAccumulator") -> "EntropyAccumulator":
+        """Adds the histograms of an accumulator with the same configuration"""
+        if (other.height, other.width, other.tile, other.bins, other.pixel_bins) != \
+                (self.height, self.width, self.tile, self.bins, self.pixel_bins) or set(other.masks) != set(self.masks):
+            raise ValueError("cannot merge accumulators with different configurations")
+        self.tile_counts += other.tile_counts
+        self.pixel_counts += other.pixel_counts
+        for name in self.mask_counts:
+            self.mask_counts[name] += other.mask_counts[name]
+        self.events += other.events
+        self.frames += other.frames
+        return self
+
+    def result(self) -> dict:
+        """
+        :return: dict of heatmaps and per mask statistics
+            tile_entropy, tile_density [grid_h, grid_w]: entropy (bits) and event density of every tile
+            pixel_entropy, event_density [H, W]: entropy (bits, pixel_bins) and event density of every pixel
+            masks: per mask pooled entropy of its pixels, information (summed pixel entropy, bits per frame)
+                and event density
+        """
+        pixel_entropy = shannon_entropy(self.pixel_counts.T.reshape(self.height, self.width, self.pixel_bins))
+        event_density = self.events.reshape(self.height, self.width) / max(self.frames, 1)
+        tile_counts = self.tile_counts.reshape(*self.grid, self.bins)
+        # mean event density of the pixels of every tile
+        row_starts, col_starts = np.arange(0, self.height, self.tile), np.arange(0, self.width, self.tile)
+        tile_sums = np.add.reduceat(np.add.reduceat(event_density, row_starts, axis=0), col_starts, axis=1)
+        tile_areas = np.outer(np.diff(np.append(row_starts, self.height)), np.diff(np.append(col_starts, self.width)))
+        masks = {name: {"pixels": int(mask.sum()), "entropy": float(shannon_entropy(self.mask_counts[name])),
+                        "information": float(pixel_entropy[mask].sum()),
+                        "event_density": float(event_density[mask].mean()) if mask.any() else 0.0}
+                 for name, mask in self.masks.items()}
+        return {"frames": self.frames, "tile_entropy": shannon_entropy(tile_counts), "tile_density": tile_sums / tile_areas,
+                "pixel_entropy": pixel_entropy, "event_density": event_density, "masks": masks}
@@ -0,0 +1,232 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+# COCO: mAP@[.5:.95] averages 10 IoU thresholds, every AP is sampled at 101 recall points
+# built with np.linspace as in pycocotools, torch.linspace rounds some of them (eg. 0.8, recall 0.7) the other way
+COCO_IOU_THRESHOLDS = torch.from_numpy(np.linspace(0.5, 0.95, 10))
+RECALL_POINTS = torch.from_numpy(np.linspace(0.0, 1.0, 101))
+
+
+def to_xyxy(boxes:torch.Tensor) -> torch.Tensor:
+    """(x_center, y_center, width, height) -> (x_min, y_min, x_max, y_max), any leading dimensions"""
+    centers, half = boxes[..., :2], boxes[..., 2:] / 2
+    return torch.cat([centers - half, centers + half], dim=-1)
+
+
+def box_iou(boxes1:torch.Tensor, boxes2:torch.Tensor) -> torch.Tensor:
+    """
+    IoU of every pair of boxes, batched over the leading dimensions
+    :param boxes1: [..., N, 4] (x_center, y_center, width, height), as the labels and decode_detections
+    :param boxes2: [..., M, 4] same format
+
+    :return: [..., N, M]
+    """
+    a, b = to_xyxy(boxes1.double()), to_xyxy(boxes2.double())
+    top_left = torch.maximum(a[..., :, None, :2], b[..., None, :, :2])
+    bottom_right = torch.minimum(a[..., :, None, 2:], b[..., None, :, 2:])
+    inter = (bottom_right - top_left).clamp(min=0).prod(dim=-1)
+    area_a = (a[..., 2:] - a[..., :2]).clamp(min=0).prod(dim=-1)
+    area_b = (b[..., 2:] - b[..., :2]).clamp(min=0).prod(dim=-1)
+    union = area_a[..., :, None] + area_b[..., None, :] - inter
+    return inter / union.clamp(min=1e-12)
+
+
+def match_greedy(iou:torch.Tensor, thresholds:torch.Tensor) -> torch.Tensor:
+    """
+    COCO matching: detections in score order take the best still free ground truth with IoU >= threshold
+    Runs for every image and threshold at once, the only loop is over the detection ranks that can match
+    :param iou: [B, D, G] detections sorted by decreasing score in every image, -1 for pairs that cannot match
+        (padding, different classes)
+    :param thresholds: [T] IoU thresholds
+
+    :return: [T, B, D] matched ground truth index, -1 for false positives
+    """
+    batch, num_dets, num_gt = iou.shape
+    thresholds = thresholds.to(iou.device).view(-1, 1, 1)
+    taken = torch.zeros((len(thresholds), batch, num_gt), dtype=torch.bool, device=iou.device)
+    matches = torch.full((len(thresholds), batch, num_dets), -1, dtype=torch.int64, device=iou.device)
+    if num_gt == 0:
+        return matches
+    # ranks where no detection of the batch reaches the lowest threshold cannot match anything
+    for d in (iou >= thresholds.min()).any(dim=2).any(dim=0).nonzero().flatten().tolist():
+        candidates = iou[:, d].unsqueeze(0).masked_fill(taken, -1.0)
+        candidates = candidates.masked_fill(candidates < thresholds, -1.0)
+        best_iou, best = candidates.max(dim=2)
+        hit = best_iou >= 0
+        matches[:, :, d] = torch.where(hit, best, -1)
+        taken |= torch.nn.functional.one_hot(best, num_gt).bool() & hit.unsqueeze(2)
+    return matches
+
+
+def match_hungarian(iou:torch.Tensor, thresholds:torch.Tensor) -> torch.Tensor:
+    """
+    Optimal one to one matching (maximum total IoU among the pairs above the threshold), needs scipy
+    Same inputs and output as match_greedy, but scores play no role in who gets matched
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    batch, num_dets, num_gt = iou.shape
+    matches = torch.full((len(thresholds), batch, num_dets), -1, dtype=torch.int64)
+    if num_gt == 0 or num_dets == 0:
+        return matches
+    iou_np = iou.detach().cpu().double().numpy()
+    for t, threshold in enumerate(thresholds.tolist()):
+        valid = iou_np >= threshold
+        # pairs below the threshold cost more than leaving both unmatched
+        cost = -iou_np * valid
+        for b in range(batch):
+            rows, cols = linear_sum_assignment(cost[b])
+            keep = valid[b, rows, cols]
+            matches[t, b, torch.from_numpy(rows[keep])] = torch.from_numpy(cols[keep])
+    return matches.to(iou.device)
+
+
+MATCHERS = {"greedy": match_greedy, "hungarian": match_hungarian}
+
+
+def precision_recall(true_positives:torch.Tensor, num_gt:int):
+    """
+    Precision/recall curve of detections sorted by decreasing score
+    :param true_positives: [T, N] bool, whether every detection is matched at every IoU threshold
+    :param num_gt: ground truth boxes of the class
+
+    :return: precision [T, N], recall [T, N]
+    """
+    tp = true_positives.cumsum(dim=1, dtype=torch.float64)
+    fp = (~true_positives).cumsum(dim=1, dtype=torch.float64)
+    return tp / (tp + fp).clamp(min=1), tp / max(num_gt, 1)
+
+
+def average_precision(precision:torch.Tensor, recall:torch.Tensor, recall_points:torch.Tensor=RECALL_POINTS) -> torch.Tensor:
+    """
+    COCO interpolated AP: the precision envelope (best precision at any higher recall) averaged at recall_points
+    :param precision: [T, N] from precision_recall
+    :param recall: [T, N] from precision_recall
+
+    :return: [T]
+    """
+    if precision.shape[1] == 0:
+        return torch.zeros(precision.shape[0], dtype=torch.float64)
+    envelope = precision.flip(1).cummax(dim=1).values.flip(1)
+    recall_points = recall_points.to(recall.dtype).expand(recall.shape[0], -1).contiguous()
+    idx = torch.searchsorted(recall.contiguous(), recall_points)
+    sampled = torch.where(idx < recall.shape[1], envelope.gather(1, idx.clamp(max=recall.shape[1] - 1)), 0.0)
+    return sampled.mean(dim=1)
+
+
+def _pad(tensors:List[torch.Tensor], shape, value) -> torch.Tensor:
+    """Stacks tensors of different first dimension, padding with value"""
+    length = max((len(t) for t in tensors), default=0)
+    out = torch.full((len(tensors), length, *shape), value, dtype=tensors[0].dtype if tensors else torch.float32)
+    for i, t in enumerate(tensors):
+        out[i, :len(t)] = t
+    return out
+
+
+class DetectionAccumulator:
+    """
+    Streaming COCO-style detection metrics: every update matches a batch of images and only keeps, per detection,
+    its score, class and whether it is a true positive at every IoU threshold (no boxes, no images).
+    compute() gives mAP@[.5:.95], AP50, AP75, per class AP and recall over everything seen so far.
+    """
+
+    def __init__(self, num_classes:int, iou_thresholds:Optional[Sequence[float]]=None, max_detections:int=100,
+                 matching:str="greedy"):
+        """
+        :param num_classes: classes of the predictions and targets
+        :param iou_thresholds: defaults to COCO's 0.5:0.05:0.95
+        :param max_detections: highest scored detections kept per image
+        :param matching: greedy (COCO) or hungarian (needs scipy)
+        """
+        if matching not in MATCHERS:
+            raise ValueError(f"unknown matching {matching}, expected one of {list(MATCHERS)}")
+        self.num_classes = num_classes
+        self.iou_thresholds = torch.as_tensor(iou_thresholds, dtype=torch.float64) if iou_thresholds is not None \
+            else COCO_IOU_THRESHOLDS.clone()
+        self.max_detections = max_detections
+        self.matcher = MATCHERS[matching]
+        self.reset()
+
+    def reset(self) -> None:
+        self._scores: List[torch.Tensor] = []
+        self._classes: List[torch.Tensor] = []
+        self._true_positives: List[torch.Tensor] = []
+        self.num_gt = torch.zeros(self.num_classes, dtype=torch.int64)
+        self.num_images = 0
+
+    def update(self, predictions:List[Dict[str, torch.Tensor]], targets:List[Dict[str, torch.Tensor]]) -> None:
+        """
+        :param predictions: one dict per image with boxes [N, 4], scores [N], classes [N] (decode_detections)
+        :param targets: one dict per image with boxes [G, 4], classes [G] (the dataset labels)
+        """
+        if len(predictions) != len(targets):
+            raise ValueError(f"{len(predictions)} predictions for {len(targets)} targets")
+        if not predictions:
+            return
+        scores, boxes, classes = [], [], []
+        for prediction in predictions:
+            order = torch.argsort(prediction["scores"].detach().float().cpu(), descending=True, stable=True)
+            order = order[:self.max_detections]
+            scores.append(prediction["scores"].detach().float().cpu()[order])
+            boxes.append(prediction["boxes"].detach().float().cpu()[order])
+            classes.append(prediction["classes"].detach().long().cpu()[order])
+        pred_scores = _pad(scores, (), float("-inf"))
+        pred_boxes = _pad(boxes, (4,), 0.0)
+        pred_classes = _pad(classes, (), -1)
+        gt_boxes = _pad([target["boxes"].float().cpu() for target in targets], (4,), 0.0)
+        gt_classes = _pad([target["classes"].long().cpu() for target in targets], (), -2)
+
+        # pairs of different classes (and padding) never match
+        iou = box_iou(pred_boxes, gt_boxes)
+        iou = iou.masked_fill(pred_classes.unsqueeze(2) != gt_classes.unsqueeze(1), -1.0)
+        matches = self.matcher(iou, self.iou_thresholds)
+
+        valid = pred_classes >= 0
+        self._scores.append(pred_scores[valid])
+        self._classes.append(pred_classes[valid])
+        self._true_positives.append((matches >= 0)[:, valid].T)
+        valid_gt = gt_classes[gt_classes >= 0]
+        self.num_gt += torch.bincount(valid_gt[valid_gt < self.num_classes], minlength=self.num_classes)
+        self.num_images += len(predictions)
+
+    def _class_curves(self, class_id:int):
+        """(precision [T, N], recall [T, N]) of a class, its detections sorted by decreasing score"""
+        scores = torch.cat(self._scores) if self._scores else torch.zeros(0)
+        classes = torch.cat(self._classes) if self._classes else torch.zeros(0, dtype=torch.int64)
+        true_positives = torch.cat(self._true_positives) if self._true_positives \
+            else torch.zeros((0, len(self.iou_thresholds)), dtype=torch.bool)
+        of_class = classes == class_id
+        order = torch.argsort(scores[of_class], descending=True, stable=True)
+        return precision_recall(true_positives[of_class][order].T, int(self.num_gt[class_id]))
+
+    def pr_curve(self, class_id:int, iou_threshold:float=0.5):
+        """Precision and recall [N] of a class at one of the IoU thresholds, for plotting"""
+        t = int(torch.argmin((self.iou_thresholds - iou_threshold).abs()))
+        precision, recall = self._class_curves(class_id)
+        return precision[t], recall[t]
+
+    def compute(self) -> Dict[str, object]:
+        """
+        :return: dict with map (mean AP over the IoU thresholds and the classes with ground truth), map_50, map_75,
+            recall (best recall averaged the same way), ap_per_class [K] and the number of images and boxes
+        """
+        thresholds = len(self.iou_thresholds)
+        ap = torch.full((self.num_classes, thresholds), float("nan"), dtype=torch.float64)
+        recall = torch.full((self.num_classes, thresholds), float("nan"), dtype=torch.float64)
+        for class_id in range(self.num_classes):
+            # classes without ground truth are left out of the means, as in COCO
+            if self.num_gt[class_id] == 0:
+                continue
+            class_precision, class_recall = self._class_curves(class_id)
+            ap[class_id] = average_precision(class_precision, class_recall)
+            recall[class_id] = class_recall[:, -1] if class_recall.shape[1] else 0.0
+
+        def at(iou_threshold):
+            t = torch.isclose(self.iou_thresholds, torch.tensor(iou_threshold, dtype=torch.float64))
+            return float(torch.nanmean(ap[:, t])) if bool(t.any()) else float("nan")
+
+        return {"map": float(torch.nanmean(ap)), "map_50": at(0.5), "map_75": at(0.75),
+                "recall": float(torch.nanmean(recall)), "ap_per_class": torch.nanmean(ap, dim=1).tolist(),
+                "images": self.num_images, "gt_boxes": int(self.num_gt.sum())}
@@ -0,0 +1,110 @@
+import os
+import time
+import resource
+import threading
+from typing import Optional
+
+import torch
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    """Resident memory of the process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # no procfs, the lifetime peak is the best we have (kB on linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def _kernel_peak_rss() -> Optional[int]:
+    """Peak resident memory tracked by the kernel (VmHWM) in bytes, None when not available"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_kernel_peak_rss() -> bool:
+    # writing 5 to clear_refs resets VmHWM to the current RSS (linux >= 4.0)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class PeakMemoryMonitor:
+    """
+    Peak resident memory of the process over a block of code, eg. a training configuration:
+
+        with PeakMemoryMonitor() as monitor:
+            train(...)
+        print(monitor.summary())
+
+    Uses the peak tracked by the kernel when it can be reset, otherwise samples the RSS
+    from a background thread every interval seconds. CUDA peaks are reported too when CUDA is used.
+    """
+
+    def __init__(self, interval:float=0.05):
+        self.interval = interval
+        self.start_rss = 0
+        self.peak_rss = 0
+        self.seconds = 0.0
+        self.cuda_peak = None
+        self._use_kernel = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self) -> None:
+        self.start_rss = self.peak_rss = current_rss()
+        self._start_time = time.perf_counter()
+        self._use_kernel = _reset_kernel_peak_rss() and _kernel_peak_rss() is not None
+        if not self._use_kernel:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.reset_peak_memory_stats()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def update(self) -> int:
+        """Peak so far, can be called while the monitor runs"""
+        rss = _kernel_peak_rss() if self._use_kernel else current_rss()
+        self.peak_rss = max(self.peak_rss, rss)
+        return self.peak_rss
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.update()
+        self.seconds = time.perf_counter() - self._start_time
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            self.cuda_peak = torch.cuda.max_memory_allocated()
+
+    def summary(self) -> dict:
+        summary = {"peak_rss_mb": self.peak_rss / 2**20, "start_rss_mb": self.start_rss / 2**20,
+                   "seconds": self.seconds}
+        if self.cuda_peak is not None:
+            summary["cuda_peak_mb"] = self.cuda_peak / 2**20
+        return summary
@@ -0,0 +1,423 @@
+import json
+import time
+import struct
+import asyncio
+import inspect
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from src.models.detection import decode_detections
+
+# every message: json header length and payload length, the json header, then the arrays back to back
+_PREFIX = struct.Struct(">II")
+
+
+def send_message(writer:asyncio.StreamWriter, header:dict, arrays:Sequence[np.ndarray]=()) -> None:
+    """
+    Queues a message on the stream, the arrays are described in the header (shape, dtype) and sent raw
+    Everything is written before the caller yields, so messages of concurrent tasks never interleave
+    """
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    header = {**header, "arrays": [{"shape": list(array.shape), "dtype": array.dtype.str} for array in arrays]}
+    encoded = json.dumps(header).encode()
+    writer.write(_PREFIX.pack(len(encoded), sum(array.nbytes for array in arrays)) + encoded)
+    for array in arrays:
+        writer.write(memoryview(array).cast("B"))
+
+
+async def receive_message(reader:asyncio.StreamReader) -> Tuple[dict, List[np.ndarray]]:
+    """
+    :return: header and arrays of the next message, asyncio.IncompleteReadError when the stream is closed
+    """
+    header_size, payload_size = _PREFIX.unpack(await reader.readexactly(_PREFIX.size))
+    header = json.loads(await reader.readexactly(header_size))
+    payload = bytearray(await reader.readexactly(payload_size)) if payload_size else bytearray()
+    arrays, offset = [], 0
+    for spec in header.pop("arrays", []):
+        dtype, shape = np.dtype(spec["dtype"]), spec["shape"]
+        count = int(np.prod(shape, dtype=np.int64))
+        arrays.append(np.frombuffer(payload, dtype, count, offset).reshape(shape))
+        offset += count * dtype.itemsize
+    return header, arrays
+
+
+def latency_summary(latencies:Sequence[float]) -> dict:
+    """p50/p90/p99/max of latencies in seconds, in ms"""
+    if len(latencies) == 0:
+        return {"p50_ms": float("nan"), "p90_ms": float("nan"), "p99_ms": float("nan"), "max_ms": float("nan")}
+    p50, p90, p99 = np.percentile(np.asarray(latencies) * 1e3, [50, 90, 99])
+    return {"p50_ms": float(p50), "p90_ms": float(p90), "p99_ms": float(p99), "max_ms": float(max(latencies)) * 1e3}
+
+
+def accepts_state(model:torch.nn.Module) -> bool:
+    """Whether the model carries its state across calls as SpikingDetector (state=..., return_state=True)"""
+    try:
+        parameters = inspect.signature(model.forward).parameters
+    except (TypeError, ValueError):
+        # TorchScript methods have no python signature
+        return False
+    return "state" in parameters and "return_state" in parameters
+
+
+class ServerStats:
+    """Counters of the server, the latencies and throughput over the last window requests"""
+
+    def __init__(self, window:int=10000):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self._finished = deque(maxlen=window)        # (finish time, latency) of every request
+        self._batch_sizes = deque(maxlen=window)
+        self._compute = deque(maxlen=window)         # forward time of every batch
+
+    def record_batch(self, size:int, seconds:float) -> None:
+        self.batches += 1
+        self._batch_sizes.append(size)
+        self._compute.append(seconds)
+
+    def record_request(self, latency:float, error:bool=False) -> None:
+        self.requests += 1
+        self.errors += error
+        self._finished.append((time.perf_counter(), latency))
+
+    def snapshot(self) -> dict:
+        finished = list(self._finished)
+        # throughput between the first and last request of the window, not diluted by idle time
+        span = finished[-1][0] - finished[0][0] if len(finished) > 1 else 0.0
+        return {"uptime_s": time.perf_counter() - self.started, "requests": self.requests, "batches": self.batches,
+                "errors": self.errors, "requests_per_s": (len(finished) - 1) / span if span > 0 else 0.0,
+                "mean_batch": float(np.mean(self._batch_sizes)) if self._batch_sizes else 0.0,
+                **latency_summary([latency for _, latency in finished]),
+                "compute_p50_ms": latency_summary(self._compute)["p50_ms"]}
+
+
+class _Request(NamedTuple):
+    """One sample waiting for a batch, or a reset of its stream (x is None)"""
+    x: Optional[np.ndarray]
+    stream: Optional[str]        # None for stateless models
+    reset: bool                  # start the stream at rest
+    decode: bool
+    arrival: float
+    future: asyncio.Future
+
+
+class InferenceServer:
+    """
+    Local inference service of a checkpoint, over a Unix or TCP socket (see send_message for the protocol)
+    Samples (a frame [C, H, W] or an EB group [T, C, H, W]) are micro-batched: a batch is run when it is full or
+    when its oldest request has waited max_delay_ms, the model runs in a worker thread so requests keep coming in
+    while it computes. Models with a state (SpikingDetector) keep the membranes of every stream across calls,
+    the states of the streams of a batch are stacked along the batch dimension.
+
+    Requests are json headers with an op:
+        infer: one sample array, stream (state key), reset (start the stream at rest), decode (detections
+            instead of the raw heatmaps), answered with the outputs of the sample
+        reset: drops the state of a stream, after the requests of the stream received before it
+        stats: counters and latencies (see ServerStats.snapshot)
+    Every answer repeats the id of its request, so clients may pipeline them.
+    """
+
+    def __init__(self, model:torch.nn.Module, device:str="cpu", max_batch:int=16, max_delay_ms:float=5.0,
+                 max_streams:int=1024, window:int=10000):
+        """
+        :param model: model in eval mode, see src/models/checkpoint.py
+        :param device: device of the model
+        :param max_batch: most samples per forward pass
+        :param max_delay_ms: longest wait of a request for more requests to batch with
+        :param max_streams: states kept, the least recently used stream is dropped beyond
+        :param window: requests of the latency and throughput statistics
+        """
+        self.model = model
+        self.device = device
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1e3
+        self.max_streams = max_streams
+        self.stateful = accepts_state(model)
+        self.batch_first = getattr(model, "batch_first", True)
+        self.states: "OrderedDict[str, List[torch.Tensor]]" = OrderedDict()
+        self.stats = ServerStats(window)
+        # a single thread, forward passes never overlap
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, path:Optional[str]=None, host:str="127.0.0.1", port:int=0) -> asyncio.AbstractServer:
+        """Listens on the Unix socket path, or on host:port (port 0 picks a free one, see address)"""
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.get_running_loop().create_task(self._batch_loop())
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    @property
+    def address(self):
+        return self._server.sockets[0].getsockname() if self._server is not None else None
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._batcher is not None:
+            self._batcher.cancel()
+        self._executor.shutdown(wait=True)
+
+    async def _handle(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        tasks = set()
+        try:
+            while True:
+                header, arrays = await receive_message(reader)
+                op = header.get("op", "infer")
+                if op in ("infer", "reset"):
+                    handler = self._infer if op == "infer" else self._reset
+                    task = asyncio.get_running_loop().create_task(handler(header, arrays, writer))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                elif op == "stats":
+                    send_message(writer, {"id": header.get("id"), "stats": {**self.stats.snapshot(),
+                                                                             "streams": len(self.states)}})
+                else:
+                    send_message(writer, {"id": header.get("id"), "error": f"unknown op {op}"})
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def _infer(self, header:dict, arrays:List[np.ndarray], writer:asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        arrival = loop.time()
+        future = loop.create_future()
+        if len(arrays) != 1:
+            future.set_exception(ValueError(f"infer takes one array, got {len(arrays)}"))
+        else:
+            stream = str(header.get("stream", "default")) if self.stateful else None
+            self._queue.put_nowait(_Request(arrays[0], stream, bool(header.get("reset", False)),
+                                            bool(header.get("decode", False)), arrival, future))
+        try:
+            names, outputs = await future
+            response = {"id": header.get("id"), "outputs": names}
+        except Exception as e:
+            names, outputs, response = [], [], {"id": header.get("id"), "error": f"{type(e).__name__}: {e}"}
+        latency = loop.time() - arrival
+        self.stats.record_request(latency, "error" in response)
+        send_message(writer, {**response, "latency_ms": latency * 1e3}, outputs)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _reset(self, header:dict, arrays:List[np.ndarray], writer:asyncio.StreamWriter) -> None:
+        # queued as the samples, a state written back by a batch already waiting or running would undo it
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put_nowait(_Request(None, str(header.get("stream")), True, False, loop.time(), future))
+        await future
+        send_message(writer, {"id": header.get("id")})
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        while True:
+            if not pending:
+                pending.append(await self._queue.get())
+            # waits for more requests until the batch is full or the oldest request is due
+            while len(pending) < self.max_batch:
+                timeout = pending[0].arrival + self.max_delay - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            batch, pending = self._take(pending)
+            for request in batch:
+                if request.x is None:
+                    self.states.pop(request.stream, None)
+                    request.future.set_result(None)
+            batch = [request for request in batch if request.x is not None]
+            if not batch:
+                continue
+            state = self._gather_state(batch) if self.stateful else None
+            start_time = time.perf_counter()
+            try:
+                outputs, state = await loop.run_in_executor(self._executor, self._run, batch, state)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            self.stats.record_batch(len(batch), time.perf_counter() - start_time)
+            if state is not None:
+                self._scatter_state(batch, state)
+            for request, output in zip(batch, outputs):
+                if not request.future.done():
+                    request.future.set_result(output)
+
+    def _take(self, pending:deque) -> Tuple[List[_Request], deque]:
+        """
+        Requests of the next batch, in arrival order: the shape of the oldest one, at most one per stream
+        (its state is the output of the previous one) and never ahead of a left out request of its stream.
+        The resets taken along are applied before the batch runs, so none may follow a request of its stream.
+        """
+        first = next((request for request in pending if request.x is not None), None)
+        key = (first.x.shape, first.x.dtype) if first is not None else None
+        batch, rest, streams, blocked = [], deque(), set(), set()
+        size = 0
+        for request in pending:
+            if request.x is None:
+                fits = request.stream not in streams and request.stream not in blocked
+            else:
+                fits = size < self.max_batch and (request.x.shape, request.x.dtype) == key
+                if request.stream is not None:
+                    fits = fits and request.stream not in streams and request.stream not in blocked
+            if fits:
+                batch.append(request)
+                if request.x is not None:
+                    streams.add(request.stream)
+                    size += 1
+            else:
+                rest.append(request)
+                blocked.add(request.stream)
+        return batch, rest
+
+    def _gather_state(self, batch:List[_Request]) -> Optional[List[torch.Tensor]]:
+        """States of the streams stacked along the batch, streams at rest get zeros, None when all are at rest"""
+        states = [None if request.reset else self.states.get(request.stream) for request in batch]
+        known = next((state for state in states if state is not None), None)
+        if known is None:
+            return None
+        return [torch.cat([state[i] if state is not None else torch.zeros_like(known[i]) for state in states])
+                for i in range(len(known))]
+
+    def _scatter_state(self, batch:List[_Request], state:List[torch.Tensor]) -> None:
+        for b, request in enumerate(batch):
+            # cloned, a view would keep the whole batch alive
+            self.states[request.stream] = [mem[b:b + 1].clone() for mem in state]
+            self.states.move_to_end(request.stream)
+        while len(self.states) > self.max_streams:
+            self.states.popitem(last=False)
+
+    @torch.inference_mode()
+    def _run(self, batch:List[_Request], state:Optional[List[torch.Tensor]]):
+        """Forward pass of a batch, returns the (names, arrays) of every sample and the new state"""
+        x = torch.from_numpy(np.stack([request.x for request in batch])).to(self.device)
+        if x.dtype == torch.uint8:
+            x = x.float().div_(255.0)
+        if self.stateful:
+            if not self.batch_first:
+                x = x.transpose(0, 1)
+            if state is not None:
+                state = [mem.to(self.device) for mem in state]
+            outputs, state = self.model(x, state, return_state=True)
+        else:
+            outputs = self.model(x)
+        if isinstance(outputs, dict):
+            names, tensors = list(outputs), list(outputs.values())
+        else:
+            tensors = list(outputs) if isinstance(outputs, (list, tuple)) else [outputs]
+            names = [f"output{i}" for i in range(len(tensors))]
+
+        results = [None] * len(batch)
+        decoded = [b for b, request in enumerate(batch) if request.decode]
+        if decoded and {"heatmap", "size", "offset"} <= set(names):
+            stride = getattr(self.model, "stride", None) or round(x.shape[-2] / outputs["heatmap"].shape[-2])
+            index = torch.as_tensor(decoded, device=outputs["heatmap"].device)
+            detections = decode_detections(*(outputs[name][index].float() for name in ("heatmap", "size", "offset")),
+                                           stride)
+            for b, sample in zip(decoded, detections):
+                results[b] = (["boxes", "scores", "classes"],
+                              [sample[name].cpu().numpy() for name in ("boxes", "scores", "classes")])
+        tensors = [tensor.float().cpu() for tensor in tensors]
+        for b in range(len(batch)):
+            if results[b] is None:
+                results[b] = (names, [tensor[b].numpy() for tensor in tensors])
+        return results, [mem.cpu() for mem in state] if self.stateful else None
+
+
+class InferenceClient:
+    """Client of an InferenceServer, requests may be pipelined from several tasks"""
+
+    def __init__(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        self._reader, self._writer = reader, writer
+        self._next_id = 0
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._receiver = asyncio.get_running_loop().create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, path:Optional[str]=None, host:str="127.0.0.1", port:int=0) -> "InferenceClient":
+        """Connects to the Unix socket path, or to host:port"""
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def _receive(self) -> None:
+        try:
+            while True:
+                header, arrays = await receive_message(self._reader)
+                future = self._waiting.pop(header.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result((header, arrays))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"connection to the server lost: {e}"))
+            self._waiting.clear()
+
+    async def _request(self, header:dict, arrays:Sequence[np.ndarray]=()) -> Tuple[dict, List[np.ndarray]]:
+        if self._receiver.done():
+            raise ConnectionError("connection to the server lost")
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[self._next_id] = future
+        send_message(self._writer, {**header, "id": self._next_id}, arrays)
+        await self._writer.drain()
+        header, arrays = await future
+        if "error" in header:
+            raise RuntimeError(f"server error: {header['error']}")
+        return header, arrays
+
+    async def infer(self, x:np.ndarray, stream:str="default", reset:bool=False,
+                    decode:bool=False) -> Tuple[Dict[str, np.ndarray], float]:
+        """
+        :param x: uint8 (scaled to [0, 1] by the server) or float frame [C, H, W] or group [T, C, H, W]
+        :param stream: key of the state, calls of a stream must be awaited in order
+        :param reset: start the stream at rest
+        :param decode: detections (boxes, scores, classes) instead of the raw detection head outputs
+
+        :return: outputs by name, and the server side latency in ms
+        """
+        header, arrays = await self._request({"op": "infer", "stream": stream, "reset": reset, "decode": decode}, [x])
+        return dict(zip(header["outputs"], arrays)), header["latency_ms"]
+
+    async def reset(self, stream:str="default") -> None:
+        await self._request({"op": "reset", "stream": stream})
+
+    async def stats(self) -> dict:
+        header, _ = await self._request({"op": "stats"})
+        return header["stats"]
+
+    async def close(self) -> None:
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        self._receiver.cancel()
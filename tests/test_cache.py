@@ -0,0 +1,48 @@
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from src.data.cache import SharedFrameCache
+
+SHAPE = (1, 8, 8)
+
+
+def frame(key:int) -> torch.Tensor:
+    return torch.full(SHAPE, key, dtype=torch.uint8)
+
+
+class CachedFrames(Dataset):
+    """Frames decoded through the cache, as TUMTraf does"""
+
+    def __init__(self, cache:SharedFrameCache, size:int):
+        self.cache = cache
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.cache.get_or_load(index, lambda: frame(index))
+
+
+def test_cache_is_shared_by_the_dataloader_workers():
+    cache = SharedFrameCache(16 * 64, SHAPE)
+    loader = DataLoader(CachedFrames(cache, 16), batch_size=4, num_workers=2)
+    for _ in range(2):
+        frames = torch.cat(list(loader))
+        assert torch.equal(frames, torch.stack([frame(key) for key in range(16)]))
+    # the second epoch only reads frames the workers of the first one stored
+    stats = cache.stats()
+    assert stats["misses"] == 16 and stats["hits"] == 16 and stats["size"] == 16
+    cache.close()
+
+
+def test_least_recently_used_frame_is_evicted():
+    cache = SharedFrameCache(2 * 64, SHAPE)
+    cache.put(0, frame(0))
+    cache.put(1, frame(1))
+    assert cache.get(0) is not None
+    cache.put(2, frame(2))
+    assert cache.get(1) is None
+    assert torch.equal(cache.get(0), frame(0)) and torch.equal(cache.get(2), frame(2))
+    cache.close()
+
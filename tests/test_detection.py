@@ -0,0 +1,32 @@
+import torch
+
+from src.models.detection import CenterNetHead, centernet_loss, encode_targets
+
+
+def padded_boxes(mask:torch.Tensor):
+    boxes = torch.tensor([[40.0, 24.0, 16.0, 12.0], [10.0, 50.0, 8.0, 8.0]]).expand(mask.shape[0], 2, 4)
+    classes = torch.tensor([1, 2]).expand(mask.shape[0], 2)
+    return boxes, classes, mask
+
+
+def test_encode_targets_places_the_valid_boxes():
+    boxes, classes, mask = padded_boxes(torch.tensor([[True, False], [True, True]]))
+    targets = encode_targets(boxes, classes, mask, num_classes=3, feature_shape=(16, 16), stride=4)
+    assert targets["heatmap"].shape == (2, 3, 16, 16)
+    assert targets["batch"].tolist() == [0, 1, 1]
+    assert targets["cell"].tolist() == [6 * 16 + 10, 6 * 16 + 10, 12 * 16 + 2]
+    assert targets["heatmap"][0, 1, 6, 10] == 1 and targets["heatmap"][1, 2, 12, 2] == 1
+    assert targets["heatmap"][0, 2].max() == 0
+
+
+def test_encode_targets_of_a_batch_without_boxes():
+    boxes, classes, mask = padded_boxes(torch.zeros(2, 2, dtype=torch.bool))
+    targets = encode_targets(boxes, classes, mask, num_classes=3, feature_shape=(16, 16), stride=4)
+    assert targets["heatmap"].shape == (2, 3, 16, 16) and not targets["heatmap"].any()
+    assert len(targets["batch"]) == len(targets["cell"]) == 0
+    assert targets["size"].shape == targets["offset"].shape == (0, 2)
+
+    outputs = CenterNetHead(8, 3)(torch.rand(2, 8, 16, 16))
+    losses = centernet_loss(outputs, targets)
+    assert torch.isfinite(losses["loss"])
+    losses["loss"].backward()
@@ -0,0 +1,33 @@
+import torch
+
+from src.data.encoding import ENCODINGS, SpikeEncoder
+
+
+def frames(seed:int=0) -> torch.Tensor:
+    return torch.randint(0, 256, (4, 1, 16, 16), dtype=torch.uint8, generator=torch.Generator().manual_seed(seed))
+
+
+def test_cache_round_trip(tmp_path):
+    for method in ENCODINGS:
+        encoder = SpikeEncoder(method, seed=3, cache_dir=tmp_path)
+        encoded = encoder(frames(), key="train/eb/0001")
+        assert encoder._cache_path("train/eb/0001").exists()
+        # loaded from the cache, by the same or a new encoder with the same config
+        assert torch.equal(encoder(frames(), key="train/eb/0001"), encoded)
+        assert torch.equal(SpikeEncoder(method, seed=3, cache_dir=tmp_path)(frames(), key="train/eb/0001"), encoded)
+        assert torch.equal(encoder.encode(frames(), key="train/eb/0001"), encoded)
+
+
+def test_stochastic_encodings_are_seeded_by_key():
+    encoder = SpikeEncoder("rate", seed=1, num_steps=2)
+    assert torch.equal(encoder(frames(), key="a"), encoder(frames(), key="a"))
+    assert not torch.equal(encoder(frames(), key="a"), encoder(frames(), key="b"))
+
+
+def test_rewritten_frames_are_encoded_again(tmp_path):
+    encoder = SpikeEncoder("delta", cache_dir=tmp_path, threshold=0.1)
+    encoder(frames(0), key="0001")
+    # the group was rewritten by the preprocessing under the same key
+    assert torch.equal(encoder(frames(1), key="0001"), encoder.encode(frames(1)))
+    assert torch.equal(encoder(frames(1), key="0001"), encoder.encode(frames(1)))
+    assert not list(tmp_path.rglob("*.tmp.npz"))
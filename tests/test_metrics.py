@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+import torch
+
+from src.utils.metrics import COCO_IOU_THRESHOLDS, DetectionAccumulator, box_iou
+
+
+def coco_reference(predictions, targets, num_classes:int):
+    """
+    COCOeval (iouType bbox, area all, maxDets 100) written out per image, class and threshold as pycocotools does:
+    evaluateImg matches the detections in score order, accumulate samples the precision envelope at 101 recalls
+    """
+    rec_thrs = np.linspace(0.0, 1.0, 101)
+    ap = np.full((num_classes, len(COCO_IOU_THRESHOLDS)), -1.0)
+    recall = np.full_like(ap, -1.0)
+    for k in range(num_classes):
+        for t, threshold in enumerate(COCO_IOU_THRESHOLDS.tolist()):
+            scores, matched, num_gt = [], [], 0
+            for prediction, target in zip(predictions, targets):
+                dets = (prediction["classes"] == k).nonzero().flatten()
+                dets = dets[np.argsort(-prediction["scores"][dets].numpy(), kind="mergesort")]
+                gts = (target["classes"] == k).nonzero().flatten()
+                num_gt += len(gts)
+                ious = box_iou(prediction["boxes"][dets], target["boxes"][gts]).numpy()
+                taken = set()
+                for d in range(len(dets)):
+                    best, m = min(threshold, 1 - 1e-10), -1
+                    for g in range(len(gts)):
+                        if g in taken or ious[d, g] < best:
+                            continue
+                        best, m = ious[d, g], g
+                    if m >= 0:
+                        taken.add(m)
+                    matched.append(m >= 0)
+                    scores.append(float(prediction["scores"][dets[d]]))
+            if num_gt == 0:
+                continue
+            order = np.argsort(-np.asarray(scores), kind="mergesort")
+            tp = np.cumsum(np.asarray(matched, dtype=float)[order])
+            fp = np.cumsum(1 - np.asarray(matched, dtype=float)[order])
+            rc = tp / num_gt
+            pr = list(tp / np.maximum(tp + fp, np.spacing(1)))
+            recall[k, t] = rc[-1] if len(rc) else 0
+            for i in range(len(pr) - 1, 0, -1):
+                pr[i - 1] = max(pr[i - 1], pr[i])
+            q = np.zeros(len(rec_thrs))
+            for ri, pi in enumerate(np.searchsorted(rc, rec_thrs, side="left")):
+                if pi < len(pr):
+                    q[ri] = pr[pi]
+            ap[k, t] = q.mean()
+    valid = ap > -1
+    return {"map": ap[valid].mean(), "map_50": ap[:, 0][valid[:, 0]].mean(), "map_75": ap[:, 5][valid[:, 5]].mean(),
+            "recall": recall[valid].mean()}
+
+
+def fixture(seed:int, images:int=6, num_classes:int=3):
+    """jittered copies of the ground truth, a few misses, duplicates and spurious boxes, class 2 has no ground truth"""
+    gen = torch.Generator().manual_seed(seed)
+    predictions, targets = [], []
+    for _ in range(images):
+        count = int(torch.randint(0, 6, (1,), generator=gen))
+        gt_boxes = torch.cat([torch.rand(count, 2, generator=gen) * 200, 10 + torch.rand(count, 2, generator=gen) * 40], 1)
+        gt_classes = torch.randint(0, num_classes - 1, (count,), generator=gen)
+        kept = torch.rand(count, generator=gen) > 0.2
+        duplicates = torch.rand(count, generator=gen) < 0.3
+        boxes = torch.cat([gt_boxes[kept], gt_boxes[duplicates],
+                           torch.cat([torch.rand(2, 2, generator=gen) * 200, 10 + torch.rand(2, 2, generator=gen) * 40], 1)])
+        boxes = boxes + torch.randn(boxes.shape, generator=gen) * 3
+        classes = torch.cat([gt_classes[kept], gt_classes[duplicates], torch.randint(0, num_classes, (2,), generator=gen)])
+        predictions.append({"boxes": boxes, "scores": torch.rand(len(boxes), generator=gen), "classes": classes})
+        targets.append({"boxes": gt_boxes, "classes": gt_classes})
+    return predictions, targets
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_accumulator_matches_coco(seed):
+    predictions, targets = fixture(seed)
+    accumulator = DetectionAccumulator(num_classes=3)
+    # streamed in uneven batches, the result does not depend on them
+    for start, end in [(0, 1), (1, 4), (4, 6)]:
+        accumulator.update(predictions[start:end], targets[start:end])
+    metrics = accumulator.compute()
+    expected = coco_reference(predictions, targets, num_classes=3)
+    for name, value in expected.items():
+        assert metrics[name] == pytest.approx(value, abs=1e-9), name
+    assert metrics["gt_boxes"] == sum(len(target["classes"]) for target in targets)
+
+
+def test_hand_computed_ap():
+    # class 0: a hit (0.9), a false positive (0.8) and a hit (0.7) on 2 boxes, precision 1, 1/2, 2/3
+    # the envelope is 1 up to recall 0.5 and 2/3 after it: (51 + 50 * 2/3) / 101
+    target = {"boxes": torch.tensor([[10.0, 10.0, 10.0, 10.0], [50.0, 50.0, 10.0, 10.0]]), "classes": torch.tensor([0, 0])}
+    prediction = {"boxes": torch.tensor([[10.0, 10.0, 10.0, 10.0], [90.0, 90.0, 10.0, 10.0], [50.0, 50.0, 10.0, 10.0]]),
+                  "scores": torch.tensor([0.9, 0.8, 0.7]), "classes": torch.tensor([0, 0, 0])}
+    accumulator = DetectionAccumulator(num_classes=2)
+    accumulator.update([prediction], [target])
+    metrics = accumulator.compute()
+    assert metrics["map"] == pytest.approx((51 + 50 * 2 / 3) / 101)
+    assert metrics["recall"] == 1.0
+    assert np.isnan(metrics["ap_per_class"][1])
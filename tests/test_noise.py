@@ -0,0 +1,42 @@
+import pytest
+import torch
+
+from src.data.noise import SEVERITIES, Compose, build_noise, uniform
+
+
+def sequences(batch:int=6) -> torch.Tensor:
+    return torch.randint(0, 256, (batch, 4, 1, 24, 32), dtype=torch.uint8, generator=torch.Generator().manual_seed(0))
+
+
+@pytest.mark.parametrize("name", list(SEVERITIES))
+def test_noise_does_not_depend_on_the_batch(name):
+    noise = build_noise(name, 3, seed=5)
+    x = sequences()
+    seeds = torch.arange(100, 106)
+    whole = noise(x, seeds=seeds)
+    assert whole.shape == x.shape and whole.dtype == x.dtype
+    # every sample alone, and the batch in another order
+    single = torch.cat([noise(x[i:i + 1], seeds=seeds[i:i + 1]) for i in range(len(x))])
+    order = torch.randperm(len(x), generator=torch.Generator().manual_seed(1))
+    assert torch.equal(whole, single)
+    assert torch.equal(whole[order], noise(x[order], seeds=seeds[order]))
+
+
+@pytest.mark.parametrize("name", list(SEVERITIES))
+def test_same_seed_same_noise(name):
+    x = sequences()
+    assert torch.equal(build_noise(name, 5, seed=2)(x), build_noise(name, 5, seed=2)(x))
+    assert not torch.equal(build_noise(name, 5, seed=2)(x), build_noise(name, 5, seed=3)(x))
+
+
+def test_float_frames_keep_their_range():
+    x = sequences().float() / 255.0
+    out = Compose([build_noise("gaussian", 5), build_noise("shot", 5)])(x)
+    assert out.dtype == torch.float32 and out.min() >= 0.0 and out.max() <= 1.0
+
+
+def test_uniform_streams():
+    u = uniform(torch.arange(4), (10000,))
+    assert u.min() >= 0.0 and u.max() < 1.0 and abs(float(u.mean()) - 0.5) < 0.01
+    assert not torch.equal(u[0], u[1])
+    assert not torch.equal(uniform(torch.arange(4), (100,), stream=1), uniform(torch.arange(4), (100,), stream=0))
@@ -0,0 +1,88 @@
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from benchmarks.synthetic import generate_dataset
+from scripts import preprocess
+from src.data.dataset import TUMTraf
+from src.data.streaming import decode_stream_frame
+
+
+def preprocess_args(monkeypatch, data_path:Path, out_path:Path, *extra:str):
+    monkeypatch.setattr(sys, "argv", ["preprocess.py", "--data-path", str(data_path), "--out-path", str(out_path),
+                                      "--split", "train,val", "--eb", *extra])
+    return preprocess.parse_args()
+
+
+def output_times(path:Path) -> dict:
+    return {file: file.stat().st_mtime_ns for file in path.rglob("*") if file.is_file()}
+
+
+@pytest.fixture(scope="module")
+def raw(tmp_path_factory) -> Path:
+    path = tmp_path_factory.mktemp("raw")
+    generate_dataset(path, ["train", "val"], frames=12, rgb_size=(64, 40), max_objects=2)
+    return path
+
+
+def test_manifest_rebuilds_only_changed_entries(raw, tmp_path, monkeypatch, capsys):
+    out = tmp_path / "out"
+    args = preprocess_args(monkeypatch, raw, out)
+    preprocess.preprocess_data(args)
+    train, val = out / "train" / "images" / "eb_transformed", out / "val" / "images" / "eb_transformed"
+    before_train, before_val = output_times(train), output_times(val)
+    assert before_train and before_val
+
+    # nothing changed, nothing is written
+    preprocess.preprocess_data(args)
+    assert output_times(train) == before_train and output_times(val) == before_val
+    assert "train/eb_transformed is up to date" in capsys.readouterr().out
+
+    # one source frame of train changes, only train is rebuilt
+    frame = sorted((raw / "train" / "images" / "eb_transformed").glob("*.jpg"))[3]
+    cv2.imwrite(str(frame), np.full((480, 640, 3), 200, dtype=np.uint8))
+    preprocess.preprocess_data(args)
+    assert output_times(val) == before_val
+    after_train = output_times(train)
+    assert set(after_train) == set(before_train)
+    assert all(after_train[file] != before_train[file] for file in after_train)
+    manifest = preprocess.load_manifest(out)
+    assert set(manifest["entries"]) == {"train/eb_transformed", "val/eb_transformed"}
+
+
+def test_changed_parameters_rebuild(raw, tmp_path, monkeypatch):
+    out = tmp_path / "out"
+    preprocess.preprocess_data(preprocess_args(monkeypatch, raw, out, "--n_frames", "4"))
+    groups = sorted(path.name for path in (out / "val" / "images" / "eb_transformed").iterdir() if path.is_dir())
+    preprocess.preprocess_data(preprocess_args(monkeypatch, raw, out, "--n_frames", "6"))
+    regrouped = sorted(path.name for path in (out / "val" / "images" / "eb_transformed").iterdir() if path.is_dir())
+    # no group of the old grouping survives next to the new ones
+    assert len(groups) == 3 and len(regrouped) == 2
+
+
+def test_formats_give_the_same_frames(raw, tmp_path, monkeypatch):
+    frames = {}
+    for fmt in ("jpg", "packed", "sparse"):
+        out = tmp_path / fmt
+        preprocess.preprocess_data(preprocess_args(monkeypatch, raw, out, "--format", fmt))
+        dataset = TUMTraf(out / "val" / "images" / "eb_transformed", out / "val" / "OPENLabel_labels_eb", by_group=True)
+        items = [dataset[i]["frame"] for i in range(len(dataset))]
+        frames[fmt] = torch.cat([item.to_dense() if item.is_sparse else item for item in items])
+    assert torch.equal(frames["jpg"], frames["packed"])
+    assert torch.equal(frames["jpg"], frames["sparse"])
+
+
+def test_stream_frames_match_the_preprocessed_ones(raw, tmp_path, monkeypatch):
+    preprocess.preprocess_data(preprocess_args(monkeypatch, raw, tmp_path))
+    roi = preprocess.load_eb_roi(None)
+    written_frames = sorted((tmp_path / "val" / "images" / "eb_transformed").glob("*/*.jpg"))
+    assert written_frames
+    for written_frame in written_frames:
+        src_frame = raw / "val" / "images" / "eb_transformed" / written_frame.name
+        written = cv2.imread(str(written_frame), cv2.IMREAD_UNCHANGED)
+        assert np.array_equal(decode_stream_frame(src_frame, roi)[0], written)
+        assert np.array_equal(decode_stream_frame(src_frame, roi), preprocess.load_frame_array(src_frame, roi))
@@ -0,0 +1,99 @@
+import io
+
+import pytest
+import torch
+
+from src.models.snn import NEURONS, SpikingDetector, SpikingStream, make_neuron
+
+
+def detector(**kwargs) -> SpikingDetector:
+    torch.manual_seed(0)
+    return SpikingDetector(channels=(4, 8), num_classes=3, **kwargs).eval()
+
+
+def events(steps:int=6, batch:int=2) -> torch.Tensor:
+    return (torch.rand(steps, batch, 1, 32, 32, generator=torch.Generator().manual_seed(0)) < 0.3).float()
+
+
+@pytest.mark.parametrize("fused", [False, True])
+def test_state_continues_the_sequence(fused):
+    model, x = detector(fused=fused), events()
+    with torch.no_grad():
+        _, whole = model(x, return_state=True)
+        _, state = model(x[:2], return_state=True)
+        _, state = model(x[2:5], state, return_state=True)
+        _, state = model(x[5:], state, return_state=True)
+    for mem, expected in zip(state, whole):
+        assert torch.allclose(mem, expected, atol=1e-6)
+
+
+def test_fused_matches_time_folded():
+    x = events()
+    with torch.no_grad():
+        folded, fused = detector()(x), detector(fused=True)(x)
+    for name in folded:
+        assert torch.allclose(folded[name], fused[name], atol=1e-5)
+
+
+def test_batch_first_and_sparse_inputs():
+    x = events()
+    with torch.no_grad():
+        reference = detector()(x)
+        batch_first = detector(batch_first=True)(x.transpose(0, 1))
+        sparse = detector()(x.to_sparse())
+    for name in reference:
+        assert torch.allclose(reference[name], batch_first[name], atol=1e-5)
+        assert torch.allclose(reference[name], sparse[name], atol=1e-5)
+
+
+def test_forward_leaves_the_state_unchanged():
+    model, x = detector(), events()
+    with torch.no_grad():
+        _, state = model(x[:3], return_state=True)
+        kept = [mem.clone() for mem in state]
+        first = model(x[3:], state)
+        second = model(x[3:], state)
+    assert all(torch.equal(mem, copy) for mem, copy in zip(state, kept))
+    assert torch.equal(first["heatmap"], second["heatmap"])
+
+
+@pytest.mark.parametrize("backend", list(NEURONS))
+def test_backends_round_trip_through_torch_save(backend):
+    pytest.importorskip({"native": "torch", "snntorch": "snntorch", "norse": "norse"}[backend])
+    model, x = detector(backend=backend), events()
+    buffer = io.BytesIO()
+    torch.save(model, buffer)
+    buffer.seek(0)
+    loaded = torch.load(buffer, weights_only=False)
+    with torch.no_grad():
+        assert torch.equal(model(x)["heatmap"], loaded(x)["heatmap"])
+
+
+@pytest.mark.parametrize("backend", list(NEURONS))
+@pytest.mark.parametrize("beta", [1.0, 1.5, -0.1])
+def test_every_backend_rejects_beta_outside_the_unit_interval(backend, beta):
+    with pytest.raises(ValueError):
+        make_neuron(backend, beta=beta)
+
+
+def test_stream_matches_the_model_over_its_first_window():
+    model, x = detector(), events(steps=5)
+    stream = SpikingStream(model, window=5)
+    with torch.no_grad():
+        for t in range(len(x)):
+            outputs, expected = stream.step(x[t]), model(x[:t + 1])
+            for name in expected:
+                assert torch.allclose(outputs[name], expected[name], atol=1e-5)
+
+
+def test_stream_resumes_from_its_state():
+    model, x = detector(), events(steps=8)
+    stream = SpikingStream(model, window=3)
+    for t in range(5):
+        stream.step(x[t])
+    resumed = SpikingStream(model, window=3)
+    resumed.load_state_dict(stream.state_dict())
+    for t in range(5, 8):
+        assert torch.equal(stream.step(x[t])["heatmap"], resumed.step(x[t])["heatmap"])
+    with pytest.raises(ValueError):
+        SpikingStream(model, window=4).load_state_dict(stream.state_dict())
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from scripts.preprocess import group_frames
+from src.data.sequences import find_runs, find_windows
+from src.data.timestamps import STEM_FORMAT, parse_timestamps
+
+
+def random_stems(count:int, seed:int) -> list:
+    """sorted capture times, mostly 50-1100 ms apart with a few long gaps, across a day and a month boundary"""
+    rng = np.random.default_rng(seed)
+    gaps = rng.integers(50_000, 1_100_000, count)
+    gaps[rng.random(count) < 0.03] = 10**8
+    start = datetime(2023, 10, 31, 23, 58, 30)
+    return [(start + timedelta(microseconds=int(us))).strftime(STEM_FORMAT) for us in np.cumsum(gaps)]
+
+
+def strptime_group_frames(frame_files, n_frames:int, max_time_diff:int=1000):
+    """group_frames before it was vectorized (in UTC, the local timezone would only shift the stems)"""
+    grouped_frames = []
+    current_group = []
+    last_timestamp = None
+    for frame_file in frame_files:
+        timestamp = int(datetime.strptime(frame_file.stem, STEM_FORMAT).replace(tzinfo=timezone.utc).timestamp() * 1000)
+        if last_timestamp is None:
+            current_group.append(frame_file)
+        else:
+            time_diff = timestamp - last_timestamp
+            if time_diff <= max_time_diff and len(current_group) < n_frames:
+                current_group.append(frame_file)
+            else:
+                if len(current_group) == n_frames:
+                    grouped_frames.append(current_group)
+                current_group = [frame_file]
+        last_timestamp = timestamp
+    if len(current_group) == n_frames:
+        grouped_frames.append(current_group)
+    return grouped_frames
+
+
+def loop_find_windows(timestamps, seq_len:int, stride:int, min_seq_len:int, max_time_diff:int):
+    bounds = find_runs(timestamps, max_time_diff)
+    windows = []
+    for run_start, run_end in zip(bounds[:-1], bounds[1:]):
+        windows += [(start, min(seq_len, run_end - start)) for start in range(run_start, run_end - min_seq_len + 1, stride)]
+    return windows
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_parse_timestamps_matches_strptime(seed):
+    stems = random_stems(500, seed)
+    expected = [(datetime.strptime(stem, STEM_FORMAT) - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+                for stem in stems]
+    assert parse_timestamps(stems).tolist() == expected
+
+
+def test_malformed_stems_raise_as_strptime():
+    assert parse_timestamps(["20231114-084328.7395"]).tolist() == parse_timestamps(["20231114-084328.739500"]).tolist()
+    for stem in ["20231314-084328.739529", "20230230-084328.739529", "20231114_084328.739529"]:
+        with pytest.raises(ValueError):
+            parse_timestamps([stem])
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("n_frames,max_time_diff", [(1, 1000), (4, 1000), (8, 500)])
+def test_group_frames_matches_the_strptime_loop(seed, n_frames, max_time_diff):
+    frame_files = [Path(f"{stem}.jpg") for stem in random_stems(400, seed)]
+    assert group_frames(frame_files, n_frames, max_time_diff) == \
+        strptime_group_frames(frame_files, n_frames, max_time_diff)
+
+
+@pytest.mark.parametrize("seq_len,stride,min_seq_len", [(4, 1, 4), (8, 3, 2), (6, 6, 1), (5, 2, 5)])
+def test_find_windows_matches_the_run_loop(seq_len, stride, min_seq_len):
+    timestamps = parse_timestamps(random_stems(300, seed=seq_len))
+    starts, lengths = find_windows(timestamps, seq_len, stride, min_seq_len, max_time_diff=800)
+    assert list(zip(starts.tolist(), lengths.tolist())) == loop_find_windows(timestamps, seq_len, stride, min_seq_len, 800)
+
+
+def test_find_windows_without_frames():
+    starts, lengths = find_windows(np.empty(0, dtype=np.int64), 4)
+    assert len(starts) == len(lengths) == 0